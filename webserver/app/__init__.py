@@ -6,7 +6,10 @@ All general configs are taken care in here:
     - pre and post request handlers
 """
 import logging
-from flask import Flask
+import signal
+import sys
+import threading
+from flask import Flask, g
 from flask_swagger_ui import get_swaggerui_blueprint
 from sqlalchemy import exc
 from werkzeug.exceptions import NotFound
@@ -16,6 +19,7 @@ from app import (
     containers_api, registries_api, users_api
 )
 from app.helpers.base_model import build_sql_uri, db
+from app.helpers.task_reconciler import task_reconciler
 from app.helpers.exceptions import (
     InvalidDBEntry, DBError, DBRecordNotFoundError, InvalidRequest,
     AuthenticationError, UnauthorizedError, KeycloakError, TaskImageException,
@@ -81,4 +85,25 @@ def create_app():
     def shutdown_session(exception=None):
         db.session.remove()
 
+    @app.teardown_request
+    # pylint: disable=unused-argument
+    def clear_token_identity(exception=None):
+        g.pop("token_identity", None)
+
+    return app
+
+def create_server_app():
+    """
+    Server entrypoint. Other than the app, it starts the
+    background threads and handles the process' signals
+    """
+    app = create_app()
+
+    # Keeps the tasks' status in the DB in line with their pods
+    task_reconciler.start()
+
+    # Exit cleanly on SIGTERM, so the pending audit entries are written
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     return app
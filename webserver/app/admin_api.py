@@ -1,30 +1,31 @@
 """
 admin endpoints:
 - GET /audit
+- GET /metrics
 """
 
 from http import HTTPStatus
 from flask import Blueprint, request
 from kubernetes.client.exceptions import ApiException
-from sqlalchemy.orm import scoped_session, sessionmaker
 
-from .helpers.base_model import engine
+from .helpers.base_model import engine, replica_engine
 from .helpers.const import (
     TASK_CONTROLLER, CONTROLLER_NAMESPACE, GITHUB_DELIVERY, OTHER_DELIVERY
 )
+from .helpers.db_pool import get_pool_metrics
 from .helpers.exceptions import FeatureNotAvailableException, InvalidRequest
+from .helpers.keycloak import kc_session
 from .helpers.kubernetes import KubernetesClient
 from .helpers.query_filters import parse_query_params
-from .helpers.wrappers import audit, auth
+from .helpers.wrappers import audit, auth, read_replica
 from .models.audit import Audit
 
 
 bp = Blueprint('admin', __name__, url_prefix='/')
-session_factory = sessionmaker(bind=engine)
-session = scoped_session(session_factory)
 
 
 @bp.route('/audit', methods=['GET'])
+@read_replica
 @auth(scope='can_do_admin', check_dataset=False)
 def get_audit_logs():
     """
@@ -33,6 +34,24 @@ def get_audit_logs():
     """
     return parse_query_params(Audit, request.args.copy()), HTTPStatus.OK
 
+@bp.route('/metrics', methods=['GET'])
+@auth(scope='can_do_admin', check_dataset=False)
+def get_metrics():
+    """
+    GET /metrics endpoint.
+        Returns the DB connection pool usage, per engine,
+        and the Keycloak requests latency, per endpoint
+    """
+    with kc_session.stats_lock:
+        keycloak_stats = {endpoint: dict(stat) for endpoint, stat in kc_session.stats.items()}
+    db_pool = {"primary": get_pool_metrics(engine)}
+    if replica_engine is not None:
+        db_pool["replica"] = get_pool_metrics(replica_engine)
+    return {
+        "db_pool": db_pool,
+        "keycloak": keycloak_stats
+    }, HTTPStatus.OK
+
 @bp.route('/delivery-secret', methods=['PATCH'])
 @auth(scope='can_do_admin', check_dataset=False)
 @audit
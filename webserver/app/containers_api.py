@@ -14,7 +14,7 @@ from .helpers.query_filters import parse_query_params
 
 from .helpers.base_model import db
 from .helpers.exceptions import InvalidRequest
-from .helpers.wrappers import audit, auth
+from .helpers.wrappers import audit, auth, read_replica
 from .models.container import Container
 from .models.registry import Registry
 
@@ -28,6 +28,7 @@ session = db.session
 @bp.route('/', methods=['GET'])
 @bp.route('', methods=['GET'])
 @audit
+@read_replica
 def get_all_containers():
     """
     GET /containers endpoint.
@@ -69,6 +70,7 @@ def add_image():
 
 @bp.route('/<int:image_id>', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_admin_dataset')
 def get_image_by_id(image_id:int=None):
     """
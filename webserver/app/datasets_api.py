@@ -19,10 +19,11 @@ from kubernetes.client import ApiException
 from .helpers.base_model import db
 from .helpers.const import DEFAULT_NAMESPACE
 from .helpers.exceptions import DBRecordNotFoundError, InvalidRequest
-from .helpers.keycloak import Keycloak
+from .helpers.keycloak import Keycloak, TokenIdentity
+from .helpers.keycloak_async import AsyncKeycloak, run_sync
 from .helpers.kubernetes import KubernetesClient
 from .helpers.query_validator import validate
-from .helpers.wrappers import auth, audit
+from .helpers.wrappers import auth, audit, read_replica
 from .models.dataset import Dataset
 from .models.catalogue import Catalogue
 from .models.dictionary import Dictionary
@@ -38,6 +39,7 @@ logger.setLevel(logging.INFO)
 @bp.route('/', methods=['GET'])
 @bp.route('', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_access_dataset')
 def get_datasets():
     """
@@ -59,11 +61,9 @@ def post_datasets():
         dict_body = body.pop("dictionaries", [])
         dataset = Dataset(**body)
 
-        kc_client = Keycloak()
-        token_info = kc_client.decode_token(kc_client.get_token_from_headers())
         dataset.add(
             commit=False,
-            user_id=token_info['sub']
+            user_id=TokenIdentity.from_request().sub
         )
         if cata_body:
             cata_data = Catalogue.validate(cata_body)
@@ -89,6 +89,7 @@ def post_datasets():
 @bp.route('/<int:dataset_id>', methods=['GET'])
 @bp.route('/<dataset_name>', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_access_dataset')
 def get_datasets_by_id_or_name(dataset_id:int=None, dataset_name:str=None):
     """
@@ -160,16 +161,19 @@ def patch_datasets_by_id_or_name(dataset_id:int=None, dataset_name:str=None):
             dars = Request.query.with_entities(Request.requested_by, Request.project_name)\
                 .filter(Request.dataset_id == ds.id, Request.proj_end > datetime.now())\
                 .group_by(Request.requested_by, Request.project_name).all()
-            for dar in dars:
-                update_args = {
-                    "name": f"{ds.id}-{ds.name}",
-                    "displayName": f"{ds.id} - {ds.name}"
-                }
-
-                user = Keycloak().get_user_by_id(dar[0])
-                req_by = user["email"]
-                kc_client = Keycloak(client=f"Request {req_by} - {dar[1]}")
-                kc_client.patch_resource(f"{ds.id}-{old_ds_name}", **update_args)
+            update_args = {
+                "name": f"{ds.id}-{ds.name}",
+                "displayName": f"{ds.id} - {ds.name}"
+            }
+            global_kc_client = AsyncKeycloak(Keycloak())
+
+            async def patch_dar_resource(requested_by:str, project_name:str):
+                user = await global_kc_client.get_user_by_id(requested_by)
+                kc_client = await AsyncKeycloak.create(f"Request {user["email"]} - {project_name}")
+                await kc_client.patch_resource(f"{ds.id}-{old_ds_name}", **update_args)
+
+            # Each DAR has its own client, they can be updated concurrently
+            run_sync(*[patch_dar_resource(*dar) for dar in dars])
         # Update catalogue and dictionaries
         if cata_body:
             Catalogue.update_or_create(cata_body, ds)
@@ -186,6 +190,7 @@ def patch_datasets_by_id_or_name(dataset_id:int=None, dataset_name:str=None):
 @bp.route('/<dataset_name>/catalogue', methods=['GET'])
 @bp.route('/<int:dataset_id>/catalogue', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_access_dataset')
 def get_datasets_catalogue_by_id_or_name(dataset_id=None, dataset_name=None):
     """
@@ -202,6 +207,7 @@ def get_datasets_catalogue_by_id_or_name(dataset_id=None, dataset_name=None):
 @bp.route('/<dataset_name>/dictionaries', methods=['GET'])
 @bp.route('/<int:dataset_id>/dictionaries', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_access_dataset')
 def get_datasets_dictionaries_by_id_or_name(dataset_id=None, dataset_name=None):
     """
@@ -210,17 +216,21 @@ def get_datasets_dictionaries_by_id_or_name(dataset_id=None, dataset_name=None):
         Gets the dataset's list of dictionaries
     """
     dataset = Dataset.get_dataset_by_name_or_id(id=dataset_id, name=dataset_name)
+    fields = Dictionary.pop_fields(request.args.to_dict())
 
-    dictionary = Dictionary.query.filter(Dictionary.dataset_id == dataset.id).all()
+    dictionary = Dictionary.load_fields(
+        Dictionary.query.filter(Dictionary.dataset_id == dataset.id), fields
+    ).all()
     if not dictionary:
         raise DBRecordNotFoundError(f"Dataset {dataset.name} has no dictionaries.")
 
-    return [dc.sanitized_dict() for dc in dictionary], HTTPStatus.OK
+    return [dc.sanitized_dict(fields) for dc in dictionary], HTTPStatus.OK
 
 
 @bp.route('/<dataset_name>/dictionaries/<table_name>', methods=['GET'])
 @bp.route('/<int:dataset_id>/dictionaries/<table_name>', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_access_dataset')
 
 def get_datasets_dictionaries_table_by_id_or_name(table_name, dataset_id=None, dataset_name=None):
@@ -230,17 +240,18 @@ def get_datasets_dictionaries_table_by_id_or_name(table_name, dataset_id=None, d
         Gets the dataset's table within its dictionaries
     """
     dataset = Dataset.get_dataset_by_name_or_id(id=dataset_id, name=dataset_name)
+    fields = Dictionary.pop_fields(request.args.to_dict())
 
-    dictionary = Dictionary.query.filter(
+    dictionary = Dictionary.load_fields(Dictionary.query.filter(
         Dictionary.dataset_id == dataset.id,
         Dictionary.table_name == table_name
-    ).all()
+    ), fields).all()
     if not dictionary:
         raise DBRecordNotFoundError(
             f"Dataset {dataset.name} has no dictionaries with table {table_name}."
         )
 
-    return [dc.sanitized_dict() for dc in dictionary], HTTPStatus.OK
+    return [dc.sanitized_dict(fields) for dc in dictionary], HTTPStatus.OK
 
 @bp.route('/token_transfer', methods=['POST'])
 @audit
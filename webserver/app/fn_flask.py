@@ -1,20 +1,74 @@
 """
 A custom Flask wrapper to handle pagination globally
 """
-
+import json
+import re
+import orjson
 from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask.wrappers import Response
 from flask_sqlalchemy.pagination import QueryPagination
 
+from app.helpers.base_model import CursorPagination
+
+NON_ASCII_REGEX = re.compile(r'[^\x00-\x7f]')
+
+
+def escape_non_ascii(match:re.Match) -> str:
+    """
+    The character's \\uXXXX escape, as json.dumps does with ensure_ascii
+    """
+    return json.dumps(match.group())[1:-1]
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Encodes the responses with orjson, much faster on large lists.
+    Types orjson doesn't handle, and datetimes, go through
+    the default Flask conversions, and non-ASCII characters
+    are escaped, so the response bodies are the same
+    """
+    def dumps(self, obj, **kwargs) -> str:
+        """
+        Serializes obj with orjson, unless json.dumps
+        arguments are passed, which orjson doesn't support
+        """
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def response(self, *args, **kwargs) -> Response:
+        """
+        Same as the default provider's response, as used by jsonify
+        and when a view returns a dict or a list, encoded with orjson
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(self._orjson_dumps(obj, option), mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj, option:int=0) -> bytes:
+        option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        data = orjson.dumps(obj, default=self.default, option=option)
+        # orjson always outputs UTF-8, non-ASCII characters can only be in strings
+        if self.ensure_ascii and not data.isascii():
+            data = NON_ASCII_REGEX.sub(escape_non_ascii, data.decode()).encode()
+        return data
+
 
 class FNFlask(Flask):
     """
     Custom response handler
     """
+    json_provider_class = FastJSONProvider
+
     def make_response(self, rv):
         """
-        Only handle the special case of QueryPagination where this has to be restructured
-        into a json format.
+        Only handle the special cases of QueryPagination and CursorPagination
+        where this has to be restructured into a json format.
         The other responses should already be of a valid format (list, json, text)
         """
         if type(rv) in [str, Response]:
@@ -26,10 +80,19 @@ class FNFlask(Flask):
             per_page = int(request.values.get("per_page", '25'))
             jsonized = {"items": []}
             for obj in body.items:
-                jsonized["items"].append(obj.sanitized_dict())
+                jsonized["items"].append(obj.sanitized_dict(body.fields))
             jsonized["page"] = page
             jsonized["per_page"] = per_page
-            jsonized["total"] = body.total
-            jsonized["pages"] = body.pages
+            # Not calculated with count=none
+            if body.total is not None:
+                jsonized["total"] = body.total
+                jsonized["pages"] = body.pages
+            return super().make_response((jsonized, status_code))
+        if isinstance(body, CursorPagination):
+            jsonized = {
+                "items": [obj.sanitized_dict(body.fields) for obj in body.items],
+                "limit": body.limit,
+                "next": body.next_cursor
+            }
             return super().make_response((jsonized, status_code))
         return super().make_response(rv)
@@ -0,0 +1,141 @@
+"""
+Maintenance of the monthly partitions of the audit table.
+    - creates the partitions for the upcoming months, so that
+        new entries never end up in the default partition.
+        Entries already in the default partition for that month
+        are moved to the new one
+    - drops the partitions older than AUDIT_RETENTION_MONTHS.
+        0 means the audit entries are never deleted
+Each partition is created, or dropped, in its own transaction,
+so one failing doesn't stop the others.
+
+Meant to run periodically:
+    python -m app.helpers.audit_partitions
+"""
+import logging
+import os
+import re
+from datetime import date
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.helpers.base_model import engine
+
+logger = logging.getLogger('audit_partitions')
+logger.setLevel(logging.INFO)
+
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "0"))
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "3"))
+PARTITION_NAME_REGEX = r'^audit_y(\d{4})m(\d{2})$'
+DEFAULT_PARTITION = "audit_default"
+
+
+def add_months(day:date, months:int) -> date:
+    """
+    Returns the first day of the month, months away from day
+    """
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_partition_name(month:date) -> str:
+    return f"audit_y{month.year}m{month.month:02d}"
+
+
+def list_partitions(conn:Connection) -> list[str]:
+    return conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'audit'"
+    )).scalars().all()
+
+
+def create_partition(conn:Connection, start:date, has_default:bool=True):
+    """
+    Creates the partition for start's month. PostgreSQL refuses to,
+    if the default partition holds entries for that month, so it's
+    detached meanwhile, and those entries moved to the new partition
+    """
+    name = get_partition_name(start)
+    end = add_months(start, 1)
+    if has_default:
+        conn.execute(text(f"ALTER TABLE audit DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF audit "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    if has_default:
+        moved = conn.execute(text(
+            f"WITH moved AS ("
+            f"DELETE FROM {DEFAULT_PARTITION} WHERE event_time >= :start AND event_time < :end RETURNING *"
+            f") INSERT INTO {name} SELECT * FROM moved"
+        ), {"start": start, "end": end}).rowcount
+        if moved:
+            logger.info("Moved %s audit entries from the default partition to %s", moved, name)
+        conn.execute(text(f"ALTER TABLE audit ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+def create_partitions(today:date, months_ahead:int=AUDIT_PARTITIONS_AHEAD) -> list[str]:
+    """
+    Creates the partitions from the current month, to months_ahead
+    months in the future. Returns the names of the new ones
+    """
+    with engine.connect() as conn:
+        existing = set(list_partitions(conn))
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(today, offset)
+        name = get_partition_name(start)
+        if name in existing:
+            continue
+        try:
+            with engine.begin() as conn:
+                create_partition(conn, start, has_default=DEFAULT_PARTITION in existing)
+        except SQLAlchemyError as exc:
+            logger.error("Could not create the audit partition %s: %s", name, exc)
+            continue
+        created.append(name)
+    return created
+
+
+def drop_old_partitions(today:date, retention_months:int=AUDIT_RETENTION_MONTHS) -> list[str]:
+    """
+    Drops the partitions whose entries are all older than retention_months.
+    Returns the names of the dropped ones
+    """
+    if retention_months <= 0:
+        return []
+
+    oldest_kept = add_months(today, -retention_months)
+    with engine.connect() as conn:
+        partitions = list_partitions(conn)
+    dropped = []
+    for name in partitions:
+        match = re.match(PARTITION_NAME_REGEX, name)
+        # The default partition is never dropped
+        if not match:
+            continue
+        # Every entry in the partition is older than the start of the following month
+        if add_months(date(int(match.group(1)), int(match.group(2)), 1), 1) > oldest_kept:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE {name}"))
+        except SQLAlchemyError as exc:
+            logger.error("Could not drop the audit partition %s: %s", name, exc)
+            continue
+        dropped.append(name)
+    return dropped
+
+
+def maintain_partitions(today:date=None):
+    today = today or date.today()
+    created = create_partitions(today)
+    dropped = drop_old_partitions(today)
+    logger.info("Audit partitions created: %s, dropped: %s", created, dropped)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    maintain_partitions()
@@ -0,0 +1,284 @@
+"""
+Background writer for the audit entries.
+
+Entries are queued by the @audit decorator and inserted in bulk by a
+separate thread, every AUDIT_BATCH_SIZE entries or AUDIT_FLUSH_INTERVAL_MS
+milliseconds, whichever comes first. If the DB is not reachable, or the
+queue is full, entries are appended to a local spool file, which is
+replayed on the next successful write.
+Entries the DB rejects (e.g. invalid values) are retried one by one,
+and the ones that can never be written are logged and dropped, so
+that they don't hold back the others.
+Pending entries are written when the process exits.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Iterator, TextIO
+from sqlalchemy import String, insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, SQLAlchemyError
+
+from app.helpers.base_model import engine
+from app.models.audit import Audit
+
+logger = logging.getLogger('audit_writer')
+logger.setLevel(logging.INFO)
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "500"))
+AUDIT_SPOOL_PATH = os.getenv("AUDIT_SPOOL_PATH", "/mnt/audit-spool/audit-spool.jsonl")
+# Seconds to wait for the pending entries on shutdown
+AUDIT_SHUTDOWN_TIMEOUT = 10
+
+_STOP = object()
+# Max length of the Audit string columns, values are truncated to fit
+COLUMN_LENGTHS = {
+    column.name: column.type.length
+    for column in Audit.__table__.columns
+    if isinstance(column.type, String) and column.type.length
+}
+
+
+def truncate_entry(entry:dict) -> dict:
+    """
+    Cuts the string values to their column's size, as longer
+    values, e.g. large request bodies, can't be inserted
+    """
+    for key, length in COLUMN_LENGTHS.items():
+        if isinstance(entry.get(key), str) and len(entry[key]) > length:
+            entry[key] = entry[key][:length]
+    return entry
+
+
+def is_transient(exc:SQLAlchemyError) -> bool:
+    """
+    Whether the error is about reaching the DB, rather than the rows
+    """
+    return (
+        isinstance(exc, (OperationalError, InterfaceError))
+        or (isinstance(exc, DBAPIError) and exc.connection_invalidated)
+    )
+
+
+class AuditWriter:
+    """
+    Thread-safe, bounded queue of audit entries, as dictionaries
+    with the Audit columns as keys, and the thread draining it
+    """
+    def __init__(
+            self,
+            batch_size:int=AUDIT_BATCH_SIZE,
+            flush_interval_ms:int=AUDIT_FLUSH_INTERVAL_MS,
+            queue_size:int=AUDIT_QUEUE_SIZE,
+            spool_path:str=AUDIT_SPOOL_PATH
+        ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.spool_path = spool_path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread_lock = threading.Lock()
+        self.spool_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """
+        Starts the writer thread, if not running already in this process
+        """
+        with self.thread_lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self.thread.start()
+
+    def put(self, entry:dict):
+        """
+        Queues an entry, never blocks. If the queue is full
+        the entry goes straight to the spool file
+        """
+        self.start()
+        entry = truncate_entry(entry)
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Audit queue is full, spooling the entry")
+            self._spool([entry])
+
+    def flush(self):
+        """
+        Blocks until all of the queued entries are written, or spooled
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def stop(self):
+        """
+        Writes the pending entries and stops the thread
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(AUDIT_SHUTDOWN_TIMEOUT)
+        if self.thread.is_alive():
+            logger.error("Timed out writing the pending audit entries")
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write([entry for entry in batch if entry is not _STOP])
+            except Exception as exc:
+                logger.error("Unexpected error while writing the audit entries: %s", exc)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if batch[-1] is _STOP:
+                return
+
+    def _write(self, entries:list[dict]):
+        """
+        Inserts the spooled entries, if any, then the new ones.
+        If the DB can't be reached, the entries not written yet are spooled
+        """
+        with self.spool_lock:
+            if not self._replay_spool():
+                if entries:
+                    logger.error("Spooling %s audit entries until the spooled ones are written", len(entries))
+                    self._append_to_spool(entries)
+                return
+
+            pending = self._insert(entries)
+            if pending:
+                logger.error("Could not write %s audit entries, spooling them", len(pending))
+                self._append_to_spool(pending)
+
+    def _insert(self, rows:list[dict]) -> list[dict]:
+        """
+        Multi-row insert. If the DB rejects it, rather than being
+        unreachable, the rows are inserted one at a time and the
+        rejected ones are dropped.
+        Returns the rows left to write, from the first transient error
+        """
+        if not rows:
+            return []
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(Audit), rows)
+            return []
+        except SQLAlchemyError as exc:
+            if is_transient(exc):
+                logger.error("DB not reachable to write the audit entries: %s", exc)
+                return rows
+            logger.warning("Audit entries rejected, inserting them one by one: %s", exc)
+
+        for index, row in enumerate(rows):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(Audit), [row])
+            except SQLAlchemyError as exc:
+                if is_transient(exc):
+                    logger.error("DB not reachable to write the audit entries: %s", exc)
+                    # The ones before have been committed already
+                    return rows[index:]
+                logger.error("Dropping audit entry that can't be written: %s %s", row, exc)
+        return []
+
+    def _replay_spool(self) -> bool:
+        """
+        Inserts the spooled entries, batch_size at a time, and removes
+        the spool file. If the DB can't be reached, the file is replaced
+        by the entries not written yet, and False is returned
+        """
+        if not os.path.exists(self.spool_path):
+            return True
+
+        recovered = 0
+        with open(self.spool_path, encoding="utf-8") as spool:
+            for spooled in self._read_spool(spool):
+                pending = self._insert(spooled)
+                recovered += len(spooled) - len(pending)
+                if pending:
+                    logger.error(
+                        "Could not write %s spooled audit entries, %s recovered so far",
+                        len(spooled), recovered
+                    )
+                    self._rewrite_spool(pending, spool)
+                    return False
+        logger.info("Recovered %s spooled audit entries", recovered)
+        os.remove(self.spool_path)
+        return True
+
+    def _spool(self, entries:list[dict]):
+        with self.spool_lock:
+            self._append_to_spool(entries)
+
+    def _append_to_spool(self, entries:list[dict]):
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for entry in entries:
+                    spool.write(self._spool_line(entry))
+        except OSError as exc:
+            logger.error("Could not spool %s audit entries, they are lost: %s", len(entries), exc)
+
+    def _rewrite_spool(self, entries:list[dict], spool:TextIO):
+        """
+        Replaces the spool file by entries, followed by
+        the lines of spool that haven't been read yet
+        """
+        tmp_path = f"{self.spool_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as tmp:
+                for entry in entries:
+                    tmp.write(self._spool_line(entry))
+                for line in spool:
+                    tmp.write(line)
+            os.replace(tmp_path, self.spool_path)
+        except OSError as exc:
+            logger.error("Could not rewrite the audit spool, some entries may be written twice: %s", exc)
+
+    @classmethod
+    def _spool_line(cls, entry:dict) -> str:
+        return json.dumps({**entry, "event_time": entry["event_time"].isoformat()}) + "\n"
+
+    def _read_spool(self, spool:TextIO) -> Iterator[list[dict]]:
+        """
+        The spooled entries, batch_size at a time
+        """
+        entries = []
+        for line in spool:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                entry["event_time"] = datetime.fromisoformat(entry["event_time"])
+            except (ValueError, KeyError, TypeError):
+                logger.error("Skipping malformed spooled audit entry: %s", line)
+                continue
+            entries.append(entry)
+            if len(entries) == self.batch_size:
+                yield entries
+                entries = []
+        if entries:
+            yield entries
+
+
+audit_writer = AuditWriter()
+atexit.register(audit_writer.stop)
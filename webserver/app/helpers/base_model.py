@@ -1,50 +1,269 @@
+import base64
+import binascii
+import json
 from datetime import datetime
-from flask import request
-from typing import Self
+from flask import g, has_app_context, request
+from typing import Callable, Self
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.pagination import QueryPagination
-from sqlalchemy import create_engine, Column
-from sqlalchemy.orm import Relationship, declarative_base
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Column
+from sqlalchemy.orm import Relationship, declarative_base, load_only
 from app.helpers.exceptions import DBRecordNotFoundError, InvalidDBEntry, InvalidRequest
-from app.helpers.const import build_sql_uri
+from app.helpers.const import PGREPLICAHOST, PGREPLICAPORT, build_sql_uri
+from app.helpers.db_pool import DB_REPLICA_CONNECT_TIMEOUT, ReplicaMonitor, create_pooled_engine
 
 
-engine = create_engine(build_sql_uri())
+class RoutingSession(Session):
+    """
+    Sends the queries to the read replica, if configured and available,
+    while in a read-only route (see wrappers.read_replica).
+    Writes always go to the primary
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and replica_engine is not None
+            and not self._flushing
+            and not getattr(clause, "is_dml", False)
+            and has_app_context()
+            and g.get("read_replica")
+            and replica_monitor.is_available()
+        ):
+            # So that a failing query can be retried on the primary
+            g.replica_used = True
+            return replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class FNSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy, using the shared engine rather than
+    creating its own, so there is a single connection pool
+    """
+    def _make_engine(self, bind_key, options, app):
+        if bind_key is None:
+            return engine
+        return super()._make_engine(bind_key, options, app)
+
+
+engine = create_pooled_engine(build_sql_uri())
+replica_engine = None
+replica_monitor = None
+if PGREPLICAHOST:
+    replica_engine = create_pooled_engine(
+        build_sql_uri(host=PGREPLICAHOST, port=PGREPLICAPORT),
+        connect_timeout=DB_REPLICA_CONNECT_TIMEOUT
+    )
+    replica_monitor = ReplicaMonitor(replica_engine)
 Base = declarative_base()
-db = SQLAlchemy(model_class=Base)
+db = FNSQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CURSOR_DEFAULT_LIMIT = 25
+CURSOR_MAX_LIMIT = 1000
+# How the total of a paginated response is calculated:
+#   - exact: COUNT(*) of the filtered query
+#   - estimate: rows estimated by the query planner, from the table statistics
+#   - none: total and pages are not returned
+COUNT_MODES = ["exact", "estimate", "none"]
+
+
+def serialize_datetime(val) -> str:
+    if isinstance(val, datetime):
+        return val.strftime(DATETIME_FORMAT)
+    return str(val)
+
+
+# How each column's values are rendered, by the columns' python type.
+# None means as they are
+SERIALIZERS = {
+    int: None,
+    bool: None,
+    datetime: serialize_datetime,
+}
+
+
+def pop_count_mode(query_params:dict) -> str:
+    """
+    Removes the count parameter from query_params and validates it
+    """
+    count_mode = query_params.pop("count", "exact")
+    if count_mode not in COUNT_MODES:
+        raise InvalidRequest(f"count parameter should be one of {", ".join(COUNT_MODES)}")
+    return count_mode
+
+
+def estimate_count(query) -> int:
+    """
+    Returns the number of rows the planner expects the query to return,
+    without running it
+    """
+    session = query.session
+    # IN lists are expanded when executed, they have to be rendered here
+    compiled = query.order_by(None).statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={"render_postcompile": True}
+    )
+    plan = session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def paginate(query, page:int, per_page:int, count_mode:str="exact", fields:list[str]=None) -> QueryPagination:
+    """
+    Offset pagination, with the total calculated according to count_mode.
+    fields is kept on the result, so only those are rendered
+    """
+    pagination = query.paginate(page=page, per_page=per_page, count=count_mode == "exact")
+    if count_mode == "estimate":
+        pagination.total = estimate_count(query)
+    pagination.fields = fields
+    return pagination
+
+
+class CursorPagination:
+    """
+    Keyset paginated results. Instead of an offset, the next page starts
+    right after the last item of this one, referenced by an opaque cursor.
+    This keeps deep pages as fast as the first one, but there is no total count.
+    """
+    def __init__(self, items:list, limit:int, next_cursor:str | None, fields:list[str]=None) -> None:
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.fields = fields
+
+    @classmethod
+    def encode_cursor(cls, last_id:int) -> str:
+        return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+    @classmethod
+    def decode_cursor(cls, cursor:str) -> int:
+        try:
+            last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+        except (binascii.Error, ValueError, TypeError, KeyError) as exc:
+            raise InvalidRequest("Invalid cursor") from exc
+        if not isinstance(last_id, int):
+            raise InvalidRequest("Invalid cursor")
+        return last_id
+
+    @classmethod
+    def pop_params(cls, query_params:dict) -> tuple[str, int] | None:
+        """
+        Cursor pagination is used only if after and/or limit are in the
+        request args. If so, they are removed from query_params and
+        returned, while page and per_page are ignored
+        """
+        if "after" not in query_params and "limit" not in query_params:
+            return None
+
+        query_params.pop("page", None)
+        query_params.pop("per_page", None)
+        after = query_params.pop("after", "")
+        try:
+            limit = int(query_params.pop("limit", CURSOR_DEFAULT_LIMIT))
+        except ValueError as ve:
+            raise InvalidRequest("limit parameter should be an integer") from ve
+        if not 0 < limit <= CURSOR_MAX_LIMIT:
+            raise InvalidRequest(f"limit parameter should be between 1 and {CURSOR_MAX_LIMIT}")
+        return after, limit
 
 
 # Another helper class for common methods
 class BaseModel():
     @classmethod
-    def _query(cls) -> QueryPagination:
+    def _query(cls) -> QueryPagination | CursorPagination:
+        query_params = request.values.to_dict()
+        cursor_params = CursorPagination.pop_params(query_params)
+        fields = cls.pop_fields(query_params)
+        query = cls.load_fields(cls.query, fields)
+        if cursor_params:
+            return cls.cursor_paginate(query, *cursor_params, fields=fields)
+
         try:
-            page = int(request.values.get("page", '1'))
-            per_page = int(request.values.get("per_page", '25'))
+            page = int(query_params.get("page", '1'))
+            per_page = int(query_params.get("per_page", '25'))
         except ValueError as ve:
             raise InvalidRequest("page and per_page parameters should be integers") from ve
 
-        return cls.query.paginate(page=page, per_page=per_page)
+        return paginate(query, page, per_page, pop_count_mode(query_params), fields)
+
+    @classmethod
+    def pop_fields(cls, query_params:dict) -> list[str] | None:
+        """
+        Removes the comma separated fields parameter from query_params,
+        and checks they are all columns of this model.
+        None means all of the fields
+        """
+        if "fields" not in query_params:
+            return None
+
+        fields = query_params.pop("fields").split(",")
+        for field in fields:
+            if field not in cls._get_serializer():
+                raise InvalidRequest(f"{field} is not a valid field")
+        return fields
+
+    @classmethod
+    def load_fields(cls, query, fields:list[str] | None):
+        """
+        Only selects the requested columns, and the primary key,
+        so that the other ones are not read from the DB at all
+        """
+        if fields is None:
+            return query
+        return query.options(load_only(*[getattr(cls, field) for field in fields]))
+
+    @classmethod
+    def cursor_paginate(cls, query, after:str, limit:int, fields:list[str]=None) -> CursorPagination:
+        """
+        Seeks on the primary key, rather than using an offset
+        """
+        if after:
+            query = query.filter(cls.id > CursorPagination.decode_cursor(after))
+        items = query.order_by(cls.id).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = CursorPagination.encode_cursor(items[-1].id)
+        return CursorPagination(items, limit, next_cursor, fields)
 
-    def sanitized_dict(self) -> dict[str, bool|int|str]:
+    def sanitized_dict(self, fields:list[str]=None) -> dict[str, bool|int|str]:
         """
         Based on the list of column names, conditionally render the values
-        in a dictionary
+        in a dictionary. If fields is set, only those are rendered
         """
+        serializer = self._get_serializer()
         jsonized = {}
-        for field in self._get_fields_name():
+        for field in fields or serializer:
             val = getattr(self, field)
-            match val:
-                case int() | bool() | None:
-                    jsonized[field] = val
-                case datetime():
-                    jsonized[field] = val.strftime("%Y-%m-%d %H:%M:%S")
-                case BaseModel():
-                    pass
-                case _:
-                    jsonized[field] = str(val)
+            convert = serializer[field]
+            jsonized[field] = val if val is None or convert is None else convert(val)
         return jsonized
 
+    @classmethod
+    def _get_serializer(cls) -> dict[str, Callable | None]:
+        """
+        Column names, and the function rendering their values.
+        Built the first time an object of this model is rendered,
+        and stored on the class
+        """
+        serializer = cls.__dict__.get("_serializer")
+        if serializer is None:
+            serializer = {}
+            for col in cls._get_fields():
+                try:
+                    serializer[col.name] = SERIALIZERS.get(col.type.python_type, str)
+                except NotImplementedError:
+                    serializer[col.name] = str
+            cls._serializer = serializer
+        return serializer
+
     def add(self, commit=True):
         db.session.add(self)
         db.session.flush()
@@ -71,7 +290,7 @@ class BaseModel():
 
     @classmethod
     def _get_fields_name(cls) -> list[str]:
-        return [col.name for col in cls._get_fields()]
+        return list(cls._get_serializer())
 
     @classmethod
     def is_field_required(cls, attribute: Column) -> bool:
@@ -11,6 +11,10 @@ def build_sql_uri(
         ):
     return f"postgresql://{username}:{quote(password)}@{host}:{port}/{database}".replace("%", "%%")
 
+# Optional read replica, with the same credentials and database as the primary
+PGREPLICAHOST = os.getenv('PGREPLICAHOST')
+PGREPLICAPORT = os.getenv('PGREPLICAPORT', os.getenv('PGPORT'))
+
 PASS_GENERATOR_SET = string.ascii_letters + string.digits + "!$@#.-_"
 PUBLIC_URL = os.getenv("PUBLIC_URL")
 
@@ -41,6 +45,9 @@ CLEANUP_AFTER_DAYS = int(os.getenv("CLEANUP_AFTER_DAYS"))
 TASK_POD_RESULTS_PATH = os.getenv("TASK_POD_RESULTS_PATH")
 TASK_POD_INPUTS_PATH = "/mnt/inputs"
 RESULTS_PATH = os.getenv("RESULTS_PATH")
+# "mount" reads the results from RESULTS_PATH when they are there,
+# "job" always copies them from a job's pod
+TASK_RESULTS_ACCESS = os.getenv("TASK_RESULTS_ACCESS", "mount")
 PUBLIC_URL = os.getenv("PUBLIC_URL")
 CRD_DOMAIN = os.getenv("CRD_DOMAIN")
 TASK_REVIEW = os.getenv("TASK_REVIEW")
@@ -0,0 +1,193 @@
+"""
+The single SQLAlchemy engine of the backend, shared by Flask-SQLAlchemy
+and the code running outside of a request (e.g. the audit writer).
+
+Its connection pool records how long it takes to get a connection,
+so that it can be sized against the number of waitress threads:
+if the wait grows, requests are queueing for a connection.
+
+Optionally, a read replica can serve the read-only endpoints,
+as long as it's reachable and not lagging too far behind.
+"""
+import logging
+import os
+import threading
+import time
+from sqlalchemy import Engine, create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger('db_pool')
+logger.setLevel(logging.INFO)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 0 means no timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Waiting longer than this for a connection is logged, in seconds
+DB_SLOW_CHECKOUT_THRESHOLD = float(os.getenv("DB_SLOW_CHECKOUT_THRESHOLD", "1"))
+# Past this replication lag, in seconds, the primary is used instead
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+# How often the replica's availability and lag are checked, in seconds
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))
+# Seconds, kept short so that an unreachable replica doesn't hold requests
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+
+
+class PoolMetrics:
+    """
+    Thread-safe counters on the connections handed out by the pool
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_seconds = 0.0
+        self.wait_max_seconds = 0.0
+
+    def record_checkout(self, wait:float, timed_out:bool=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total_seconds += wait
+            self.wait_max_seconds = max(self.wait_max_seconds, wait)
+        if wait > DB_SLOW_CHECKOUT_THRESHOLD:
+            logger.warning("Waited %.2fs for a DB connection", wait)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total_seconds": self.wait_total_seconds,
+                "wait_max_seconds": self.wait_max_seconds
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool timing each connection checkout, including the
+    wait for a connection to be returned when the pool is exhausted.
+    Each pool has its own metrics, kept when the pool is recreated
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self) -> QueuePool:
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_checkout(time.monotonic() - start, timed_out=True)
+            raise
+        self.metrics.record_checkout(time.monotonic() - start)
+        return conn
+
+
+def create_pooled_engine(uri:str, connect_timeout:int=None) -> Engine:
+    connect_args = {}
+    if connect_timeout:
+        connect_args["connect_timeout"] = connect_timeout
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+
+    return create_engine(
+        uri,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args=connect_args
+    )
+
+
+def get_pool_metrics(engine:Engine) -> dict:
+    """
+    Current state of the engine's pool, and the checkouts so far
+    """
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # Negative while the pool is not full yet
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        **pool.metrics.as_dict()
+    }
+
+
+class ReplicaMonitor:
+    """
+    Tells whether the replica can be used. The result of the
+    check is kept for DB_REPLICA_CHECK_INTERVAL seconds, so that
+    at most one lag query runs per interval.
+    A connection error on the replica makes it unavailable
+    until the next check.
+    """
+    def __init__(
+            self,
+            engine:Engine,
+            max_lag:float=DB_REPLICA_MAX_LAG,
+            check_interval:float=DB_REPLICA_CHECK_INTERVAL
+        ) -> None:
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # Reentrant, as _on_error can be called while checking
+        self.lock = threading.RLock()
+        self.available = False
+        self.next_check = 0.0
+        event.listen(engine, "handle_error", self._on_error)
+
+    def is_available(self) -> bool:
+        with self.lock:
+            if time.monotonic() >= self.next_check:
+                self.available = self._check()
+                self.next_check = time.monotonic() + self.check_interval
+            return self.available
+
+    def get_lag(self) -> float:
+        """
+        Seconds since the last replayed transaction, 0 if there is
+        nothing to replay. Not in recovery means it's not a replica
+        """
+        with self.engine.connect() as conn:
+            return float(conn.execute(text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )).scalar() or 0)
+
+    def _check(self) -> bool:
+        try:
+            lag = self.get_lag()
+        except SQLAlchemyError as exc:
+            logger.warning("DB replica not reachable, using the primary: %s", exc)
+            return False
+        if lag > self.max_lag:
+            logger.warning("DB replica is %.1fs behind, using the primary", lag)
+            return False
+        return True
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            with self.lock:
+                self.available = False
+                self.next_check = time.monotonic() + self.check_interval
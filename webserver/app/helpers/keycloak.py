@@ -1,10 +1,19 @@
+import copy
+import hashlib
 import logging
 import os
 import random
 import re
+import threading
+import time
+import jwt
 import requests
 from base64 import b64encode
-from flask import request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from app.helpers.exceptions import AuthenticationError, UnauthorizedError, KeycloakError
 from app.helpers.const import PASS_GENERATOR_SET
@@ -23,6 +32,7 @@ URLS = {
     "health_check": f"{KEYCLOAK_URL}/realms/master",
     "get_token": f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/token",
     "validate": f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/token/introspect",
+    "certs": f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/certs",
     "client": f"{KEYCLOAK_URL}/admin/realms/{REALM}/clients",
     "client_secret": f"{KEYCLOAK_URL}/admin/realms/{REALM}/clients/%s/client-secret",
     "client_exchange": f"{KEYCLOAK_URL}/admin/realms/{REALM}/clients/%s/management/permissions",
@@ -35,9 +45,459 @@ URLS = {
     "permission": f"{KEYCLOAK_URL}/admin/realms/{REALM}/clients/%s/authz/resource-server/permission/scope",
     "permissions_check": f"{KEYCLOAK_URL}/admin/realms/{REALM}/clients/%s/authz/resource-server/policy/evaluate",
     "user": f"{KEYCLOAK_URL}/admin/realms/{REALM}/users",
+    "user_count": f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/count",
     "user_role": f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/%s/role-mappings/realm",
     "user_reset": f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/%s/reset-password"
 }
+# Seconds before the admin token expiration at which a new one is requested
+TOKEN_REFRESH_MARGIN = int(os.getenv("KEYCLOAK_TOKEN_REFRESH_MARGIN", "30"))
+# Either "local" (access tokens verified against the realm public keys)
+# or "introspection" (every token is sent to Keycloak)
+TOKEN_VALIDATION = os.getenv("KEYCLOAK_TOKEN_VALIDATION", "local")
+# Minimum seconds between realm keys fetches, in case of unknown key ids
+JWKS_MIN_REFRESH_INTERVAL = 10
+# Only access tokens are signed with the realm's asymmetric keys
+LOCAL_VERIFICATION_ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512"]
+# Permission decisions are kept for this many seconds at most, or until the token expires
+PERMISSION_CACHE_TTL = int(os.getenv("KEYCLOAK_PERMISSION_CACHE_TTL", "300"))
+PERMISSION_CACHE_SIZE = int(os.getenv("KEYCLOAK_PERMISSION_CACHE_SIZE", "1024"))
+# Clients' ids and secrets are kept for this many seconds
+CLIENT_CACHE_TTL = int(os.getenv("KEYCLOAK_CLIENT_CACHE_TTL", "300"))
+# HTTP transport settings
+REQUEST_TIMEOUT = float(os.getenv("KEYCLOAK_REQUEST_TIMEOUT", "30"))
+POOL_SIZE = int(os.getenv("KEYCLOAK_POOL_SIZE", "20"))
+MAX_RETRIES = int(os.getenv("KEYCLOAK_MAX_RETRIES", "3"))
+SLOW_REQUEST_THRESHOLD = float(os.getenv("KEYCLOAK_SLOW_REQUEST_THRESHOLD", "1"))
+# Users' profiles and roles are kept for this many seconds, missing users for less
+USER_CACHE_TTL = int(os.getenv("KEYCLOAK_USER_CACHE_TTL", "60"))
+USER_CACHE_NEGATIVE_TTL = int(os.getenv("KEYCLOAK_USER_CACHE_NEGATIVE_TTL", "10"))
+USER_CACHE_SIZE = int(os.getenv("KEYCLOAK_USER_CACHE_SIZE", "1024"))
+EXCHANGED_TOKEN_CACHE_SIZE = int(os.getenv("KEYCLOAK_EXCHANGED_TOKEN_CACHE_SIZE", "1024"))
+# Max concurrent requests when fetching details for a list of users
+USERS_LOOKUP_WORKERS = int(os.getenv("KEYCLOAK_USERS_LOOKUP_WORKERS", "8"))
+
+
+class KeycloakCache:
+    """
+    Process-wide store for the values every Keycloak instance
+    needs at init time: the admin token, and the clients' ids and secrets.
+    These are fetched once and shared across instances and threads.
+    The admin token is renewed shortly before it expires, the clients'
+    ids and secrets are fetched again after CLIENT_CACHE_TTL seconds.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Drops everything. The next Keycloak instance will fetch
+        the values again
+        """
+        with self.lock:
+            self.admin_token = None
+            self.admin_token_expires_at = 0.0
+            self.client_ids = {}
+            self.client_secrets = {}
+            self.signing_keys = {}
+            self.signing_keys_fetched_at = None
+
+    def get_admin_token(self) -> str | None:
+        """
+        Returns the admin token only if it's not about to expire
+        """
+        if time.monotonic() < self.admin_token_expires_at - TOKEN_REFRESH_MARGIN:
+            return self.admin_token
+        return None
+
+    def set_admin_token(self, token:str, expires_in:int | None):
+        """
+        Store the admin token. If Keycloak did not tell us its lifetime
+        it won't be reused.
+        """
+        self.admin_token = token
+        self.admin_token_expires_at = time.monotonic() + (expires_in or 0)
+
+    def invalidate_admin_token(self, token:str):
+        """
+        Drops the admin token if it's the one Keycloak refused,
+        i.e. after a Keycloak restart
+        """
+        with self.lock:
+            if self.admin_token == token:
+                self.admin_token = None
+                self.admin_token_expires_at = 0.0
+
+    def get_client_value(self, values:dict, key:str) -> str | None:
+        """
+        Returns a client's id or secret, if it has not expired
+        """
+        with self.lock:
+            entry = values.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                del values[key]
+                return None
+            return entry["value"]
+
+    def set_client_value(self, values:dict, key:str, value:str):
+        if CLIENT_CACHE_TTL <= 0:
+            return
+        with self.lock:
+            values[key] = {
+                "expires_at": time.monotonic() + CLIENT_CACHE_TTL,
+                "value": value
+            }
+
+    def invalidate_client(self, client_name:str=None, client_id:str=None):
+        """
+        Drops a client's id and secret, i.e. when it's deleted,
+        or Keycloak doesn't find it anymore
+        """
+        with self.lock:
+            entry = self.client_ids.pop(client_name, None)
+            if entry is not None:
+                self.client_secrets.pop(entry["value"], None)
+            self.client_secrets.pop(client_id, None)
+
+
+kc_cache = KeycloakCache()
+
+
+class PermissionCache:
+    """
+    Bounded LRU store of the positive authorization decisions
+    returned by Keycloak for a (token, scope, resource) on a client.
+    Entries expire after PERMISSION_CACHE_TTL seconds, or when the
+    token does, whichever comes first. Denied requests are not cached.
+    """
+    def __init__(self, max_size:int=PERMISSION_CACHE_SIZE, ttl:int=PERMISSION_CACHE_TTL) -> None:
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decisions = OrderedDict()
+
+    @classmethod
+    def get_key(cls, token:str, scope:str, resource:str, client_name:str) -> str:
+        """
+        Tokens are not kept in memory as they are, only their hash
+        """
+        return hashlib.sha256(f"{client_name}|{scope}|{resource}|{token}".encode()).hexdigest()
+
+    @classmethod
+    def get_token_expiration(cls, token:str) -> float | None:
+        """
+        The signature has been already checked by Keycloak at this point,
+        here we are only interested in the exp claim
+        """
+        try:
+            return jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.InvalidTokenError:
+            return None
+
+    def is_allowed(self, key:str) -> bool:
+        with self.lock:
+            decision = self.decisions.get(key)
+            if decision is None:
+                return False
+            if decision["expires_at"] <= time.time():
+                del self.decisions[key]
+                return False
+            self.decisions.move_to_end(key)
+            return True
+
+    def allow(self, key:str, token:str, client_name:str, resource:str):
+        """
+        Stores a positive decision. Tokens without an expiration
+        are not cached
+        """
+        token_exp = self.get_token_expiration(token)
+        if token_exp is None:
+            return
+
+        expires_at = min(time.time() + self.ttl, token_exp)
+        if expires_at <= time.time():
+            return
+
+        with self.lock:
+            self.decisions[key] = {
+                "expires_at": expires_at,
+                "client_name": client_name,
+                "resource": resource
+            }
+            self.decisions.move_to_end(key)
+            while len(self.decisions) > self.max_size:
+                self.decisions.popitem(last=False)
+
+    def invalidate(self, client_name:str=None, resource:str=None):
+        """
+        Drops the decisions for a client and/or a resource.
+        With no arguments, everything is dropped.
+        To be used every time permissions, policies or resources change
+        """
+        with self.lock:
+            if client_name is None and resource is None:
+                self.decisions.clear()
+                return
+
+            to_remove = [
+                key for key, decision in self.decisions.items()
+                if client_name in [None, decision["client_name"]] and resource in [None, decision["resource"]]
+            ]
+            for key in to_remove:
+                del self.decisions[key]
+
+
+permission_cache = PermissionCache()
+
+
+class ExchangedTokenCache:
+    """
+    Bounded LRU store of the project access tokens obtained by exchanging
+    a global token. Entries are keyed by the hash of the source token
+    and the project client, and are dropped TOKEN_REFRESH_MARGIN seconds
+    before either token expires.
+    """
+    def __init__(self, max_size:int=EXCHANGED_TOKEN_CACHE_SIZE) -> None:
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.tokens = OrderedDict()
+
+    @classmethod
+    def get_key(cls, token:str, client_name:str) -> str:
+        return hashlib.sha256(f"{client_name}|{token}".encode()).hexdigest()
+
+    def get(self, key:str) -> str | None:
+        with self.lock:
+            entry = self.tokens.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                del self.tokens[key]
+                return None
+            self.tokens.move_to_end(key)
+            return entry["token"]
+
+    def set(self, key:str, source_token:str, exchanged_token:str, client_name:str):
+        """
+        Tokens without an expiration are not cached
+        """
+        expirations = [
+            PermissionCache.get_token_expiration(source_token),
+            PermissionCache.get_token_expiration(exchanged_token)
+        ]
+        if None in expirations:
+            return
+
+        expires_at = min(expirations) - TOKEN_REFRESH_MARGIN
+        if expires_at <= time.time():
+            return
+
+        with self.lock:
+            self.tokens[key] = {
+                "token": exchanged_token,
+                "expires_at": expires_at,
+                "client_name": client_name
+            }
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def invalidate(self, client_name:str=None):
+        """
+        Drops the tokens for a client. With no arguments, everything is dropped
+        """
+        with self.lock:
+            if client_name is None:
+                self.tokens.clear()
+                return
+
+            to_remove = [key for key, entry in self.tokens.items() if entry["client_name"] == client_name]
+            for key in to_remove:
+                del self.tokens[key]
+
+
+exchanged_token_cache = ExchangedTokenCache()
+
+
+class UserCache:
+    """
+    Bounded LRU store of the users' lookups, by id, username and email,
+    and of their realm roles. Entries expire after USER_CACHE_TTL seconds.
+    Users not found are cached as well, for USER_CACHE_NEGATIVE_TTL seconds.
+    Values are copied in and out, so callers can't alter the cached ones.
+    """
+    def __init__(self, max_size:int=USER_CACHE_SIZE, ttl:int=USER_CACHE_TTL, negative_ttl:int=USER_CACHE_NEGATIVE_TTL) -> None:
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+
+    def get(self, kind:str, value:str) -> tuple[bool, dict | list | None]:
+        """
+        Returns whether the lookup was cached, and its result
+        """
+        key = (kind, value)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry["expires_at"] <= time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, copy.deepcopy(entry["value"])
+
+    def set(self, kind:str, value:str, result:dict | list | None):
+        ttl = self.ttl if result else self.negative_ttl
+        if ttl <= 0:
+            return
+
+        with self.lock:
+            self.entries[(kind, value)] = {
+                "expires_at": time.monotonic() + ttl,
+                "value": copy.deepcopy(result)
+            }
+            self.entries.move_to_end((kind, value))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id:str=None, username:str=None, email:str=None):
+        """
+        Drops every entry for a user, looked up by any of its identifiers.
+        With no arguments, everything is dropped.
+        To be used every time a user, or its roles, change
+        """
+        with self.lock:
+            if user_id is None and username is None and email is None:
+                self.entries.clear()
+                return
+
+            to_remove = [("id", user_id), ("roles", user_id), ("username", username), ("email", email)]
+            # Make sure the lookups by the other identifiers are dropped too
+            for key, entry in self.entries.items():
+                if not isinstance(entry["value"], dict):
+                    continue
+                if (user_id and entry["value"].get("id") == user_id) or \
+                        (username and entry["value"].get("username") == username):
+                    to_remove.append(key)
+            for key in to_remove:
+                self.entries.pop(key, None)
+
+
+user_cache = UserCache()
+
+
+class KeycloakSession(requests.Session):
+    """
+    Shared HTTP transport for every Keycloak call.
+    Connections are kept alive in a pool, every request has a timeout,
+    idempotent requests are retried with a backoff on connection errors
+    and gateway errors, and each call's latency is tracked.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        retries = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retries)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    @classmethod
+    def get_endpoint_name(cls, method:str, url:str) -> str:
+        """
+        Groups urls by replacing ids in the path,
+        so that the stats are per endpoint and not per object
+        """
+        path = re.sub(r'^https?://[^/]+', '', url.split('?')[0])
+        path = re.sub(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '/{id}', path)
+        return f"{method.upper()} {path}"
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        finally:
+            self.record_latency(self.get_endpoint_name(method, url), time.perf_counter() - start)
+
+        if response.status_code == 401:
+            auth_header = (kwargs.get("headers") or {}).get("Authorization", "")
+            kc_cache.invalidate_admin_token(auth_header.replace("Bearer ", ""))
+        return response
+
+    def record_latency(self, endpoint:str, elapsed:float):
+        with self.stats_lock:
+            stat = self.stats.setdefault(endpoint, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stat["count"] += 1
+            stat["total_seconds"] += elapsed
+            stat["max_seconds"] = max(stat["max_seconds"], elapsed)
+
+        if elapsed >= SLOW_REQUEST_THRESHOLD:
+            logger.warning("Slow Keycloak request %s: %.3fs", endpoint, elapsed)
+        else:
+            logger.debug("Keycloak request %s: %.3fs", endpoint, elapsed)
+
+
+kc_session = KeycloakSession()
+
+
+class TokenIdentity:
+    """
+    Request-scoped summary of the bearer token owner.
+    The token is decoded once per request, and the result is stored
+    in flask.g so that auth, audit and the endpoints can share it.
+    """
+    def __init__(self, token:str, token_info:dict, kc_client:"Keycloak") -> None:
+        self.token = token
+        self.token_info = token_info
+        self.kc_client = kc_client
+        self.sub = token_info.get("sub")
+        self.username = token_info.get("username")
+        self.roles = token_info.get("realm_access", {}).get("roles", [])
+        self._is_admin = None
+
+    @property
+    def is_admin(self) -> bool:
+        """
+        Admin flag, from the token realm roles. If those are not
+        in the token, Keycloak is asked, only once per request
+        """
+        if self._is_admin is None:
+            if "realm_access" in self.token_info:
+                self._is_admin = "Administrator" in self.roles
+            else:
+                self._is_admin = self.kc_client.is_user_admin(self.token)
+        return self._is_admin
+
+    @classmethod
+    def from_request(cls, kc_client:"Keycloak"=None, token:str=None) -> "TokenIdentity":
+        """
+        Returns the identity of the current request's token.
+        If it has not been decoded yet in this request, it will be,
+        with the given Keycloak client or a global one
+        """
+        if token is None:
+            token = Keycloak.get_token_from_headers()
+
+        identity = g.get("token_identity")
+        if identity is not None and identity.token == token:
+            return identity
+
+        kc_client = kc_client or Keycloak()
+        identity = cls(token, kc_client.decode_token(token), kc_client)
+        g.token_identity = identity
+        return identity
+
 
 class Keycloak:
     def __init__(self, client='global') -> None:
@@ -64,15 +524,23 @@ class Keycloak:
 
     def exchange_global_token(self, token:str, type:str="access_token") -> str:
         """
-        Token exchange across clients. From global to the instanced one
+        Token exchange across clients. From global to the instanced one.
+        Exchanged access tokens are cached until shortly before they expire
         """
+        cache_key = None
+        if type == "access_token":
+            cache_key = ExchangedTokenCache.get_key(token, self.client_name)
+            cached_token = exchanged_token_cache.get(cache_key)
+            if cached_token:
+                return cached_token
+
         acpayload = {
             'client_secret': KEYCLOAK_SECRET,
             'client_id': KEYCLOAK_CLIENT,
             'grant_type': 'refresh_token',
             'refresh_token': token
         }
-        ac_resp = requests.post(
+        ac_resp = kc_session.post(
             URLS["get_token"],
             data=acpayload,
             headers={
@@ -93,7 +561,7 @@ class Keycloak:
             'subject_token': access_token,
             'audience': self.client_name
         }
-        exchange_resp = requests.post(
+        exchange_resp = kc_session.post(
             URLS["get_token"],
             data=payload,
             headers={
@@ -103,7 +571,11 @@ class Keycloak:
         if not exchange_resp.ok:
             logger.info(exchange_resp.content.decode())
             raise KeycloakError("Cannot exchange token")
-        return exchange_resp.json()[type]
+
+        exchanged_token = exchange_resp.json()[type]
+        if cache_key:
+            exchanged_token_cache.set(cache_key, token, exchanged_token, self.client_name)
+        return exchanged_token
 
     def get_impersonation_token(self, user_id:str) -> str:
         """
@@ -119,7 +591,7 @@ class Keycloak:
             'requested_subject': user_id,
             'audience': KEYCLOAK_CLIENT
         }
-        exchange_resp = requests.post(
+        exchange_resp = kc_session.post(
             URLS["get_token"],
             data=payload,
             headers={
@@ -147,7 +619,11 @@ class Keycloak:
         if not client_id:
             client_id = self.client_id
 
-        secret_resp = requests.get(
+        secret = kc_cache.get_client_value(kc_cache.client_secrets, client_id)
+        if secret is not None:
+            return secret
+
+        secret_resp = kc_session.get(
             URLS["client_secret"] % client_id,
             headers={
                 "Authorization": f"Bearer {self.admin_token}"
@@ -155,8 +631,11 @@ class Keycloak:
         )
         if not secret_resp.ok:
             logger.info(secret_resp.content.decode())
+            if secret_resp.status_code == 404:
+                kc_cache.invalidate_client(client_id=client_id)
             raise KeycloakError(f"Failed to fetch {client_id}'s secret")
 
+        kc_cache.set_client_value(kc_cache.client_secrets, client_id, secret_resp.json()["value"])
         return secret_resp.json()["value"]
 
     def get_token(self, username=None, password=None, token_type='refresh_token', payload:dict=None, raise_on_temp_pass:bool=True) -> str:
@@ -179,7 +658,7 @@ class Keycloak:
                 'password': password
             }
 
-        response_auth = requests.post(
+        response_auth = kc_session.post(
             URLS["get_token"],
             data=payload,
             headers={
@@ -190,6 +669,14 @@ class Keycloak:
         if not raise_on_temp_pass:
             return response_auth
 
+        self._check_token_response(response_auth)
+        return response_auth.json()[token_type]
+
+    def _check_token_response(self, response_auth):
+        """
+        Raises the appropriate exception if the token endpoint
+        returned an error
+        """
         if not response_auth.ok:
             logger.info(response_auth.content.decode())
 
@@ -197,13 +684,92 @@ class Keycloak:
                 raise AuthenticationError("Temporary password must be changed before logging in")
 
             raise AuthenticationError("Failed to login")
-        return response_auth.json()[token_type]
+
+    def get_signing_key(self, kid:str) -> jwt.PyJWK | None:
+        """
+        Returns the realm public key with the given key id.
+        The realm keys are cached, and fetched again only when
+        an unknown key id shows up, i.e. after a key rotation
+        """
+        with kc_cache.lock:
+            if kid in kc_cache.signing_keys:
+                return kc_cache.signing_keys[kid]
+
+            fetched_at = kc_cache.signing_keys_fetched_at
+            if fetched_at is not None and time.monotonic() - fetched_at < JWKS_MIN_REFRESH_INTERVAL:
+                return None
+
+            certs_resp = kc_session.get(URLS["certs"])
+            if not certs_resp.ok:
+                logger.info(certs_resp.content.decode())
+                raise KeycloakError("Failed to fetch the realm keys")
+
+            try:
+                signing_keys = jwt.PyJWKSet.from_dict(certs_resp.json()).keys
+            except jwt.PyJWKSetError:
+                signing_keys = []
+
+            kc_cache.signing_keys = {key.key_id: key for key in signing_keys}
+            kc_cache.signing_keys_fetched_at = time.monotonic()
+            return kc_cache.signing_keys.get(kid)
+
+    def decode_token_locally(self, token:str) -> dict | None:
+        """
+        Verifies signature, expiration and audience of an access token
+        with the realm public keys, without reaching Keycloak.
+        Returns None if the token can't be verified this way
+        (i.e. refresh tokens, or local validation is disabled) so that
+        the caller can fall back to the introspection endpoint
+        """
+        if TOKEN_VALIDATION != "local":
+            return None
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.DecodeError:
+            return None
+
+        if header.get("alg") not in LOCAL_VERIFICATION_ALGORITHMS or not header.get("kid"):
+            return None
+
+        signing_key = self.get_signing_key(header["kid"])
+        if signing_key is None:
+            raise AuthenticationError("Token expired. Validation failed")
+
+        try:
+            token_info = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=[header["alg"]],
+                options={"verify_aud": False, "require": ["exp"]}
+            )
+        except jwt.InvalidTokenError as ite:
+            logger.info("Local token validation failed: %s", ite)
+            raise AuthenticationError("Token expired. Validation failed") from ite
+
+        if token_info.get("typ", "Bearer") != "Bearer":
+            return None
+
+        audience = token_info.get("aud", [])
+        if isinstance(audience, str):
+            audience = [audience]
+        if self.client_name not in audience and token_info.get("azp") != self.client_name:
+            raise AuthenticationError("Token not valid for this client")
+
+        # Keep the same format as the introspection endpoint
+        token_info.setdefault("username", token_info.get("preferred_username"))
+        token_info["active"] = True
+        return token_info
 
     def is_user_admin(self, token:str) -> bool:
         """
         Given a token checks if the owner is an Admin or SuperAdmin
         """
-        response_auth = requests.post(
+        token_info = self.decode_token_locally(token)
+        if token_info is not None:
+            return "Administrator" in token_info.get("realm_access", {}).get("roles", [])
+
+        response_auth = kc_session.post(
             URLS["validate"],
             data={
                 "client_secret": self.client_secret,
@@ -235,15 +801,26 @@ class Keycloak:
 
     def get_admin_token(self) -> str:
         """
-        Get administrative level token
+        Get administrative level token. This is shared across
+        instances, and renewed only when close to its expiration
         """
-        payload = {
-            'client_id': 'admin-cli',
-            'grant_type': 'password',
-            'username': KEYCLOAK_ADMIN,
-            'password': KEYCLOAK_ADMIN_PASSWORD
-        }
-        return self.get_token(token_type='access_token', payload=payload)
+        with kc_cache.lock:
+            admin_token = kc_cache.get_admin_token()
+            if admin_token:
+                return admin_token
+
+            payload = {
+                'client_id': 'admin-cli',
+                'grant_type': 'password',
+                'username': KEYCLOAK_ADMIN,
+                'password': KEYCLOAK_ADMIN_PASSWORD
+            }
+            response_auth = self.get_token(payload=payload, raise_on_temp_pass=False)
+            self._check_token_response(response_auth)
+
+            token_body = response_auth.json()
+            kc_cache.set_admin_token(token_body["access_token"], token_body.get("expires_in"))
+            return token_body["access_token"]
 
     def is_token_valid(self, token:str, scope:str, resource:str, tok_type='refresh_token', with_permissions:bool=True) -> bool:
         """
@@ -251,7 +828,15 @@ class Keycloak:
         """
         is_access_token = tok_type == 'access_token'
         if is_access_token:
-            response_auth = requests.post(
+            try:
+                if self.decode_token_locally(token) is not None:
+                    if with_permissions:
+                        return self.check_permissions(token, scope, resource, is_access_token)
+                    return True
+            except AuthenticationError:
+                return False
+
+            response_auth = kc_session.post(
                 URLS["validate"],
                 data={
                     "client_secret": self.client_secret,
@@ -263,7 +848,7 @@ class Keycloak:
                 }
             )
         else:
-            response_auth = requests.post(
+            response_auth = kc_session.post(
                 URLS["get_token"],
                 data={
                     "client_secret": self.client_secret,
@@ -282,10 +867,16 @@ class Keycloak:
 
     def decode_token(self, token:str) -> dict:
         """
-        Simple token decode, mostly to fetch user general info or exp date
+        Simple token decode, mostly to fetch user general info or exp date.
+        Access tokens are verified locally, unless the introspection
+        validation is configured. Any other token goes through Keycloak
         """
+        token_info = self.decode_token_locally(token)
+        if token_info is not None:
+            return token_info
+
         b64_auth = b64encode(f"{self.client_name}:{self.client_secret}".encode()).decode()
-        response_validate = requests.post(
+        response_validate = kc_session.post(
             URLS["validate"],
             data=f"token={token}",
             headers={
@@ -308,7 +899,11 @@ class Keycloak:
         if client_name is None:
             client_name = self.client_name
 
-        client_id_resp = requests.get(
+        client_id = kc_cache.get_client_value(kc_cache.client_ids, client_name)
+        if client_id is not None:
+            return client_id
+
+        client_id_resp = kc_session.get(
             URLS["client"],
             params = {"clientId": client_name},
             headers=headers
@@ -319,9 +914,19 @@ class Keycloak:
         if not len(client_id_resp.json()):
             raise KeycloakError("Could not find project", 400)
 
+        kc_cache.set_client_value(kc_cache.client_ids, client_name, client_id_resp.json()[0]["id"])
         return client_id_resp.json()[0]["id"]
 
     def check_permissions(self, token:str, scope:str, resource:str, is_access_token=False) -> bool:
+        """
+        Asks Keycloak for an authorization decision on the given resource
+        and scope. Positive decisions are cached for the token lifetime
+        """
+        cache_key = PermissionCache.get_key(token, scope, resource, self.client_name)
+        if permission_cache.is_allowed(cache_key):
+            return True
+
+        original_token = token
         if not is_access_token:
             token = self.get_token(
                 payload={
@@ -337,7 +942,7 @@ class Keycloak:
             'Content-Type': 'application/x-www-form-urlencoded',
         }
 
-        request_perm = requests.post(
+        request_perm = kc_session.post(
             URLS["get_token"],
             data={
                 "grant_type": "urn:ietf:params:oauth:grant-type:uma-ticket",
@@ -350,6 +955,8 @@ class Keycloak:
         if not request_perm.ok:
             logger.info(request_perm.content.decode())
             raise UnauthorizedError("User is not authorized")
+
+        permission_cache.allow(cache_key, original_token, self.client_name, resource)
         return True
 
     def get_role(self, role_name:str) -> dict[str, str]:
@@ -360,7 +967,7 @@ class Keycloak:
 
         Raises a specific exception if not found
         """
-        realm_resp = requests.get(
+        realm_resp = kc_session.get(
             URLS["roles"] + f"/{role_name}",
             headers={
                 'Authorization': f'Bearer {self.admin_token}',
@@ -380,7 +987,7 @@ class Keycloak:
         headers={
             'Authorization': f'Bearer {self.admin_token}'
         }
-        response_res = requests.get(
+        response_res = kc_session.get(
             URLS["resource"] % self.client_id,
             params={
                 "name": resource_name
@@ -411,7 +1018,7 @@ class Keycloak:
         headers={
             'Authorization': f'Bearer {self.admin_token}'
         }
-        response_res = requests.put(
+        response_res = kc_session.put(
             (URLS["resource"] % self.client_id) + f"/{resource["_id"]}",
             json=resource,
             headers=headers
@@ -428,7 +1035,7 @@ class Keycloak:
         headers={
             'Authorization': f'Bearer {self.admin_token}'
         }
-        policy_response = requests.get(
+        policy_response = kc_session.get(
             URLS["get_policies"] % self.client_id,
             params={"name": name},
             headers=headers
@@ -447,7 +1054,7 @@ class Keycloak:
         headers={
             'Authorization': f'Bearer {self.admin_token}'
         }
-        scope_response = requests.get(
+        scope_response = kc_session.get(
             URLS["scopes"] % self.client_id,
             params={
                 "permission": False,
@@ -467,7 +1074,7 @@ class Keycloak:
             return that one
         : token_lifetime : time in seconds for the
         """
-        client_post_rest = requests.post(
+        client_post_rest = kc_session.post(
             URLS['client'],
             json={
                 "clientId": client_name,
@@ -488,7 +1095,7 @@ class Keycloak:
             logger.info(client_post_rest.content.decode())
             raise KeycloakError("Failed to create a project")
 
-        update_req = requests.put(
+        update_req = kc_session.put(
             URLS["client_auth"] % self.get_client_id(client_name),
             json={
                 "decisionStrategy": "AFFIRMATIVE",
@@ -501,11 +1108,42 @@ class Keycloak:
 
         return self.get_client_id(client_name)
 
+    def client_exists(self, client_name:str) -> bool:
+        """
+        Checks if a client exists, without relying on the cached ids
+        """
+        client_id_resp = kc_session.get(
+            URLS["client"],
+            params = {"clientId": client_name},
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if not client_id_resp.ok:
+            logger.info(client_id_resp.content.decode())
+            raise KeycloakError("Could not find client")
+        return len(client_id_resp.json()) > 0
+
+    def delete_client(self, client_name:str):
+        """
+        Deletes a client, and with it all of its scopes,
+        resources, policies and permissions
+        """
+        client_delete_resp = kc_session.delete(
+            f"{URLS["client"]}/{self.get_client_id(client_name)}",
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        kc_cache.invalidate_client(client_name=client_name)
+        permission_cache.invalidate(client_name=client_name)
+        exchanged_token_cache.invalidate(client_name=client_name)
+
+        if not client_delete_resp.ok and client_delete_resp.status_code != 404:
+            logger.info(client_delete_resp.content.decode())
+            raise KeycloakError("Failed to delete the project")
+
     def create_scope(self, scope_name) -> dict:
         """
         Create a custom scope for the instanced client
         """
-        scope_post_rest = requests.post(
+        scope_post_rest = kc_session.post(
             URLS["scopes"] % self.client_id,
             json={"name": scope_name},
             headers=self._post_json_headers()
@@ -522,7 +1160,7 @@ class Keycloak:
         """
         Creates a custom policy for a resource
         """
-        policy_response = requests.post(
+        policy_response = kc_session.post(
             (URLS["policies"] % self.client_id) + policy_type,
             json=payload,
             headers=self._post_json_headers()
@@ -547,7 +1185,7 @@ class Keycloak:
         if current_policy.get("config"):
             current_policy["config"]["noa"] = payload['notOnOrAfter']
             current_policy["config"]["nbf"] = payload['notBefore']
-            policy_response = requests.put(
+            policy_response = kc_session.put(
                 (URLS["policies"] % self.client_id) + "/" + current_policy["id"],
                 json=current_policy,
                 headers=self._post_json_headers()
@@ -562,7 +1200,7 @@ class Keycloak:
         payload["owner"] = {
             "id": self.client_id, "name": client_name
         }
-        resource_response = requests.post(
+        resource_response = kc_session.post(
             URLS["resource"] % self.client_id,
             json=payload,
             headers=self._post_json_headers()
@@ -576,7 +1214,7 @@ class Keycloak:
         return resource_response.json()
 
     def create_permission(self, payload:dict) -> dict:
-        permission_response = requests.post(
+        permission_response = kc_session.post(
             URLS["permission"] % self.client_id,
             json=payload,
             headers=self._post_json_headers()
@@ -601,7 +1239,7 @@ class Keycloak:
         # Make sure the role exists before creating the user
         role = self.get_role(kwargs.get("role", "Users"))
 
-        user_response = requests.post(
+        user_response = kc_session.post(
             URLS["user"],
             json={
                 "firstName": kwargs.get("firstName", ""),
@@ -623,6 +1261,8 @@ class Keycloak:
             logger.info(user_response.text)
             raise KeycloakError("Failed to create the user")
 
+        # The user might have been cached as missing
+        user_cache.invalidate(username=username, email=kwargs.get("email"))
         user_info = self.get_user(username)
 
         # Assign a role
@@ -642,21 +1282,32 @@ class Keycloak:
         """
         if isinstance(role, str):
             role = self.get_role(role)
-        user_role_response = requests.post(
+        user_role_response = kc_session.post(
             URLS["user_role"] % user_id,
             json=[role],
             headers=self._post_json_headers()
         )
+        user_cache.invalidate(user_id=user_id)
         if not user_role_response.ok and user_role_response.status_code != 409:
             logger.info(user_role_response.text)
             raise KeycloakError("Failed to create the user")
 
-    def list_users(self) -> list[dict]:
+    def list_users(self, first:int=None, max_results:int=None) -> list[dict]:
         """
-        Method to return a dictionary representing a Keycloak user
+        Method to return a list of dictionaries representing Keycloak users.
+
+        :param first: the offset of the first user to return
+        :param max_results: how many users to return at most
         """
-        user_response = requests.get(
+        params = {}
+        if first is not None:
+            params["first"] = first
+        if max_results is not None:
+            params["max"] = max_results
+
+        user_response = kc_session.get(
             URLS["user"],
+            params=params,
             headers={"Authorization": f"Bearer {self.admin_token}"}
         )
         if not user_response.ok:
@@ -664,6 +1315,19 @@ class Keycloak:
 
         return user_response.json()
 
+    def count_users(self) -> int:
+        """
+        Returns the number of users in the realm
+        """
+        count_response = kc_session.get(
+            URLS["user_count"],
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if not count_response.ok:
+            raise KeycloakError("Failed to fetch the user")
+
+        return count_response.json()
+
     def get_user(self, username:str) -> dict:
         """
         Method to return a dictionary representing a Keycloak user,
@@ -683,7 +1347,7 @@ class Keycloak:
         """
         Method to return a dictionary representing a Keycloak user
         """
-        user_response = requests.get(
+        user_response = kc_session.get(
             f"{URLS["user"]}/{user_id}",
             headers={"Authorization": f"Bearer {self.admin_token}"}
         )
@@ -696,7 +1360,11 @@ class Keycloak:
         """
         Method to return a dictionary representing a Keycloak user
         """
-        user_response = requests.get(
+        cached, user = user_cache.get("username", username)
+        if cached:
+            return user
+
+        user_response = kc_session.get(
             URLS["user"],
             params= {
                 "username": username,
@@ -707,14 +1375,20 @@ class Keycloak:
         if not user_response.ok:
             raise KeycloakError("Failed to fetch the user")
 
-        return user_response.json()[0] if user_response.json() else None
+        user = user_response.json()[0] if user_response.json() else None
+        user_cache.set("username", username, user)
+        return user
 
     def get_user_by_email(self, email:str) -> dict:
         """
         Method to return a dictionary representing a Keycloak user,
         using their email
         """
-        user_response = requests.get(
+        cached, user = user_cache.get("email", email)
+        if cached:
+            return user
+
+        user_response = kc_session.get(
             URLS["user"],
             params= {
                 "email": email,
@@ -725,34 +1399,59 @@ class Keycloak:
         if not user_response.ok:
             raise KeycloakError("Failed to fetch the user")
 
-        return user_response.json()[0] if user_response.json() else None
+        user = user_response.json()[0] if user_response.json() else None
+        user_cache.set("email", email, user)
+        return user
 
     def get_user_by_id(self, user_id:str) -> dict:
         """
         Method to return a dictionary representing a Keycloak user,
         using their id
         """
-        user_response = requests.get(
+        cached, user = user_cache.get("id", user_id)
+        if cached:
+            return user
+
+        user_response = kc_session.get(
             f"{URLS["user"]}/{user_id}",
             headers={"Authorization": f"Bearer {self.admin_token}"}
         )
         if not user_response.ok:
             raise KeycloakError("Failed to fetch the user")
 
-        return user_response.json() if user_response.json() else None
+        user = user_response.json() if user_response.json() else None
+        user_cache.set("id", user_id, user)
+        return user
 
     def get_user_role(self, user_id:str) -> list[str]:
         """
         From a user id, get all of their realm roles
         """
-        role_response = requests.get(
+        cached, roles = user_cache.get("roles", user_id)
+        if cached:
+            return roles
+
+        role_response = kc_session.get(
             URLS["user_role"] % user_id,
             headers={"Authorization": f"Bearer {self.admin_token}"}
         )
         if not role_response.ok:
             raise KeycloakError("Failed to get the user's role")
 
-        return [role["name"] for role in role_response.json()]
+        roles = [role["name"] for role in role_response.json()]
+        user_cache.set("roles", user_id, roles)
+        return roles
+
+    def get_users_roles(self, user_ids:list[str]) -> dict[str, list[str]]:
+        """
+        Gets the realm roles for several users at once, with a bounded
+        number of concurrent requests. Returns a user_id: roles mapping
+        """
+        if not user_ids:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(USERS_LOOKUP_WORKERS, len(user_ids))) as executor:
+            return dict(zip(user_ids, executor.map(self.get_user_role, user_ids)))
 
     def has_user_roles(self, user_id:str, roles:set) -> bool:
         """
@@ -773,7 +1472,7 @@ class Keycloak:
                 "Incorrect credentials"
             )
 
-        res_pass_resp = requests.put(
+        res_pass_resp = kc_session.put(
             URLS["user_reset"] % user_id,
             json={
                 "type": "password",
@@ -782,6 +1481,7 @@ class Keycloak:
             },
             headers={"Authorization": f"Bearer {self.admin_token}"}
         )
+        user_cache.invalidate(user_id=user_id, username=username)
         if not self.check_if_keycloak_resp_is_valid(res_pass_resp):
             logging.error(res_pass_resp.json())
             raise KeycloakError("Could not update the password.")
@@ -791,7 +1491,7 @@ class Keycloak:
         Method to automate the setup for this client to
         allow token exchange on behalf of a user for admin-level
         """
-        client_permission_resp = requests.put(
+        client_permission_resp = kc_session.put(
             URLS["client_exchange"] % self.client_id,
             json={"enabled": True},
             headers = self._post_json_headers()
@@ -803,7 +1503,7 @@ class Keycloak:
         global_client_id = self.get_client_id('global')
 
         # Fetching the token exchange scope
-        client_te_scope_resp = requests.get(
+        client_te_scope_resp = kc_session.get(
             URLS["scopes"] % rm_client_id,
             params = {
                 "permission": False,
@@ -817,7 +1517,7 @@ class Keycloak:
             raise KeycloakError("Error on keycloak")
 
         token_exch_scope = client_te_scope_resp.json()[0]["id"]
-        resource_scope_resp = requests.get(
+        resource_scope_resp = kc_session.get(
             URLS["resource"] % rm_client_id,
             params = {
                 "name": f"client.resource.{self.client_id}"
@@ -829,7 +1529,7 @@ class Keycloak:
         resource_id = resource_scope_resp.json()[0]["_id"]
 
         # Create a custom client exchange policy
-        global_client_policy_resp = requests.post(
+        global_client_policy_resp = kc_session.post(
             (URLS["policies"] % rm_client_id) + "/client",
             json={
                 "name": f"token-exchange-{self.client_name}",
@@ -839,7 +1539,7 @@ class Keycloak:
             headers = self._post_json_headers()
         )
         if global_client_policy_resp.status_code == 409:
-            global_policy_id = requests.get(
+            global_policy_id = kc_session.get(
                 (URLS["policies"] % rm_client_id) + "/client",
                 params = {
                     "name": f"token-exchange-{self.client_name}"
@@ -853,7 +1553,7 @@ class Keycloak:
             global_policy_id = global_client_policy_resp.json()["id"]
 
         token_exch_name = f"token-exchange.permission.client.{self.client_id}"
-        token_exch_permission_resp = requests.get(
+        token_exch_permission_resp = kc_session.get(
             URLS["permission"] % rm_client_id,
             params = {
                 "name": token_exch_name
@@ -864,7 +1564,7 @@ class Keycloak:
         )
         token_exch_permission_id = token_exch_permission_resp.json()[0]["id"]
         # Updating the permission
-        client_permission_resp = requests.put(
+        client_permission_resp = kc_session.put(
             (URLS["permission"] % rm_client_id) + f"/{token_exch_permission_id}",
             json={
                 "name": token_exch_name,
@@ -878,3 +1578,38 @@ class Keycloak:
         )
         if not client_permission_resp.ok:
             raise KeycloakError("Failed to update the exchange permission")
+
+    def disable_token_exchange(self):
+        """
+        Undoes enable_token_exchange, removing the exchange permission
+        and policy for this client from realm-management
+        """
+        client_permission_resp = kc_session.put(
+            URLS["client_exchange"] % self.client_id,
+            json={"enabled": False},
+            headers = self._post_json_headers()
+        )
+        if not client_permission_resp.ok and client_permission_resp.status_code != 404:
+            logger.info(client_permission_resp.content.decode())
+            raise KeycloakError("Failed to remove the exchange permissions")
+
+        rm_client_id = self.get_client_id('realm-management')
+        policy_resp = kc_session.get(
+            (URLS["policies"] % rm_client_id) + "/client",
+            params = {
+                "name": f"token-exchange-{self.client_name}"
+            },
+            headers = self._post_json_headers()
+        )
+        if not policy_resp.ok:
+            logger.info(policy_resp.content.decode())
+            raise KeycloakError("Failed to fetch the exchange policy")
+
+        for policy in policy_resp.json():
+            delete_resp = kc_session.delete(
+                (URLS["policies"] % rm_client_id) + f"/{policy["id"]}",
+                headers = self._post_json_headers()
+            )
+            if not delete_resp.ok and delete_resp.status_code != 404:
+                logger.info(delete_resp.content.decode())
+                raise KeycloakError("Failed to delete the exchange policy")
@@ -0,0 +1,52 @@
+"""
+asyncio interface to the Keycloak helper, to send independent
+requests concurrently, and a bridge to run them from sync code.
+
+The Keycloak methods are blocking, so each call runs in the default
+executor. They share the pooled HTTP session and process-wide caches
+of the sync helper, so the two can be mixed freely.
+"""
+import asyncio
+import functools
+from typing import Any, Awaitable
+
+from app.helpers.keycloak import Keycloak
+
+
+class AsyncKeycloak:
+    """
+    Exposes the same methods as the Keycloak instance it wraps,
+    as coroutines. Non-callable attributes are returned as they are.
+    """
+    def __init__(self, kc_client:Keycloak) -> None:
+        self.kc_client = kc_client
+
+    @classmethod
+    async def create(cls, client:str='global') -> "AsyncKeycloak":
+        """
+        Instancing Keycloak might need a few requests,
+        so it's not done on the event loop
+        """
+        return cls(await asyncio.to_thread(Keycloak, client=client))
+
+    def __getattr__(self, name:str):
+        attr = getattr(self.kc_client, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def _async_call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+        return _async_call
+
+
+def run_sync(*coroutines:Awaitable) -> list[Any]:
+    """
+    Sync bridge. Runs the coroutines concurrently in a new event loop
+    and returns their results in the same order.
+    If any of them fails, its exception is raised.
+    """
+    async def _gather():
+        return await asyncio.gather(*coroutines)
+
+    return asyncio.run(_gather())
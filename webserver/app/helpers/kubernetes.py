@@ -1,11 +1,12 @@
 import base64
+import copy
+import functools
 import os
 import logging
-import shutil
-import tarfile
-from tempfile import TemporaryFile
+import threading
+from typing import Iterator
 from kubernetes import client, config
-from kubernetes.stream import stream
+from kubernetes.stream.ws_client import websocket_call
 from kubernetes.client.exceptions import ApiException
 from kubernetes.watch import Watch
 from app.helpers.exceptions import InvalidRequest, KubernetesException
@@ -14,16 +15,62 @@ from app.helpers.const import TASK_NAMESPACE
 logger = logging.getLogger('kubernetes_helper')
 logger.setLevel(logging.INFO)
 
+# HTTP transport settings
+# Seconds, the client ignores non integer timeouts
+KUBERNETES_REQUEST_TIMEOUT = int(os.getenv("KUBERNETES_REQUEST_TIMEOUT", "30"))
+KUBERNETES_POOL_SIZE = int(os.getenv("KUBERNETES_POOL_SIZE", "20"))
 
-class KubernetesBase:
+
+class PooledApiClient(client.ApiClient):
+    """
+    ApiClient with a default timeout on every request
+    """
+    def request(self, *args, **kwargs):
+        # Streamed responses (watches, logs) set their own timeout, if any
+        if kwargs.get("_preload_content", True) and kwargs.get("_request_timeout") is None:
+            kwargs["_request_timeout"] = KUBERNETES_REQUEST_TIMEOUT
+        return super().request(*args, **kwargs)
+
+
+class SharedApiClient:
+    """
+    Process-wide ApiClient, shared by all of the Kubernetes helpers,
+    so the config is loaded, and the connections pool created,
+    once per process rather than on every client instance.
+    In cluster, the service account token is read again
+    from its file when it's rotated.
+    """
     def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.api_client = None
+        self.pid = None
+
+    def get(self) -> client.ApiClient:
+        with self.lock:
+            if self.api_client is None or self.pid != os.getpid():
+                self.api_client = PooledApiClient(self.load_configuration())
+                self.pid = os.getpid()
+            return self.api_client
+
+    @classmethod
+    def load_configuration(cls) -> client.Configuration:
+        configuration = client.Configuration()
         if os.getenv('KUBERNETES_SERVICE_HOST'):
             # Get configuration for an in-cluster setup
-            config.load_incluster_config()
+            config.load_incluster_config(client_configuration=configuration)
         else:
             # Get config from outside the cluster. Mostly DEV
-            config.load_kube_config()
-        super().__init__()
+            config.load_kube_config(client_configuration=configuration)
+        configuration.connection_pool_maxsize = KUBERNETES_POOL_SIZE
+        return configuration
+
+
+shared_api_client = SharedApiClient()
+
+
+class KubernetesBase:
+    def __init__(self) -> None:
+        super().__init__(api_client=shared_api_client.get())
 
     @classmethod
     def encode_secret_value(cls, value:str) -> str:
@@ -146,62 +193,46 @@ class KubernetesBase:
             if kexc.status != 409:
                 raise KubernetesException(kexc.body) from kexc
 
-    def cp_from_pod(self, pod_name:str, source_path:str, dest_path:str, out_name:str, namespace=TASK_NAMESPACE):
+    def stream_from_pod(self, pod_name:str, source_path:str, namespace=TASK_NAMESPACE) -> Iterator[bytes]:
         """
-        Method that emulates the `kubectl cp` command
+        Method that emulates the `kubectl cp` command, returning the tar
+        archive of source_path's contents as it's received from the pod.
+        The exec is started straight away, so that failing to connect
+        raises here, rather than while reading
         """
+        # What stream() does, on a copy of the shared ApiClient, as it swaps
+        # the client's request method for the websocket's one, while other
+        # threads keep using it. The copy shares its configuration and pool.
+        # stream() doesn't pass capture_all on, without which all of the output
+        # is also kept in memory to be returned by read_all, that's the whole archive
+        exec_api_client = copy.copy(self.api_client)
+        exec_api_client.request = functools.partial(
+            websocket_call, exec_api_client.configuration, binary=True, capture_all=False
+        )
         # cmd to archive the content of source_path to stdout
-        exec_command = ['tar', 'cf', '-', source_path]
-        # Make sure the tmp/data folder exists so that the zip files is not in the same folder
-        # as the actual results
-        os.makedirs("/tmp/data", exist_ok=True)
-        try:
-            with TemporaryFile() as tar_buffer:
-                resp = stream(
-                    self.connect_get_namespaced_pod_exec,
-                    pod_name, namespace,
-                    command=exec_command,
-                    stderr=True, stdin=True,
-                    stdout=True, tty=False,
-                    _preload_content=False
-                )
-                # Read the stdout from the pod aka the source_path contents
-                while resp.is_open():
-                    resp.update(timeout=1)
-                    if resp.peek_stdout():
-                        out = resp.read_stdout()
-                        tar_buffer.write(out.encode('utf-8'))
-                    if resp.peek_stderr():
-                        logger.error("STDERR: %s" % resp.read_stderr())
-                resp.close()
-
-                tar_buffer.flush()
-                tar_buffer.seek(0)
-                try:
-                    os.makedirs(dest_path, exist_ok=True)
-                except FileExistsError:
-                    # folder exists, skip
-                    pass
-                # Loop through the contents of the pod's folder
-                with tarfile.open(fileobj=tar_buffer, mode='r:') as tar:
-                    for member in tar.getmembers():
-                        fname = member.name.replace(source_path[1:], "")
-                        if fname:
-                            if member.isdir():
-                                tar.makedir(member, dest_path + '/' + fname[1:])
-                            else:
-                                tar.makefile(member, dest_path + '/' + fname[1:])
-
-            # Create an archive on the Flask's pod PVC
-            results_file_archive = f'/tmp/data/{out_name}'
-            shutil.make_archive(results_file_archive, 'zip', dest_path)
-        except NotADirectoryError as nde:
-            logger.error("%s %s %s", nde.filename, nde.filename, nde.strerror)
-            raise KubernetesException("Error creating the zip file") from nde
-        except Exception as e:
-            raise KubernetesException(getattr(e, "strerror", "")) from e
+        resp = client.CoreV1Api(api_client=exec_api_client).connect_get_namespaced_pod_exec(
+            pod_name, namespace,
+            command=['tar', 'cf', '-', '-C', source_path, '.'],
+            stderr=True, stdin=False,
+            stdout=True, tty=False,
+            _preload_content=False
+        )
+        return self._read_stdout(resp)
 
-        return f"{results_file_archive}.zip"
+    @classmethod
+    def _read_stdout(cls, resp) -> Iterator[bytes]:
+        try:
+            while resp.is_open():
+                resp.update(timeout=1)
+                if resp.peek_stdout():
+                    yield resp.read_stdout()
+                if resp.peek_stderr():
+                    logger.error("STDERR: %s", resp.read_stderr())
+            # Frames received with the closing one
+            if resp.peek_stdout():
+                yield resp.read_stdout()
+        finally:
+            resp.close()
 
 class KubernetesClient(KubernetesBase, client.CoreV1Api):
     def is_pod_ready(self, label):
@@ -0,0 +1,182 @@
+"""
+In-memory copy of the task pods, kept current by a background
+thread watching the tasks namespace, informer style:
+    - lists the pods labelled with task_id once
+    - watches for changes from that list's resource version
+    - lists again if the watch can't be resumed
+Pods are indexed by task_id, so the status of a page of tasks
+needs no calls to the API server.
+
+If the cache hasn't heard from the API server for more than
+TASK_POD_CACHE_MAX_STALENESS seconds, it reports a miss, and
+the caller should list the pods itself.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable
+from kubernetes.client import V1Pod
+from kubernetes.client.exceptions import ApiException
+from kubernetes.watch import Watch
+
+from app.helpers.const import TASK_NAMESPACE
+from app.helpers.kubernetes import KubernetesClient
+
+logger = logging.getLogger('pod_cache')
+logger.setLevel(logging.INFO)
+
+TASK_POD_CACHE = os.getenv("TASK_POD_CACHE", "true").lower() == "true"
+TASK_POD_CACHE_MAX_STALENESS = int(os.getenv("TASK_POD_CACHE_MAX_STALENESS", "60"))
+# The API server ends each watch after this many seconds, and it's resumed.
+# Should be lower than the max staleness, so an idle watch doesn't count as stale
+POD_WATCH_TIMEOUT = 30
+# Seconds to wait before listing again, after an error
+POD_WATCH_RETRY_DELAY = 5
+TASK_LABEL = "task_id"
+
+
+class PodCache:
+    """
+    Task pods, as returned by the API server, by task_id label
+    and pod name. The watching thread starts on the first lookup.
+    Subscribers are called with every change, see subscribe
+    """
+    def __init__(
+            self,
+            namespace:str=TASK_NAMESPACE,
+            max_staleness:int=TASK_POD_CACHE_MAX_STALENESS,
+            enabled:bool=TASK_POD_CACHE
+        ) -> None:
+        self.namespace = namespace
+        self.max_staleness = max_staleness
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.pods:dict[str, dict[str, V1Pod]] = {}
+        # monotonic time of the last response from the API server
+        self.last_sync = None
+        self.thread = None
+        self.pid = None
+        self.subscribers = []
+
+    def subscribe(self, callback:Callable[[str, V1Pod], None]):
+        """
+        callback is called with the event type (ADDED, MODIFIED or DELETED)
+        and the pod, for each change, and for each pod when they are listed.
+        Pods missing from a new list are DELETED, with their last known state.
+        It runs on the watching thread, so it should not block
+        """
+        self.subscribers.append(callback)
+
+    def is_fresh(self) -> bool:
+        """
+        Whether the API server has been heard from within max_staleness seconds
+        """
+        with self.lock:
+            return self.last_sync is not None and time.monotonic() - self.last_sync <= self.max_staleness
+
+    def start(self):
+        """
+        Starts the watching thread, if not running already in this process
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.last_sync = None
+            self.thread = threading.Thread(target=self._run, name="pod-cache", daemon=True)
+            self.thread.start()
+
+    def get_pods(self, task_id:int) -> list[V1Pod] | None:
+        """
+        The pods of a task, or None if the cache can't be trusted
+        """
+        if not self.enabled:
+            return None
+
+        self.start()
+        if not self.is_fresh():
+            return None
+        with self.lock:
+            return list(self.pods.get(str(task_id), {}).values())
+
+    def _run(self):
+        v1 = KubernetesClient()
+        while True:
+            try:
+                resource_version = self._list(v1)
+                while resource_version:
+                    resource_version = self._watch(v1, resource_version)
+                continue
+            except ApiException as exc:
+                if exc.status == 410:
+                    logger.info("Pods watch expired, listing the pods again")
+                    continue
+                logger.error("Error watching the task pods: %s", exc.reason)
+            except Exception as exc:
+                logger.error("Error watching the task pods: %s", exc)
+            time.sleep(POD_WATCH_RETRY_DELAY)
+
+    def _list(self, v1:KubernetesClient) -> str:
+        pod_list = v1.list_namespaced_pod(self.namespace, label_selector=TASK_LABEL)
+        pods = {}
+        for pod in pod_list.items:
+            pods.setdefault(pod.metadata.labels[TASK_LABEL], {})[pod.metadata.name] = pod
+        with self.lock:
+            # Pods deleted while not watching, e.g. since the watch expired
+            deleted = [
+                pod for task_id, task_pods in self.pods.items()
+                for name, pod in task_pods.items() if name not in pods.get(task_id, {})
+            ]
+            self.pods = pods
+            self.last_sync = time.monotonic()
+        for pod in deleted:
+            self._notify("DELETED", pod)
+        for pod in pod_list.items:
+            self._notify("ADDED", pod)
+        return pod_list.metadata.resource_version
+
+    def _watch(self, v1:KubernetesClient, resource_version:str) -> str:
+        """
+        Applies the changes until the API server ends the watch.
+        Returns the resource version to resume from, None
+        if the pods have to be listed again
+        """
+        watcher = Watch()
+        for event in watcher.stream(
+            v1.list_namespaced_pod,
+            self.namespace,
+            label_selector=TASK_LABEL,
+            resource_version=resource_version,
+            timeout_seconds=POD_WATCH_TIMEOUT,
+            _request_timeout=POD_WATCH_TIMEOUT + 10
+        ):
+            if event["type"] == "ERROR":
+                logger.error("Error event from the pods watch: %s", event["raw_object"])
+                return None
+            self.apply_event(event["type"], event["object"])
+        with self.lock:
+            self.last_sync = time.monotonic()
+        return watcher.resource_version
+
+    def apply_event(self, event_type:str, pod:V1Pod):
+        task_id = (pod.metadata.labels or {}).get(TASK_LABEL)
+        if task_id is None:
+            return
+        with self.lock:
+            if event_type == "DELETED":
+                self.pods.get(task_id, {}).pop(pod.metadata.name, None)
+            else:
+                self.pods.setdefault(task_id, {})[pod.metadata.name] = pod
+            self.last_sync = time.monotonic()
+        self._notify(event_type, pod)
+
+    def _notify(self, event_type:str, pod:V1Pod):
+        for callback in self.subscribers:
+            try:
+                callback(event_type, pod)
+            except Exception as exc:
+                logger.error("Pod event subscriber failed: %s", exc)
+
+
+pod_cache = PodCache()
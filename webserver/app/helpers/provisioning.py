@@ -0,0 +1,104 @@
+"""
+Small dependency graph executor, used to create a set of
+Keycloak objects that depend on each other.
+Steps whose dependencies are satisfied run concurrently.
+If any step fails, the completed ones are rolled back,
+in the reverse order of completion.
+"""
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+logger = logging.getLogger('provisioning')
+logger.setLevel(logging.INFO)
+
+PROVISIONING_WORKERS = int(os.getenv("KEYCLOAK_PROVISIONING_WORKERS", "8"))
+
+
+class ProvisioningPlan:
+    """
+    Each step is a function that receives the results of the steps
+    completed so far, keyed by step name. Its return value is stored
+    under its own name.
+    An optional rollback function receives the step's result.
+    """
+    def __init__(self, name:str, max_workers:int=PROVISIONING_WORKERS) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add_step(
+            self,
+            name:str,
+            func:Callable[[dict], Any],
+            depends_on:list[str]=None,
+            rollback:Callable[[Any], None]=None
+        ):
+        if name in self.steps:
+            raise ValueError(f"Step {name} already in the plan")
+        self.steps[name] = {
+            "func": func,
+            "depends_on": set(depends_on or []),
+            "rollback": rollback
+        }
+
+    def run(self) -> dict[str, Any]:
+        """
+        Runs all of the steps, and returns their results.
+        On failure, the first exception raised by a step is raised again,
+        after the completed steps have been rolled back
+        """
+        missing = {dep for step in self.steps.values() for dep in step["depends_on"]} - set(self.steps)
+        if missing:
+            raise ValueError(f"Unknown steps {", ".join(sorted(missing))} in the plan")
+
+        results = {}
+        completed = []
+        pending = dict(self.steps)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    ready = [name for name, step in pending.items() if step["depends_on"].issubset(results)]
+                    for name in ready:
+                        logger.info("%s - %s", self.name, name)
+                        running[executor.submit(pending.pop(name)["func"], dict(results))] = name
+
+                if not running:
+                    if error is None:
+                        raise ValueError(f"Circular dependency between {", ".join(sorted(pending))}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        completed.append(name)
+                    except Exception as exc:
+                        logger.error("%s - %s failed: %s", self.name, name, exc)
+                        # Keep the first failure, the remaining running steps are left to finish
+                        error = error or exc
+
+        if error is not None:
+            self.rollback(completed, results)
+            raise error
+
+        return results
+
+    def rollback(self, completed:list[str], results:dict[str, Any]):
+        """
+        Undoes the completed steps, the last completed first.
+        Failures here are logged, so that the other steps can still be undone
+        """
+        for name in reversed(completed):
+            rollback = self.steps[name]["rollback"]
+            if rollback is None:
+                continue
+            logger.info("%s - Rolling back %s", self.name, name)
+            try:
+                rollback(results[name])
+            except Exception as exc:
+                logger.error("%s - Failed to roll back %s: %s", self.name, name, exc)
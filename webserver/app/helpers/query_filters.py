@@ -1,16 +1,107 @@
+import operator
 import re
-from app.helpers.base_model import Base
+from datetime import datetime
+from sqlalchemy import String, inspect
+from app.helpers.base_model import Base, CursorPagination, paginate, pop_count_mode
 from app.helpers.exceptions import InvalidRequest
 
 
-FILTERS = [
-    'ne',
-    'eq',
-    'lt',
-    'gt',
-    'lte',
-    'gte',
-]
+FILTERS = {
+    'ne': operator.ne,
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'gte': operator.ge,
+    'in': lambda column, values: column.in_(values),
+    'like': lambda column, value: column.like(value),
+    'isnull': lambda column, value: column.is_(None) if value else column.is_not(None),
+}
+# field, field=, field__op
+FILTER_KEY_REGEX = re.compile(r'^(?P<field>.+?)(?:__(?P<op>[a-z]+))?=?$')
+BOOLEAN_VALUES = {
+    "true": True,
+    "1": True,
+    "false": False,
+    "0": False,
+}
+
+
+def to_bool(value:str) -> bool:
+    if value.lower() not in BOOLEAN_VALUES:
+        raise ValueError(f"{value} is not a boolean")
+    return BOOLEAN_VALUES[value.lower()]
+
+
+# How query string values are converted, by the columns' python type
+COERCERS = {
+    bool: to_bool,
+    int: int,
+    float: float,
+    datetime: datetime.fromisoformat,
+}
+
+
+class FilterPlan:
+    """
+    Filterable columns of a model, with the function converting
+    the query string values to each column's type.
+    Built once per model, see get_filter_plan.
+
+    The filters are applied with bound parameters, so the same
+    set of fields and operators, regardless of the values, reuses
+    the SQL compiled by SQLAlchemy the first time. This is true for
+    __in as well, as its values are expanded at execution time.
+    """
+    def __init__(self, model:Base) -> None: # type: ignore
+        self.model = model
+        self.columns = {}
+        # __like only applies to these
+        self.text_columns = set()
+        for attr in inspect(model).column_attrs:
+            column_type = attr.columns[0].type
+            self.columns[attr.key] = (getattr(model, attr.key), COERCERS.get(column_type.python_type, str))
+            if isinstance(column_type, String):
+                self.text_columns.add(attr.key)
+
+    def coerce(self, field:str, op:str, value:str):
+        coercer = self.columns[field][1]
+        try:
+            if op == 'isnull':
+                return to_bool(value)
+            if op == 'in':
+                return [coercer(val) for val in value.split(",")]
+            if op == 'like':
+                return value
+            return coercer(value)
+        except ValueError as ve:
+            raise InvalidRequest(f"{value} is not a valid value for {field}") from ve
+
+    def apply(self, query, query_params:dict):
+        for qp_f, qp_v in query_params.items():
+            match = FILTER_KEY_REGEX.match(qp_f)
+            if match is None:
+                raise InvalidRequest(f"{qp_f!r} is not a valid filter")
+            field = match.group("field")
+            op = match.group("op") or 'eq'
+            if field not in self.columns:
+                raise InvalidRequest(f"{field} is not a valid field")
+            if op not in FILTERS:
+                raise InvalidRequest(f"{op} is not a valid filter")
+            if op == 'like' and field not in self.text_columns:
+                raise InvalidRequest(f"like can only filter text fields, {field} is not one")
+
+            query = query.filter(FILTERS[op](self.columns[field][0], self.coerce(field, op, qp_v)))
+        return query
+
+
+_filter_plans = {}
+
+
+def get_filter_plan(model:Base) -> FilterPlan: # type: ignore
+    if model not in _filter_plans:
+        _filter_plans[model] = FilterPlan(model)
+    return _filter_plans[model]
 
 
 def parse_query_params(model: Base, query_params: dict): # type: ignore
@@ -18,51 +109,39 @@ def parse_query_params(model: Base, query_params: dict): # type: ignore
     We aim to convert query strings in models fields
     to be used as filters.
     The filters follow the python Django filtering system
-        - __lte => less than or equal
-        - __gte => greater than or equal
-        - =     => equal
-        - __eq  => equal
-        - __gt  => greater than
-        - __lt  => less than
-        - __ne  => not equal
+        - __lte    => less than or equal
+        - __gte    => greater than or equal
+        - =        => equal
+        - __eq     => equal
+        - __gt     => greater than
+        - __lt     => less than
+        - __ne     => not equal
+        - __in     => any of the comma separated values
+        - __like   => SQL LIKE pattern, text fields only, e.g. name__like=%25test%25
+        - __isnull => true or false
+    Values are converted to the field's type, invalid ones are rejected.
     Parameters
     ----------
     :param model: The Table model to look against the query args
     :param query_params: the request args => request.args.copy()
+
+    If after and/or limit are provided, the results are keyset
+    paginated instead, see CursorPagination.
+    With offset pagination, count sets how the total is calculated, see COUNT_MODES.
+    fields, comma separated, restricts the columns selected and returned
     """
+    cursor_params = CursorPagination.pop_params(query_params)
+    count_mode = pop_count_mode(query_params)
+    fields = model.pop_fields(query_params)
     try:
         page = int(query_params.pop("page", '1'))
         per_page = int(query_params.pop("per_page", '25'))
     except ValueError as ve:
         raise InvalidRequest("page and per_page parameters should be integers") from ve
 
-    current_query = model.query
-    for qp_f, qp_v in query_params.items():
-        added = False
-        field = re.sub(r'(=|__).*', '', qp_f)
-        for k in FILTERS:
-            if re.findall(f'.+__{k}$', qp_f):
-                if k == 'ne':
-                    current_query = current_query.filter(getattr(model, field) != qp_v)
-                if k == 'eq':
-                    current_query = current_query.filter(getattr(model, field) == qp_v)
-                if k == 'gt':
-                    current_query = current_query.filter(getattr(model, field) > qp_v)
-                if k == 'lt':
-                    current_query = current_query.filter(getattr(model, field) < qp_v)
-                if k == 'gte':
-                    current_query = current_query.filter(getattr(model, field) >= qp_v)
-                if k == 'lte':
-                    current_query = current_query.filter(getattr(model, field) <= qp_v)
-                added = True
-                break
-
-        if not getattr(model, field, None):
-            raise InvalidRequest(f"{field} is not a valid field")
-
-        if not added:
-            # We are in the = case
-            current_query = current_query.filter(getattr(model, field) == qp_v)
-
-    return current_query.paginate(page=page, per_page=per_page)
+    current_query = get_filter_plan(model).apply(model.query, query_params)
+    current_query = model.load_fields(current_query, fields)
 
+    if cursor_params:
+        return model.cursor_paginate(current_query, *cursor_params, fields=fields)
+    return paginate(current_query, page, per_page, count_mode, fields)
@@ -0,0 +1,188 @@
+"""
+Keeps the tasks' status in the DB in line with their pods.
+
+Pod changes, from the pods cache watch, are queued and written
+to the tasks table in batches every TASK_RECONCILER_INTERVAL_MS
+milliseconds, only keeping the latest state of each task's pod.
+This way the tasks can be filtered by status, and their status
+read from the DB, without calling the Kubernetes API.
+"""
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, column, func, table, update
+from sqlalchemy.exc import SQLAlchemyError
+from kubernetes.client import V1Pod
+
+from app.helpers.base_model import engine
+from app.helpers.pod_cache import TASK_LABEL, pod_cache
+
+logger = logging.getLogger('task_reconciler')
+logger.setLevel(logging.INFO)
+
+TASK_RECONCILER = os.getenv("TASK_RECONCILER", "true").lower() == "true"
+TASK_RECONCILER_INTERVAL_MS = int(os.getenv("TASK_RECONCILER_INTERVAL_MS", "1000"))
+TASK_RECONCILER_QUEUE_SIZE = 10000
+# Status set by the backend itself, not to be overwritten by the pod's
+CANCELLED_STATUS = "cancelled"
+
+# The Task model imports this module
+tasks_table = table(
+    "tasks",
+    column("id"),
+    column("status"),
+    column("started_at"),
+    column("finished_at"),
+    column("exit_code"),
+    column("status_reason"),
+    column("updated_at")
+)
+
+
+def to_naive_utc(val:datetime | None) -> datetime | None:
+    """
+    k8s timestamps are timezone aware, the DB ones are UTC without timezone
+    """
+    if isinstance(val, datetime) and val.tzinfo is not None:
+        return val.astimezone(timezone.utc).replace(tzinfo=None)
+    return val
+
+
+def get_pod_state(pod:V1Pod) -> dict | None:
+    """
+    Deconstructs the state of the pod's first container, the same way
+    Task.get_status does. None if the container has not been created yet
+    """
+    if not pod.status or not pod.status.container_statuses:
+        return None
+
+    state = pod.status.container_statuses[0].state
+    for status in ['running', 'waiting', 'terminated']:
+        container_state = getattr(state, status)
+        if container_state is not None:
+            return {
+                "status": status,
+                "started_at": to_naive_utc(getattr(container_state, "started_at", None)),
+                "finished_at": to_naive_utc(getattr(container_state, "finished_at", None)),
+                "exit_code": getattr(container_state, "exit_code", None),
+                "status_reason": getattr(container_state, "reason", None)
+            }
+    return None
+
+
+class TaskReconciler:
+    """
+    Subscribes to the pods cache, and writes the changes from its own thread
+    """
+    def __init__(self, interval_ms:int=TASK_RECONCILER_INTERVAL_MS, enabled:bool=TASK_RECONCILER) -> None:
+        self.interval = interval_ms / 1000
+        self.enabled = enabled
+        self.queue = queue.Queue(maxsize=TASK_RECONCILER_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """
+        Starts the writer thread and the pods watch,
+        if not running already in this process.
+        Nothing to reconcile without the pods cache
+        """
+        if not self.enabled or not pod_cache.enabled:
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            if self.pid is None:
+                pod_cache.subscribe(self.on_pod_event)
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="task-reconciler", daemon=True)
+            self.thread.start()
+        pod_cache.start()
+
+    def is_current(self) -> bool:
+        """
+        Whether the tasks' status in the DB can be trusted
+        """
+        return (
+            self.enabled
+            and self.thread is not None
+            and self.thread.is_alive()
+            and pod_cache.is_fresh()
+        )
+
+    def on_pod_event(self, event_type:str, pod:V1Pod):
+        task_id = (pod.metadata.labels or {}).get(TASK_LABEL)
+        if not (task_id or "").isdigit():
+            return
+        try:
+            self.queue.put_nowait((int(task_id), event_type, pod))
+        except queue.Full:
+            logger.warning("Task reconciler queue is full, dropping the event for task %s", task_id)
+
+    def _run(self):
+        while True:
+            events = [self.queue.get()]
+            try:
+                while True:
+                    events.append(self.queue.get(timeout=self.interval))
+                    if len(events) >= TASK_RECONCILER_QUEUE_SIZE:
+                        break
+            except queue.Empty:
+                pass
+
+            try:
+                self.write(events)
+            except SQLAlchemyError as exc:
+                logger.error("Could not update the status of %s tasks: %s", len(events), exc)
+            except Exception as exc:
+                logger.error("Unexpected error while updating the tasks status: %s", exc)
+
+    def write(self, events:list[tuple[int, str, V1Pod]]):
+        """
+        Only the latest event of each task is written
+        """
+        latest = {}
+        for task_id, event_type, pod in events:
+            latest[task_id] = (event_type, pod)
+
+        updates = []
+        deleted = []
+        for task_id, (event_type, pod) in latest.items():
+            if event_type == "DELETED":
+                deleted.append(task_id)
+                continue
+            state = get_pod_state(pod)
+            if state is not None:
+                updates.append({"task_id": task_id, **{f"new_{key}": val for key, val in state.items()}})
+
+        with engine.begin() as conn:
+            if updates:
+                conn.execute(
+                    update(tasks_table)
+                    .where(
+                        tasks_table.c.id == bindparam("task_id"),
+                        tasks_table.c.status.is_distinct_from(CANCELLED_STATUS)
+                    )
+                    .values(
+                        status=bindparam("new_status"),
+                        started_at=bindparam("new_started_at"),
+                        finished_at=bindparam("new_finished_at"),
+                        exit_code=bindparam("new_exit_code"),
+                        status_reason=bindparam("new_status_reason"),
+                        updated_at=func.now()
+                    ),
+                    updates
+                )
+            if deleted:
+                # Same as Task.get_status, a running task without a pod has been deleted
+                conn.execute(
+                    update(tasks_table)
+                    .where(tasks_table.c.id.in_(deleted), tasks_table.c.status == "running")
+                    .values(status="deleted", updated_at=func.now())
+                )
+
+
+task_reconciler = TaskReconciler()
@@ -1,11 +1,13 @@
 import logging
+from datetime import datetime
 from functools import wraps
-from flask import request
-from sqlalchemy.exc import IntegrityError
+from flask import g, request
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
 
+from app.helpers.audit_writer import audit_writer
+from app.helpers.base_model import db
 from app.helpers.exceptions import AuthenticationError, UnauthorizedError, LogAndException
-from app.helpers.keycloak import Keycloak
-from app.models.audit import Audit
+from app.helpers.keycloak import Keycloak, TokenIdentity
 from app.models.dataset import Dataset
 from app.models.request import Request
 
@@ -28,10 +30,10 @@ def auth(scope:str, check_dataset=True):
             token_type = 'refresh_token'
 
             kc_client = Keycloak()
-            token_info = kc_client.decode_token(token)
-            user = kc_client.get_user_by_username(token_info['username'])
+            identity = TokenIdentity.from_request(kc_client, token)
+            user = kc_client.get_user_by_username(identity.username)
 
-            if requested_project and not kc_client.is_user_admin(token):
+            if requested_project and not identity.is_admin:
                 dar = Request.get_active_project(requested_project, user["id"])
                 if dar.dataset_id:
                     ds = Dataset.get_dataset_by_name_or_id(id=dar.dataset_id)
@@ -53,7 +55,7 @@ def auth(scope:str, check_dataset=True):
             # If the user is an admin or system, ignore the project
             if not kc_client.has_user_roles(user["id"], {"Super Administrator", "Administrator", "System"}):
                 if requested_project:
-                    client = f"Request {token_info['username']} - {requested_project}"
+                    client = f"Request {identity.username} - {requested_project}"
                     kc_client = Keycloak(client)
                     token = kc_client.exchange_global_token(token)
                     token_type = 'access_token'
@@ -98,17 +100,52 @@ def audit(func):
 
         requested_by = ""
         if "Authorization" in request.headers:
-            token = Keycloak().decode_token(Keycloak.get_token_from_headers())
-            requested_by = token.get('sub')
-
-        http_method = request.method
-        http_endpoint = request.path
-        api_function = func.__name__
-        to_save = Audit(source_ip, http_method, http_endpoint, requested_by, http_status, api_function, details)
-        to_save.add()
+            requested_by = TokenIdentity.from_request().sub
+
+        # The entry is written in bulk by a background thread
+        audit_writer.put({
+            "ip_address": source_ip,
+            "http_method": request.method,
+            "endpoint": request.path,
+            "requested_by": requested_by,
+            "status_code": http_status,
+            "api_function": func.__name__,
+            "details": details,
+            "event_time": datetime.now()
+        })
+        # Some endpoints rely on this to persist their changes
+        db.session.commit()
         return response_object, http_status
     return _audit
 
+
+def read_replica(func):
+    """
+    The queries of the decorated view go to the read replica,
+    if one is configured and available. Only for views that don't
+    need to read their own writes.
+    If a query on the replica fails, e.g. it went down or cancelled
+    the query on a conflict with recovery, the view runs again on
+    the primary. Only the view itself is retried, not a streamed
+    response's body, which is sent once the view returned
+    """
+    @wraps(func)
+    def _read_replica(*args, **kwargs):
+        g.read_replica = True
+        try:
+            return func(*args, **kwargs)
+        except (OperationalError, InterfaceError) as exc:
+            if not g.pop("replica_used", False):
+                raise
+            logger.warning("Query on the DB replica failed, retrying on the primary: %s", exc)
+            db.session.rollback()
+            g.read_replica = False
+            return func(*args, **kwargs)
+        finally:
+            g.pop("read_replica", None)
+            g.pop("replica_used", None)
+    return _read_replica
+
 def find_and_redact_key(obj: dict, key: str):
     """
     Given a dictionary, tries to find a (nested) key and redact its value
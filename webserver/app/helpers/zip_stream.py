@@ -0,0 +1,129 @@
+"""
+Builds zip archives as a stream of bytes, so that a download
+is sent while it's being archived, without writing the archive
+to disk, or holding all of it in memory.
+The archived files can come from a folder, or from a tar
+archive, itself read as a stream.
+"""
+import io
+import os
+import tarfile
+import time
+import zipfile
+from typing import BinaryIO, Iterator
+
+ZIP_CHUNK_SIZE = 64 * 1024
+# Zip dates can't be older than this
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class ChunksBuffer(io.RawIOBase):
+    """
+    Write only, non seekable, file object for zipfile to write
+    the archive into. The bytes written so far are taken with pop
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(self.chunks[-1])
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    Read only file object over an iterator of bytes
+    """
+    def __init__(self, chunks:Iterator[bytes]) -> None:
+        super().__init__()
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            try:
+                self.pending = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def stream_zip(entries:Iterator[tuple[zipfile.ZipInfo, BinaryIO | None]]) -> Iterator[bytes]:
+    """
+    Archives each entry's file object, None for folders, yielding
+    the archive's bytes as they are compressed.
+    The entries' file_size should be set, as it tells whether zip64 is needed
+    """
+    buffer = ChunksBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for info, fileobj in entries:
+            if fileobj is None:
+                archive.writestr(info, b"")
+                continue
+            info.compress_type = archive.compression
+            with archive.open(info, mode="w") as dest:
+                while chunk := fileobj.read(ZIP_CHUNK_SIZE):
+                    dest.write(chunk)
+                    if data := buffer.pop():
+                        yield data
+            yield buffer.pop()
+    # The central directory
+    yield buffer.pop()
+
+
+def iter_folder(path:str) -> Iterator[tuple[zipfile.ZipInfo, BinaryIO | None]]:
+    """
+    The folders and regular files under path, named relative to it.
+    Symlinks are skipped, so nothing outside of path is archived
+    """
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if not os.path.islink(os.path.join(root, name)))
+        for name in dirs:
+            full_path = os.path.join(root, name)
+            yield zipfile.ZipInfo.from_file(full_path, os.path.relpath(full_path, path), strict_timestamps=False), None
+
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            if os.path.islink(full_path) or not os.path.isfile(full_path):
+                continue
+            with open(full_path, "rb") as fileobj:
+                yield zipfile.ZipInfo.from_file(full_path, os.path.relpath(full_path, path), strict_timestamps=False), fileobj
+
+
+def iter_tar(chunks:Iterator[bytes]) -> Iterator[tuple[zipfile.ZipInfo, BinaryIO | None]]:
+    """
+    The folders and regular files of a tar archive, read as it's received.
+    Each file can only be read before moving to the next entry.
+    Names are relative to the archive's root, anything outside of it is skipped
+    """
+    with tarfile.open(fileobj=io.BufferedReader(ChunksReader(chunks)), mode="r|") as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name == "." or name.startswith("..") or os.path.isabs(name):
+                continue
+
+            date_time = max(time.localtime(member.mtime)[:6], ZIP_MIN_DATE_TIME)
+            if member.isdir():
+                info = zipfile.ZipInfo(f"{name}/", date_time)
+                info.external_attr = (0o40000 | member.mode) << 16 | 0x10
+                yield info, None
+            elif member.isfile():
+                info = zipfile.ZipInfo(name, date_time)
+                info.external_attr = (0o100000 | member.mode) << 16
+                info.file_size = member.size
+                yield info, tar.extractfile(member)
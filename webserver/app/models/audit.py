@@ -1,10 +1,16 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime, String
+from sqlalchemy import Column, Integer, DateTime, Index, String
 from sqlalchemy.sql import func
 from app.helpers.base_model import BaseModel, db
 
 class Audit(db.Model, BaseModel):
     __tablename__ = 'audit'
+    # The table is partitioned by month on event_time, see app.helpers.audit_partitions
+    __table_args__ = (
+        Index('ix_audit_event_time', 'event_time'),
+        Index('ix_audit_requested_by_event_time', 'requested_by', 'event_time'),
+        Index('ix_audit_endpoint_event_time', 'endpoint', 'event_time'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     ip_address = Column(String(256), nullable=False)
     http_method = Column(String(256), nullable=False)
@@ -13,7 +19,7 @@ class Audit(db.Model, BaseModel):
     status_code = Column(Integer)
     api_function = Column(String(256))
     details = Column(String(4096))
-    event_time = Column(DateTime(timezone=False), server_default=func.now())
+    event_time = Column(DateTime(timezone=False), primary_key=True, server_default=func.now())
 
     def __init__(self,
                  ip_address:str,
@@ -1,5 +1,5 @@
 import re
-from sqlalchemy import Column, Integer, Boolean, String, ForeignKey
+from sqlalchemy import Column, Integer, Boolean, Index, String, ForeignKey
 from sqlalchemy.orm import relationship
 from app.helpers.base_model import BaseModel, db
 from app.models.registry import Registry
@@ -8,6 +8,11 @@ from app.helpers.exceptions import ContainerRegistryException, InvalidRequest
 
 class Container(db.Model, BaseModel):
     __tablename__ = 'containers'
+    # Image lookups, by tag or by sha
+    __table_args__ = (
+        Index('ix_containers_name_registry_id_tag', 'name', 'registry_id', 'tag'),
+        Index('ix_containers_name_registry_id_sha', 'name', 'registry_id', 'sha'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(256), nullable=False)
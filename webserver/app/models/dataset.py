@@ -1,11 +1,12 @@
 import logging
 import re
 import requests
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, Index, String, func
 from app.helpers.base_model import BaseModel, db
 from app.helpers.const import DEFAULT_NAMESPACE, TASK_NAMESPACE, PUBLIC_URL
 from app.helpers.exceptions import DBRecordNotFoundError, InvalidRequest
-from app.helpers.keycloak import Keycloak
+from app.helpers.keycloak import Keycloak, permission_cache
+from app.helpers.keycloak_async import AsyncKeycloak, run_sync
 from app.helpers.kubernetes import KubernetesClient
 from kubernetes.client import V1Secret
 from kubernetes.client.exceptions import ApiException
@@ -81,10 +82,11 @@ class Dataset(db.Model, BaseModel):
             args=self.extra_connection_args
         ).connection_str
 
-    def sanitized_dict(self):
-        dataset = super().sanitized_dict()
-        dataset["slug"] = self.slugify_name()
-        dataset["url"] = f"https://{PUBLIC_URL}/datasets/{dataset["slug"]}"
+    def sanitized_dict(self, fields:list[str]=None):
+        dataset = super().sanitized_dict(fields)
+        if "name" in dataset:
+            dataset["slug"] = self.slugify_name()
+            dataset["url"] = f"https://{PUBLIC_URL}/datasets/{dataset["slug"]}"
         return dataset
 
     def slugify_name(self) -> str:
@@ -128,16 +130,19 @@ class Dataset(db.Model, BaseModel):
         delattr(self, "password")
         # Add to keycloak
         kc_client = Keycloak()
-        admin_policy = kc_client.get_policy('admin-policy')
-        sys_policy = kc_client.get_policy('system-policy')
-
-        admin_ds_scope = []
-        admin_ds_scope.append(kc_client.get_scope('can_admin_dataset'))
-        admin_ds_scope.append(kc_client.get_scope('can_access_dataset'))
-        admin_ds_scope.append(kc_client.get_scope('can_exec_task'))
-        admin_ds_scope.append(kc_client.get_scope('can_admin_task'))
-        admin_ds_scope.append(kc_client.get_scope('can_send_request'))
-        admin_ds_scope.append(kc_client.get_scope('can_admin_request'))
+        async_kc_client = AsyncKeycloak(kc_client)
+        scopes = [
+            'can_admin_dataset', 'can_access_dataset', 'can_exec_task',
+            'can_admin_task', 'can_send_request', 'can_admin_request'
+        ]
+        # These do not depend on each other, so they are sent concurrently
+        admin_policy, sys_policy, *admin_ds_scope = run_sync(
+            async_kc_client.get_policy('admin-policy'),
+            async_kc_client.get_policy('system-policy'),
+            *[async_kc_client.get_scope(scope) for scope in scopes]
+        )
+        # Only once the lookups succeeded, so a failing one
+        # doesn't leave this policy behind
         policy = kc_client.create_policy({
             "name": f"{self.id} - {self.name} Admin Policy",
             "description": f"List of users allowed to administrate the {self.name} dataset",
@@ -161,6 +166,7 @@ class Dataset(db.Model, BaseModel):
             "resources": [resource_ds["_id"]],
             "scopes": [scope["id"] for scope in admin_ds_scope]
         })
+        permission_cache.invalidate(resource=f"{self.id}-{self.name}")
 
     def update(self, **kwargs):
         """
@@ -219,6 +225,7 @@ class Dataset(db.Model, BaseModel):
                 "displayName": f"{self.id} - {kwargs["name"]}"
             }
             kc_client.patch_resource(f"{self.id}-{self.name}", **update_args)
+            permission_cache.invalidate(resource=f"{self.id}-{self.name}")
 
         # Update table
         if kwargs:
@@ -239,10 +246,10 @@ class Dataset(db.Model, BaseModel):
         """
         if id and name:
             error_msg = f"Dataset \"{name}\" with id {id} does not exist"
-            dataset = cls.query.filter((Dataset.name.ilike(name or "") & (Dataset.id == id))).one_or_none()
+            dataset = cls.query.filter((func.lower(Dataset.name) == (name or "").lower()) & (Dataset.id == id)).one_or_none()
         else:
             error_msg = f"Dataset {name if name else id} does not exist"
-            dataset = cls.query.filter((Dataset.name.ilike(name or "") | (Dataset.id == id))).one_or_none()
+            dataset = cls.query.filter((func.lower(Dataset.name) == (name or "").lower()) | (Dataset.id == id)).one_or_none()
 
         if not dataset:
             raise DBRecordNotFoundError(error_msg)
@@ -251,3 +258,7 @@ class Dataset(db.Model, BaseModel):
 
     def __repr__(self):
         return f'<Dataset {self.name}>'
+
+
+# Case insensitive lookups by name, see get_dataset_by_name_or_id
+Index('ix_datasets_lower_name', func.lower(Dataset.name))
@@ -3,7 +3,7 @@ import json
 import logging
 import re
 from kubernetes.client.exceptions import ApiException
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, Index, String, Boolean
 
 from app.helpers.const import TASK_NAMESPACE
 from app.helpers.container_registries import AzureRegistry, BaseRegistry, DockerRegistry, GitHubRegistry
@@ -17,6 +17,9 @@ logger.setLevel(logging.INFO)
 
 class Registry(db.Model, BaseModel):
     __tablename__ = 'registries'
+    __table_args__ = (
+        Index('ix_registries_url', 'url'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     url = Column(String(256), nullable=False)
@@ -37,14 +40,6 @@ class Registry(db.Model, BaseModel):
         self.username = username
         self.password = password
 
-    def sanitized_dict(self):
-        san_dict = super().sanitized_dict()
-        keys = list(san_dict.keys())
-        for k in keys:
-            if k not in self._get_fields_name():
-                san_dict.pop(k, None)
-        return san_dict
-
     @classmethod
     def validate(cls, data:dict):
         data = super().validate(data)
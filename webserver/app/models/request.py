@@ -1,12 +1,13 @@
 from datetime import datetime
 import logging
-from sqlalchemy import Column, Integer, DateTime, String, ForeignKey, update
+from sqlalchemy import Column, Integer, DateTime, Index, String, ForeignKey, update
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.exc import IntegrityError
 from app.helpers.base_model import BaseModel, db
 from app.models.dataset import Dataset
-from app.helpers.keycloak import Keycloak
+from app.helpers.keycloak import Keycloak, permission_cache
+from app.helpers.provisioning import ProvisioningPlan
 from app.helpers.exceptions import DBError, InvalidRequest, LogAndException
 
 
@@ -16,6 +17,10 @@ logger.setLevel(logging.INFO)
 
 class Request(db.Model, BaseModel):
     __tablename__ = 'requests'
+    # Active project lookup, on every request with a project header
+    __table_args__ = (
+        Index('ix_requests_project_name_requested_by_proj_end', 'project_name', 'requested_by', 'proj_end'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(256), nullable=False)
     description = Column(String(4096))
@@ -75,121 +80,180 @@ class Request(db.Model, BaseModel):
 
     def approve(self):
         """
-        Method to orchestrate the Keycloak objects creation
+        Method to orchestrate the Keycloak objects creation.
+        Objects that do not depend on each other are created
+        concurrently, see _get_provisioning_plan
         """
         session = db.session
         self.proj_end = self.proj_end.replace(hour=23, minute=59)
         try:
             global_kc_client = Keycloak()
             user = global_kc_client.get_user_by_id(self.requested_by)
-
-            admin_global_policy = global_kc_client.get_role('Administrator')
-            system_global_policy = global_kc_client.get_role('System')
+            ds = Dataset.query.filter(Dataset.id == self.dataset_id).one_or_none()
 
             new_client_name = self._get_client_name(user["email"])
-            token_lifetime = (self.proj_end - datetime.now()).seconds
+            results = self._get_provisioning_plan(global_kc_client, new_client_name, user, ds).run()
+            # The date policy might have been updated on an existing client
+            permission_cache.invalidate(client_name=new_client_name)
+            ret_response = {"token": results["impersonation token"]}
 
-            logger.info("Creating client %s", new_client_name)
-            global_kc_client.create_client(new_client_name, token_lifetime)
+            logger.info("Updating DB")
+            query = update(Request).\
+                where(Request.id == self.id).\
+                values(status=self.STATUSES["approved"], requested_by=user["id"])
+            session.execute(query)
+            session.commit()
+        except IntegrityError as exc:
+            session.rollback()
+            raise DBError(f"Failed to approve request {self.id}") from exc
+        except LogAndException as exc:
+            self.delete(commit=True)
+            raise exc
 
-            logger.info("%s - Getting admin token", new_client_name)
-            kc_client = Keycloak(new_client_name)
-            logger.info("%s - Token exchange", new_client_name)
-            kc_client.enable_token_exchange()
+        return ret_response
 
-            scopes = ["can_admin_dataset","can_exec_task", "can_admin_task", "can_access_dataset"]
+    def _get_provisioning_plan(
+            self,
+            global_kc_client:Keycloak,
+            new_client_name:str,
+            user:dict,
+            ds:Dataset
+        ) -> ProvisioningPlan:
+        """
+        Describes the Keycloak objects needed for a project, and their dependencies:
+            - client => token exchange, scopes, policies
+            - scopes => resource
+            - resource, policies => permissions
+            - permissions, token exchange => impersonation token
+        If the client is new, it's deleted on failure, together with everything created in it,
+        and its token exchange policy is removed from realm-management.
+        """
+        token_lifetime = (self.proj_end - datetime.now()).seconds
+        scopes = ["can_admin_dataset","can_exec_task", "can_admin_task", "can_access_dataset"]
+        scope_steps = [f"scope {scope}" for scope in scopes]
 
-            logger.info("%s - Creating scopes", new_client_name)
-            created_scopes = []
-            for scope in scopes:
-                created_scopes.append(kc_client.create_scope(scope))
+        def create_client(_):
+            created = not global_kc_client.client_exists(new_client_name)
+            global_kc_client.create_client(new_client_name, token_lifetime)
+            return created
 
-            ds = Dataset.query.filter(Dataset.id == self.dataset_id).one_or_none()
+        def delete_client(created:bool):
+            if created:
+                global_kc_client.delete_client(new_client_name)
 
-            logger.info("%s - Creating resource", new_client_name)
-            resource = kc_client.create_resource({
+        def enable_token_exchange(res):
+            res["client admin"].enable_token_exchange()
+            return res["client admin"] if res["client"] else None
+
+        def disable_token_exchange(client_admin:Keycloak):
+            if client_admin is not None:
+                client_admin.disable_token_exchange()
+
+        plan = ProvisioningPlan(new_client_name)
+        plan.add_step("admin role", lambda _: global_kc_client.get_role('Administrator'))
+        plan.add_step("system role", lambda _: global_kc_client.get_role('System'))
+        plan.add_step("client", create_client, rollback=delete_client)
+        plan.add_step("client admin", lambda _: Keycloak(new_client_name), ["client"])
+        plan.add_step(
+            "token exchange",
+            enable_token_exchange,
+            ["client", "client admin"],
+            rollback=disable_token_exchange
+        )
+        for scope, step in zip(scopes, scope_steps):
+            plan.add_step(
+                step,
+                lambda res, scope=scope: res["client admin"].create_scope(scope),
+                ["client admin"]
+            )
+        plan.add_step(
+            "resource",
+            lambda res: res["client admin"].create_resource({
                 "name": f"{ds.id}-{ds.name}",
-                "owner": {"id": kc_client.client_id, "name": new_client_name},
+                "owner": {"id": res["client admin"].client_id, "name": new_client_name},
                 "displayName": f"{ds.id} {ds.name}",
-                "scopes": created_scopes,
+                "scopes": [res[step] for step in scope_steps],
                 "uris": []
-            })
-
-            logger.info("%s - Creating policies", new_client_name)
-            policies = []
-            # Create admin policy
-            policies.append(kc_client.create_policy({
+            }),
+            ["client admin", *scope_steps]
+        )
+        plan.add_step(
+            "admin policy",
+            lambda res: res["client admin"].create_policy({
                 "name": f"{ds.id} - {ds.name} Admin Policy",
                 "description": f"List of users allowed to administrate the {ds.name} dataset",
                 "logic": "POSITIVE",
-                "roles": [{"id": admin_global_policy["id"], "required": False}]
-            }, "/role"))
-            # Create system policy
-            policies.append(kc_client.create_policy({
+                "roles": [{"id": res["admin role"]["id"], "required": False}]
+            }, "/role"),
+            ["client admin", "admin role"]
+        )
+        plan.add_step(
+            "system policy",
+            lambda res: res["client admin"].create_policy({
                 "name": f"{ds.id} - {ds.name} System Policy",
                 "description": f"List of users allowed to perform automated actions on the {ds.name} dataset",
                 "logic": "POSITIVE",
-                "roles": [{"id": system_global_policy["id"], "required": False}]
-            }, "/role"))
-            # Create the requester's policy
-            user_policy = kc_client.create_policy({
+                "roles": [{"id": res["system role"]["id"], "required": False}]
+            }, "/role"),
+            ["client admin", "system role"]
+        )
+        plan.add_step(
+            "user policy",
+            lambda res: res["client admin"].create_policy({
                 "name": f"{ds.id} - {ds.name} User {user["id"]} Policy",
                 "description": f"User specific permission to perform actions on the {ds.name} dataset",
                 "logic": "POSITIVE",
                 "decisionStrategy": "UNANIMOUS",
                 "type": "user",
                 "users": [user["id"]]
-            }, "/user")
-            # Create project date policy
-            date_range_policy = kc_client.create_or_update_time_policy({
+            }, "/user"),
+            ["client admin"]
+        )
+        plan.add_step(
+            "date policy",
+            lambda res: res["client admin"].create_or_update_time_policy({
                 "name": f"{user["id"]} Date access policy",
                 "description": "Date range to allow the user to access a dataset within this project",
                 "logic": "POSITIVE",
                 "notBefore": self.proj_start.strftime("%Y-%m-%d %H:%M:%S"),
                 "notOnOrAfter": self.proj_end.strftime("%Y-%m-%d %H:%M:%S")
-            }, "/time")
-
-            logger.info("%s - Creating permissions", new_client_name)
-            # Admin permission
-            kc_client.create_permission({
+            }, "/time"),
+            ["client admin"]
+        )
+        plan.add_step(
+            "admin permission",
+            lambda res: res["client admin"].create_permission({
                 "name": f"{ds.id}-{ds.name} Administration Permission",
                 "description": "List of policies that will allow certain users or roles to administrate the dataset",
                 "type": "resource",
                 "logic": "POSITIVE",
                 "decisionStrategy": "AFFIRMATIVE",
-                "policies": [pol["id"] for pol in policies],
-                "resources": [resource["_id"]],
-                "scopes": [scope["id"] for scope in created_scopes]
-            })
-            # User permission
-            kc_client.create_permission({
+                "policies": [res["admin policy"]["id"], res["system policy"]["id"]],
+                "resources": [res["resource"]["_id"]],
+                "scopes": [res[step]["id"] for step in scope_steps]
+            }),
+            ["resource", "admin policy", "system policy"]
+        )
+        plan.add_step(
+            "user permission",
+            lambda res: res["client admin"].create_permission({
                 "name": f"{ds.id}-{ds.name} User {user["id"]} Permission",
                 "description": "List of policies that will allow certain users or roles to administrate the dataset",
                 "type": "resource",
                 "logic": "POSITIVE",
                 "decisionStrategy": "UNANIMOUS",
-                "policies": [user_policy["id"], date_range_policy["id"]],
-                "resources": [resource["_id"]],
-                "scopes": [scope["id"] for scope in created_scopes]
-            })
-
-            logger.info("%s - Impersonation token", new_client_name)
-            ret_response = {"token": kc_client.get_impersonation_token(user["id"])}
-
-            logger.info("Updating DB")
-            query = update(Request).\
-                where(Request.id == self.id).\
-                values(status=self.STATUSES["approved"], requested_by=user["id"])
-            session.execute(query)
-            session.commit()
-        except IntegrityError as exc:
-            session.rollback()
-            raise DBError(f"Failed to approve request {self.id}") from exc
-        except LogAndException as exc:
-            self.delete(commit=True)
-            raise exc
-
-        return ret_response
+                "policies": [res["user policy"]["id"], res["date policy"]["id"]],
+                "resources": [res["resource"]["_id"]],
+                "scopes": [res[step]["id"] for step in scope_steps]
+            }),
+            ["resource", "user policy", "date policy"]
+        )
+        plan.add_step(
+            "impersonation token",
+            lambda res: res["client admin"].get_impersonation_token(user["id"]),
+            ["token exchange", "admin permission", "user permission"]
+        )
+        return plan
 
     @classmethod
     def get_active_project(cls, proj_name:str, user_id:str):
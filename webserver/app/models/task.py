@@ -1,24 +1,31 @@
 import logging
 import json
+import os
 import re
 from datetime import datetime, timedelta
+from functools import partial
 from kubernetes.client import V1CustomResourceDefinition
 from kubernetes.client.exceptions import ApiException
-from sqlalchemy import Column, Integer, DateTime, String, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, DateTime, Index, String, ForeignKey, Boolean
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from typing import Callable, Iterator
 from uuid import uuid4
 
 import urllib3
 from app.helpers.const import (
-    CLEANUP_AFTER_DAYS, CRD_DOMAIN, MEMORY_RESOURCE_REGEX, MEMORY_UNITS, CPU_RESOURCE_REGEX, PUBLIC_URL, TASK_CONTROLLER,
-    TASK_NAMESPACE, TASK_POD_RESULTS_PATH, TASK_POD_INPUTS_PATH, RESULTS_PATH, TASK_REVIEW
+    CLEANUP_AFTER_DAYS, CRD_DOMAIN, MEMORY_RESOURCE_REGEX, MEMORY_UNITS, CPU_RESOURCE_REGEX, TASK_CONTROLLER,
+    TASK_NAMESPACE, TASK_POD_RESULTS_PATH, TASK_POD_INPUTS_PATH, RESULTS_PATH, TASK_REVIEW,
+    TASK_RESULTS_ACCESS
 )
 from app.helpers.base_model import BaseModel, db
-from app.helpers.keycloak import Keycloak
+from app.helpers.keycloak import Keycloak, TokenIdentity
 from app.helpers.kubernetes import KubernetesBatchClient, KubernetesCRDClient, KubernetesClient
+from app.helpers.pod_cache import pod_cache
 from app.helpers.exceptions import DBError, InvalidRequest, TaskCRDExecutionException, TaskImageException, TaskExecutionException
 from app.helpers.task_pod import TaskPod
+from app.helpers.task_reconciler import task_reconciler
+from app.helpers.zip_stream import iter_tar, stream_zip
 from app.models.dataset import Dataset
 from app.models.container import Container
 from app.models.registry import Registry
@@ -34,9 +41,17 @@ REVIEW_STATUS = {
     None: "Pending Review"
 }
 
+# The pod's state, rendered within the task's status
+POD_STATE_FIELDS = ["started_at", "finished_at", "exit_code", "status_reason"]
+
 
 class Task(db.Model, BaseModel):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_requested_by', 'requested_by'),
+        Index('ix_tasks_dataset_id', 'dataset_id'),
+        Index('ix_tasks_status', 'status'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(256), nullable=False)
     docker_image = Column(String(256), nullable=False)
@@ -46,6 +61,11 @@ class Task(db.Model, BaseModel):
     updated_at = Column(DateTime(timezone=False), onupdate=func.now())
     requested_by = Column(String(256), nullable=False)
     review_status = Column(Boolean, nullable=True)
+    # Pod state, kept in line by the task reconciler
+    started_at = Column(DateTime(timezone=False), nullable=True)
+    finished_at = Column(DateTime(timezone=False), nullable=True)
+    exit_code = Column(Integer, nullable=True)
+    status_reason = Column(String(256), nullable=True)
     dataset_id = Column(Integer, ForeignKey(Dataset.id, ondelete='CASCADE'))
     dataset = relationship("Dataset")
 
@@ -78,11 +98,21 @@ class Task(db.Model, BaseModel):
         self.is_from_controller = kwargs.get("task_controller", False)
         self.db_query = kwargs.get("db_query", {})
 
+    @classmethod
+    def load_fields(cls, query, fields:list[str] | None):
+        """
+        The status is built from the pod state columns too,
+        and the image is needed to find the task's pod
+        """
+        if fields is not None and "status" in fields:
+            fields = list(dict.fromkeys(fields + POD_STATE_FIELDS + ["docker_image"]))
+        return super().load_fields(query, fields)
+
     @classmethod
     def validate(cls, data:dict):
         kc_client = Keycloak()
-        user_token = Keycloak.get_token_from_headers()
-        data["requested_by"] = kc_client.decode_token(user_token).get('sub')
+        identity = TokenIdentity.from_request(kc_client)
+        data["requested_by"] = identity.sub
         user = kc_client.get_user_by_id(data["requested_by"])
         # Support only for one image at a time, the standard is executors == list
         executors = data["executors"][0]
@@ -93,7 +123,7 @@ class Task(db.Model, BaseModel):
 
         data["from_controller"] = is_from_controller
         # Dataset validation
-        if kc_client.is_user_admin(user_token):
+        if identity.is_admin:
             ds_id = data.get("tags", {}).get("dataset_id")
             ds_name = data.get("tags", {}).get("dataset_name")
             if ds_name or ds_id:
@@ -312,7 +342,8 @@ class Task(db.Model, BaseModel):
             "regcred_secret": image.registry.slugify_name()
         }).create_pod_spec()
         try:
-            current_pod = self.get_current_pod()
+            # Not from the cache, the pod might have just been created
+            current_pod = self.get_current_pod(cached=False)
             if current_pod:
                 raise TaskExecutionException("Pod is already running", code=409)
 
@@ -329,19 +360,21 @@ class Task(db.Model, BaseModel):
             # create CRD
             self.create_controller_crd()
 
-    def get_current_pod(self, is_running:bool=True):
+    def get_current_pod(self, is_running:bool=True, cached:bool=True):
         """
-        Fetches the pod object from k8s API.
+        Fetches the pod object from the pods cache, or the k8s API
+        if the cache is stale or cached is False.
             is_running will only consider running pods only
         """
-        v1 = KubernetesClient()
-        running_pods = v1.list_namespaced_pod(
-            TASK_NAMESPACE,
-            label_selector=f"task_id={self.id}"
-        )
+        pods = pod_cache.get_pods(self.id) if cached else None
+        if pods is None:
+            pods = KubernetesClient().list_namespaced_pod(
+                TASK_NAMESPACE,
+                label_selector=f"task_id={self.id}"
+            ).items
         try:
-            running_pods.items.sort(key=lambda x: x.metadata.creation_timestamp, reverse=True)
-            for pod in running_pods.items:
+            pods.sort(key=lambda x: x.metadata.creation_timestamp, reverse=True)
+            for pod in pods:
                 images = [im.image for im in pod.spec.containers]
                 statuses = []
                 if pod.status.container_statuses and is_running:
@@ -388,6 +421,29 @@ class Task(db.Model, BaseModel):
         except AttributeError:
             return self.status if self.status != 'running' else 'deleted'
 
+    def get_stored_status(self) -> dict | str:
+        """
+        Same as get_status, but from the pod's state
+        written to the DB by the task reconciler
+        """
+        # A waiting container has no start time, get_status
+        # falls back to the bare status for it
+        if self.status not in ['running', 'terminated']:
+            return self.status
+
+        returned_status = {
+            "started_at": self.started_at
+        }
+        if self.status == 'terminated':
+            returned_status.update({
+                "finished_at": self.finished_at,
+                "exit_code": self.exit_code,
+                "reason": self.status_reason
+            })
+        return {
+            self.status: returned_status
+        }
+
     def terminate_pod(self):
         """
         Terminate a pod, checking if during the process
@@ -410,10 +466,35 @@ class Task(db.Model, BaseModel):
             raise TaskExecutionException("Task already cancelled")
         return self.sanitized_dict()
 
-    def get_results(self):
+    def get_results_path(self) -> str:
+        """
+        The task's results folder, on the backend's results volume
+        """
+        return f"{RESULTS_PATH}/{self.id}/results"
+
+    def has_mounted_results(self) -> bool:
+        """
+        Whether the results can be read straight from the backend's
+        results volume, rather than copied from a job's pod.
+        An empty folder is not trusted, the volume might be
+        a different one than the task's, depending on the storage
+        """
+        if TASK_RESULTS_ACCESS != "mount":
+            return False
+        try:
+            with os.scandir(self.get_results_path()) as entries:
+                return any(True for _ in entries)
+        except OSError:
+            return False
+
+    def get_results(self) -> tuple[Iterator[bytes], Callable[[], None]]:
         """
         The idea is to create a job that holds indefinitely
-        so that the backend can copy the results
+        so that the backend can copy the results.
+        Returns the zip archive of the results, converted from the
+        tar streamed from the job's pod, and the function deleting
+        the job, to call once the response is closed, whether the
+        archive has been read or not
         """
         v1_batch = KubernetesBatchClient()
         job_name = f"result-job-{uuid4()}"
@@ -444,14 +525,10 @@ class Task(db.Model, BaseModel):
 
             job_pod = v1.list_namespaced_pod(namespace=TASK_NAMESPACE, label_selector=f"job-name={job_name}").items[0]
 
-            res_file = v1.cp_from_pod(
+            tar_stream = v1.stream_from_pod(
                 pod_name=job_pod.metadata.name,
-                source_path=TASK_POD_RESULTS_PATH,
-                dest_path=f"{RESULTS_PATH}/{self.id}/results",
-                out_name=f"{PUBLIC_URL}-results-{self.id}"
+                source_path=TASK_POD_RESULTS_PATH
             )
-            v1.delete_pod(job_pod.metadata.name)
-            v1_batch.delete_job(job_name)
         except ApiException as e:
             if 'job_pod' in locals() and self.get_current_pod(job_pod.metadata.name):
                 v1_batch.delete_job(job_name)
@@ -459,7 +536,27 @@ class Task(db.Model, BaseModel):
             raise InvalidRequest(f"Failed to run pod: {e.reason}") from e
         except urllib3.exceptions.MaxRetryError as mre:
             raise InvalidRequest("The cluster could not create the job") from mre
-        return res_file
+        return (
+            self.stream_job_results(tar_stream, job_pod.metadata.name),
+            partial(self.delete_results_job, job_pod.metadata.name, job_name)
+        )
+
+    @classmethod
+    def stream_job_results(cls, tar_stream:Iterator[bytes], pod_name:str) -> Iterator[bytes]:
+        try:
+            yield from stream_zip(iter_tar(tar_stream))
+        except Exception as exc:
+            # The response has started already, the download is cut short
+            logger.error("Failed to stream the results from %s: %s", pod_name, exc)
+            raise
+
+    @classmethod
+    def delete_results_job(cls, pod_name:str, job_name:str):
+        try:
+            KubernetesClient().delete_pod(pod_name)
+            KubernetesBatchClient().delete_job(job_name)
+        except InvalidRequest as exc:
+            logger.error(exc.description)
 
     def create_controller_crd(self):
         """
@@ -519,13 +616,20 @@ class Task(db.Model, BaseModel):
         """
         return REVIEW_STATUS[self.review_status]
 
-    def sanitized_dict(self):
+    def sanitized_dict(self, fields:list[str]=None):
         """
-        Extend the method to add custom status and review
+        Extend the method to add custom status and review.
+        The pod's state columns are only rendered if requested
         """
-        san_dict = super().sanitized_dict()
-        san_dict["status"] = self.get_status()
-        if TASK_REVIEW:
+        if fields is None:
+            fields = [field for field in self._get_serializer() if field not in POD_STATE_FIELDS]
+        san_dict = super().sanitized_dict(fields)
+        if "status" in san_dict:
+            if task_reconciler.is_current():
+                san_dict["status"] = self.get_stored_status()
+            else:
+                san_dict["status"] = self.get_status()
+        if TASK_REVIEW and "review_status" in san_dict:
             san_dict["review_status"] = self.get_review_status()
 
         return san_dict
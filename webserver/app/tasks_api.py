@@ -10,19 +10,22 @@ tasks-related endpoints:
 - POST /tasks/id/results/approve
 - POST /tasks/id/results/block
 """
+import unicodedata
 from datetime import datetime, timedelta
 from http import HTTPStatus
-from flask import Blueprint, request, send_file
+from urllib.parse import quote
+from flask import Blueprint, Response, request
 
 from app.helpers.const import CLEANUP_AFTER_DAYS, PUBLIC_URL, TASK_REVIEW
 from app.helpers.exceptions import (
     DBRecordNotFoundError, FeatureNotAvailableException,
     UnauthorizedError, InvalidRequest
 )
-from app.helpers.keycloak import Keycloak
-from app.helpers.wrappers import audit, auth
+from app.helpers.keycloak import TokenIdentity
+from app.helpers.wrappers import audit, auth, read_replica
 from app.helpers.base_model import db
 from app.helpers.query_filters import parse_query_params
+from app.helpers.zip_stream import iter_folder, stream_zip
 from app.models.task import Task
 
 bp = Blueprint('tasks', __name__, url_prefix='/tasks')
@@ -36,13 +39,24 @@ def does_user_own_task(task:Task):
 
     If they don't, an exception is raised with 403 status code
     """
-    kc_client = Keycloak()
-    token = kc_client.get_token_from_headers()
-    dec_token = kc_client.decode_token(token)
+    identity = TokenIdentity.from_request()
 
-    if task.requested_by != dec_token['sub'] and not kc_client.is_user_admin(token):
+    if task.requested_by != identity.sub and not identity.is_admin:
         raise UnauthorizedError("User does not have enough permissions")
 
+def attachment_names(download_name:str) -> dict[str, str]:
+    """
+    The Content-Disposition filename parameters, as send_file sets them.
+    Non ASCII names are also sent RFC 5987 encoded, in filename*
+    """
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        quoted = quote(download_name, safe="!#$&+-.^_`|~")
+        return {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    return {"filename": download_name}
+
 @bp.route('/service-info', methods=['GET'])
 @audit
 @auth(scope='can_do_admin')
@@ -58,6 +72,7 @@ def get_service_info():
 @bp.route('/', methods=['GET'])
 @bp.route('', methods=['GET'])
 @audit
+@read_replica
 @auth(scope='can_admin_task')
 def get_tasks():
     """
@@ -141,17 +156,29 @@ def get_task_results(task_id):
 
     does_user_own_task(task)
 
-    kc_client = Keycloak()
-    token = kc_client.get_token_from_headers()
     # admin should be able to fetch them regardless
-    if TASK_REVIEW and not task.review_status and not kc_client.is_user_admin(token):
+    if TASK_REVIEW and not task.review_status and not TokenIdentity.from_request().is_admin:
         return {"status": task.get_review_status()}, 400
 
     if task.created_at.date() + timedelta(days=CLEANUP_AFTER_DAYS) <= datetime.now().date():
         return {"error": "Tasks results are not available anymore. Please, run the task again"}, 500
 
-    results_file = task.get_results()
-    return send_file(results_file, download_name=f"{PUBLIC_URL}-{task_id}-results.zip"), 200
+    delete_job = None
+    if task.has_mounted_results():
+        results = stream_zip(iter_folder(task.get_results_path()))
+    else:
+        results, delete_job = task.get_results()
+
+    response = Response(results, mimetype="application/zip")
+    response.headers.set(
+        "Content-Disposition",
+        "attachment",
+        **attachment_names(f"{PUBLIC_URL}-{task_id}-results.zip")
+    )
+    if delete_job:
+        # Also called when the archive is never read, e.g. on HEAD requests
+        response.call_on_close(delete_job)
+    return response, 200
 
 @bp.route('/<task_id>/logs', methods=['GET'])
 @audit
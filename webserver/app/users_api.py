@@ -4,6 +4,7 @@ user-related endpoints:
 - POST /users
 - PUT /users/reset-password
 """
+import math
 from http import HTTPStatus
 from flask import Blueprint, request
 
@@ -65,6 +66,20 @@ def reset_password():
     )
     return '', HTTPStatus.NO_CONTENT
 
+def list_users_page(kc:Keycloak, page:int, per_page:int) -> list[dict]:
+    """
+    The page of users, leaving out the backend admin user.
+    Keycloak can't exclude it, so one more user is fetched, either
+    to fill the page if the admin is in it, or to shift the page
+    by one if the admin is in a previous one.
+    Keycloak sorts the users by username
+    """
+    ls_users = kc.list_users(first=(page - 1) * per_page, max_results=per_page + 1)
+    usernames = [user["username"] for user in ls_users]
+    if ls_users and KEYCLOAK_ADMIN not in usernames and KEYCLOAK_ADMIN < usernames[0]:
+        return ls_users[1:]
+    return [user for user in ls_users if user["username"] != KEYCLOAK_ADMIN][:per_page]
+
 @bp.route('/', methods=['GET'])
 @bp.route('', methods=['GET'])
 @audit
@@ -73,17 +88,44 @@ def get_users_list():
     """
     GET /users/ endpoint. This is a simplified version
     of what keycloak returns as a user list.
+    If page and/or per_page are provided, only that page
+    is fetched from keycloak, and the response is paginated
     """
     kc = Keycloak()
-    ls_users = kc.list_users()
+    paginated = "page" in request.args or "per_page" in request.args
+    if paginated:
+        try:
+            page = int(request.args.get("page", '1'))
+            per_page = int(request.args.get("per_page", '25'))
+        except ValueError as ve:
+            raise InvalidRequest("page and per_page parameters should be integers") from ve
+        if page < 1 or per_page < 1:
+            raise InvalidRequest("page and per_page parameters should be greater than 0")
+
+        ls_users = list_users_page(kc, page, per_page)
+    else:
+        ls_users = [user for user in kc.list_users() if user["username"] != KEYCLOAK_ADMIN]
+
+    users_roles = kc.get_users_roles([user["id"] for user in ls_users])
     normalised_list = [{
             "username": user["username"],
             "email": user["email"],
             "firstName": user.get("firstName", ''),
             "lastName": user.get("lastName", ''),
-            "role": kc.get_user_role(user["id"]),
+            "role": users_roles[user["id"]],
             "needs_to_reset_password": user.get("requiredActions", []) != []
-        } for user in ls_users if user["username"] != KEYCLOAK_ADMIN
+        } for user in ls_users
     ]
 
-    return normalised_list, HTTPStatus.OK
+    if not paginated:
+        return normalised_list, HTTPStatus.OK
+
+    # The backend admin user is part of the realm, but never listed
+    total = max(kc.count_users() - 1, 0)
+    return {
+        "items": normalised_list,
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "pages": math.ceil(total / per_page)
+    }, HTTPStatus.OK
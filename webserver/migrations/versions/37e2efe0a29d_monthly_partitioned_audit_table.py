@@ -0,0 +1,97 @@
+"""Monthly partitioned audit table
+
+Revision ID: 37e2efe0a29d
+Revises: 50181f0b508c
+Create Date: 2026-10-17 10:12:41.508263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '37e2efe0a29d'
+down_revision: Union[str, None] = '50181f0b508c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions are created from the oldest entry to this many months ahead.
+# Later ones are created by app.helpers.audit_partitions
+PARTITIONS_AHEAD = 3
+
+AUDIT_COLUMNS = "id, ip_address, http_method, endpoint, requested_by, status_code, api_function, details, event_time"
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE audit RENAME TO audit_old")
+    op.execute("ALTER TABLE audit_old RENAME CONSTRAINT audit_pkey TO audit_old_pkey")
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE audit (
+            id INTEGER NOT NULL DEFAULT nextval('audit_id_seq'),
+            ip_address VARCHAR(256) NOT NULL,
+            http_method VARCHAR(256) NOT NULL,
+            endpoint VARCHAR(256) NOT NULL,
+            requested_by VARCHAR(256) NOT NULL,
+            status_code INTEGER,
+            api_function VARCHAR(256),
+            details VARCHAR(4096),
+            event_time TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT audit_pkey PRIMARY KEY (id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """)
+    op.execute("ALTER SEQUENCE audit_id_seq OWNED BY audit.id")
+    # One partition per month, from the oldest entry
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month DATE := date_trunc('month', COALESCE((SELECT min(event_time) FROM audit_old), now()));
+        BEGIN
+            WHILE month <= date_trunc('month', now()) + interval '{PARTITIONS_AHEAD} months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF audit FOR VALUES FROM (%L) TO (%L)',
+                    'audit_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                    month,
+                    month + interval '1 month'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+    # Safety net, in case the partitions maintenance does not run for a while
+    op.execute("CREATE TABLE audit_default PARTITION OF audit DEFAULT")
+    op.create_index('ix_audit_event_time', 'audit', ['event_time'])
+    op.create_index('ix_audit_requested_by_event_time', 'audit', ['requested_by', 'event_time'])
+    op.create_index('ix_audit_endpoint_event_time', 'audit', ['endpoint', 'event_time'])
+
+    op.execute(f"""
+        INSERT INTO audit ({AUDIT_COLUMNS})
+        SELECT id, ip_address, http_method, endpoint, requested_by, status_code,
+            api_function, details, COALESCE(event_time, now())
+        FROM audit_old
+    """)
+    op.execute("DROP TABLE audit_old")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE audit RENAME TO audit_partitioned")
+    op.execute("ALTER TABLE audit_partitioned RENAME CONSTRAINT audit_pkey TO audit_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE audit (
+            id INTEGER NOT NULL DEFAULT nextval('audit_id_seq'),
+            ip_address VARCHAR(256) NOT NULL,
+            http_method VARCHAR(256) NOT NULL,
+            endpoint VARCHAR(256) NOT NULL,
+            requested_by VARCHAR(256) NOT NULL,
+            status_code INTEGER,
+            api_function VARCHAR(256),
+            details VARCHAR(4096),
+            event_time TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+            CONSTRAINT audit_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE audit_id_seq OWNED BY audit.id")
+    op.execute(f"INSERT INTO audit ({AUDIT_COLUMNS}) SELECT {AUDIT_COLUMNS} FROM audit_partitioned")
+    # Drops the partitions too
+    op.execute("DROP TABLE audit_partitioned")
@@ -0,0 +1,32 @@
+"""Task pod state
+
+Revision ID: 94acf4d6ab11
+Revises: fefb9b891dd0
+Create Date: 2026-10-17 16:42:08.513207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '94acf4d6ab11'
+down_revision: Union[str, None] = 'fefb9b891dd0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tasks', sa.Column('started_at', sa.DateTime(timezone=False), nullable=True))
+    op.add_column('tasks', sa.Column('finished_at', sa.DateTime(timezone=False), nullable=True))
+    op.add_column('tasks', sa.Column('exit_code', sa.Integer(), nullable=True))
+    op.add_column('tasks', sa.Column('status_reason', sa.String(256), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('tasks', 'status_reason')
+    op.drop_column('tasks', 'exit_code')
+    op.drop_column('tasks', 'finished_at')
+    op.drop_column('tasks', 'started_at')
@@ -0,0 +1,48 @@
+"""Indexes for hot lookups
+
+Revision ID: fefb9b891dd0
+Revises: 37e2efe0a29d
+Create Date: 2026-10-17 14:03:27.184406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fefb9b891dd0'
+down_revision: Union[str, None] = '37e2efe0a29d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Request.get_active_project
+    op.create_index(
+        'ix_requests_project_name_requested_by_proj_end',
+        'requests',
+        ['project_name', 'requested_by', 'proj_end']
+    )
+    # Tasks list filters
+    op.create_index('ix_tasks_requested_by', 'tasks', ['requested_by'])
+    op.create_index('ix_tasks_dataset_id', 'tasks', ['dataset_id'])
+    op.create_index('ix_tasks_status', 'tasks', ['status'])
+    # Task.get_image_with_repo and the containers sync
+    op.create_index('ix_containers_name_registry_id_tag', 'containers', ['name', 'registry_id', 'tag'])
+    op.create_index('ix_containers_name_registry_id_sha', 'containers', ['name', 'registry_id', 'sha'])
+    op.create_index('ix_registries_url', 'registries', ['url'])
+    # Dataset.get_dataset_by_name_or_id
+    op.create_index('ix_datasets_lower_name', 'datasets', [sa.text('lower(name)')])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_datasets_lower_name', table_name='datasets')
+    op.drop_index('ix_registries_url', table_name='registries')
+    op.drop_index('ix_containers_name_registry_id_sha', table_name='containers')
+    op.drop_index('ix_containers_name_registry_id_tag', table_name='containers')
+    op.drop_index('ix_tasks_status', table_name='tasks')
+    op.drop_index('ix_tasks_dataset_id', table_name='tasks')
+    op.drop_index('ix_tasks_requested_by', table_name='tasks')
+    op.drop_index('ix_requests_project_name_requested_by_proj_end', table_name='requests')
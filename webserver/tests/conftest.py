@@ -1,6 +1,8 @@
 import base64
 import copy
+import io
 import os
+import tarfile
 import requests
 from typing import List
 from pytest import fixture
@@ -12,14 +14,18 @@ from unittest.mock import Mock
 
 from app import create_app
 from app.helpers.base_model import db
+from app.helpers.audit_writer import audit_writer
 from app.models.dataset import Dataset
 from app.models.catalogue import Catalogue
 from app.models.dictionary import Dictionary
 from app.models.request import Request
 from app.models.task import Task
-from app.helpers.keycloak import Keycloak, URLS, KEYCLOAK_SECRET, KEYCLOAK_CLIENT
+from app.helpers.keycloak import Keycloak, URLS, KEYCLOAK_SECRET, KEYCLOAK_CLIENT, kc_cache, permission_cache, user_cache, exchanged_token_cache
 from tests.helpers.keycloak import clean_kc
 from app.helpers.exceptions import KeycloakError
+from app.helpers.kubernetes import shared_api_client
+from app.helpers.pod_cache import pod_cache
+from app.helpers.task_reconciler import task_reconciler
 from app.models.task import Task
 from app.helpers.const import CRD_DOMAIN
 
@@ -76,6 +82,34 @@ def user_token(basic_user):
     )
     return exchange_resp.json()["refresh_token"]
 
+@fixture(autouse=True)
+def clear_kc_cache():
+    """
+    The admin token, clients details, permission decisions, users and exchanged
+    tokens are cached process-wide. Some tests mock those requests, so every
+    test starts with a clean cache
+    """
+    kc_cache.clear()
+    permission_cache.invalidate()
+    user_cache.invalidate()
+    exchanged_token_cache.invalidate()
+
+@fixture(autouse=True)
+def disable_pod_cache(mocker):
+    """
+    Tests mock list_namespaced_pod, the pods should
+    always be fetched through it, not from the watch
+    """
+    mocker.patch.object(pod_cache, "enabled", False)
+
+@fixture(autouse=True)
+def disable_task_reconciler(mocker):
+    """
+    The tasks' status is read from the pods, as
+    the DB is not kept in line by the reconciler
+    """
+    mocker.patch.object(task_reconciler, "enabled", False)
+
 @fixture
 def app_ctx(app):
     with app.app_context():
@@ -153,6 +187,7 @@ def client():
         with app.app_context():
             db.create_all()
             yield tclient
+            audit_writer.flush()
             close_all_sessions()
             db.drop_all()
             clean_kc()
@@ -162,6 +197,8 @@ def client():
 def k8s_config(mocker):
     mocker.patch('kubernetes.config.load_kube_config', return_value=Mock())
     mocker.patch('app.helpers.kubernetes.config.load_kube_config', Mock())
+    # Built again with the mocked config and transport
+    mocker.patch.object(shared_api_client, "api_client", None)
 
 @fixture
 def v1_mock(mocker):
@@ -203,9 +240,9 @@ def v1_mock(mocker):
             'app.helpers.kubernetes.KubernetesClient.read_namespaced_pod_log',
             return_value="Example logs\nanother line"
         ),
-        "cp_from_pod_mock": mocker.patch(
-            'app.helpers.kubernetes.KubernetesClient.cp_from_pod',
-            return_value="../tests/files/results.zip"
+        "stream_from_pod_mock": mocker.patch(
+            'app.helpers.kubernetes.KubernetesClient.stream_from_pod',
+            side_effect=lambda *args, **kwargs: iter([build_tar({"results.csv": b"a,b\n1,2\n"})])
         )
     }
 
@@ -347,6 +384,19 @@ def access_request(dataset, user_uuid, k8s_client, dar_user):
     return request
 
 # Conditional url side_effects
+def build_tar(files:dict[str, bytes]) -> bytes:
+    """
+    Tar archive with the given files' contents, as the
+    results archive streamed from a pod
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
 def side_effect(dict_mock:dict):
     """
     This tries to mock dynamically according to what urllib3.requests
@@ -1,3 +1,5 @@
+import io
+import zipfile
 from datetime import timedelta
 from kubernetes.client.exceptions import ApiException
 
@@ -27,6 +29,99 @@ class TestTaskResults:
         assert response.status_code == 200
         assert response.content_type == "application/zip"
 
+    def test_get_results_download_name_is_quoted(
+        self,
+        cr_client,
+        registry_client,
+        simple_admin_header,
+        client,
+        results_job_mock,
+        task_mock,
+        mocker
+    ):
+        """
+        The archive name is quoted in the Content-Disposition
+        header, and RFC 5987 encoded if it's not ASCII
+        """
+        mocker.patch("app.tasks_api.PUBLIC_URL", "nœud fédéré")
+        response = client.get(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Disposition"] == (
+            f'attachment; filename="nud federe-{task_mock.id}-results.zip"; '
+            f"filename*=UTF-8''n%C5%93ud%20f%C3%A9d%C3%A9r%C3%A9-{task_mock.id}-results.zip"
+        )
+        response.close()
+
+    def test_get_results_streamed_from_job(
+        self,
+        simple_admin_header,
+        client,
+        reg_k8s_client,
+        results_job_mock,
+        task_mock
+    ):
+        """
+        The tar from the job's pod is sent as a zip,
+        and the job is deleted once it's been read
+        """
+        response = client.get(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        assert archive.namelist() == ["results.csv"]
+        assert archive.read("results.csv") == b"a,b\n1,2\n"
+        reg_k8s_client["delete_job_mock"].assert_not_called()
+        response.close()
+        reg_k8s_client["delete_namespaced_pod_mock"].assert_called_once()
+        reg_k8s_client["delete_job_mock"].assert_called_once()
+
+    def test_get_results_head_deletes_job(
+        self,
+        simple_admin_header,
+        client,
+        reg_k8s_client,
+        results_job_mock,
+        task_mock
+    ):
+        """
+        The job is deleted even if the archive is never read
+        """
+        response = client.head(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        response.close()
+        reg_k8s_client["stream_from_pod_mock"].assert_called_once()
+        reg_k8s_client["delete_namespaced_pod_mock"].assert_called_once()
+        reg_k8s_client["delete_job_mock"].assert_called_once()
+
+    def test_get_results_exec_failure(
+        self,
+        simple_admin_header,
+        client,
+        reg_k8s_client,
+        results_job_mock,
+        task_mock
+    ):
+        """
+        Failing to connect to the job's pod returns an error,
+        rather than an empty archive
+        """
+        reg_k8s_client["stream_from_pod_mock"].side_effect = ApiException(status=0, reason="Handshake status 500")
+
+        response = client.get(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 400
+        assert response.json["error"] == 'Failed to run pod: Handshake status 500'
+
     def test_get_results_job_creation_failure(
         self,
         cr_client,
@@ -51,6 +146,61 @@ class TestTaskResults:
         assert response.status_code == 400
         assert response.json["error"] == 'Failed to run pod: Something went wrong'
 
+    def test_get_results_from_mount(
+        self,
+        simple_admin_header,
+        client,
+        reg_k8s_client,
+        results_job_mock,
+        task_mock,
+        tmp_path,
+        mocker
+    ):
+        """
+        When the results are on the backend's volume, they are
+        archived from there, and no job is created
+        """
+        mocker.patch('app.models.task.RESULTS_PATH', str(tmp_path))
+        results_dir = tmp_path / str(task_mock.id) / "results"
+        (results_dir / "plots").mkdir(parents=True)
+        (results_dir / "output.csv").write_text("a,b\n1,2\n")
+        (results_dir / "plots" / "plot.png").write_bytes(b"png")
+
+        response = client.get(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        assert response.content_type == "application/zip"
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        assert sorted(archive.namelist()) == ["output.csv", "plots/", "plots/plot.png"]
+        assert archive.read("output.csv") == b"a,b\n1,2\n"
+        reg_k8s_client["create_namespaced_job_mock"].assert_not_called()
+
+    def test_get_results_empty_mount_uses_job(
+        self,
+        simple_admin_header,
+        client,
+        reg_k8s_client,
+        results_job_mock,
+        task_mock,
+        tmp_path,
+        mocker
+    ):
+        """
+        An empty results folder might not be the task's volume,
+        the results are copied from a job's pod instead
+        """
+        mocker.patch('app.models.task.RESULTS_PATH', str(tmp_path))
+        (tmp_path / str(task_mock.id) / "results").mkdir(parents=True)
+
+        response = client.get(
+            f'/tasks/{task_mock.id}/results',
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        reg_k8s_client["create_namespaced_job_mock"].assert_called_once()
+
     def test_results_not_found_with_expired_date(
         self,
         simple_admin_header,
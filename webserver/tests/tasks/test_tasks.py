@@ -72,12 +72,8 @@ class TestGetTasks:
         )
         assert resp.status_code == 200
 
-    @mock.patch('app.helpers.keycloak.Keycloak.is_user_admin', return_value=False)
-    @mock.patch('app.tasks_api.Keycloak.decode_token')
     def test_get_task_by_id_non_admin_owner(
             self,
-            mocks_decode,
-            mock_is_admin,
             mocks_kc_tasks,
             simple_user_header,
             client,
@@ -88,7 +84,9 @@ class TestGetTasks:
         """
         If a user wants to check a specific task they should be allowed if they did request it
         """
-        mocks_decode.return_value = {"sub": basic_user["id"]}
+        # The token is decoded once in the auth wrapper, and reused
+        mocks_kc_tasks["wrappers"].return_value.decode_token.return_value = {"sub": basic_user["id"]}
+        mocks_kc_tasks["wrappers"].return_value.is_user_admin.return_value = False
         task.requested_by = basic_user["id"]
         resp = client.get(
             f'/tasks/{task.id}',
@@ -96,10 +94,8 @@ class TestGetTasks:
         )
         assert resp.status_code == 200, resp.json
 
-    @mock.patch('app.helpers.keycloak.Keycloak.is_user_admin', return_value=False)
     def test_get_task_by_id_non_admin_non_owner(
             self,
-            mock_is_admin,
             mocks_kc_tasks,
             simple_user_header,
             client,
@@ -108,6 +104,7 @@ class TestGetTasks:
         """
         If a user wants to check a specific task they should not be allowed if they did not request it
         """
+        mocks_kc_tasks["wrappers"].return_value.is_user_admin.return_value = False
         task_obj = db.session.get(Task, task.id)
         task_obj.requested_by = "some random uuid"
 
@@ -1,11 +1,55 @@
 import json
-from datetime import datetime
-from sqlalchemy import select
+import pytest
+from datetime import date, datetime
+from unittest import mock
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
 
-from app.helpers.base_model import db
+from app.helpers.audit_partitions import add_months, create_partitions, drop_old_partitions, list_partitions
+from app.helpers.audit_writer import AuditWriter, audit_writer
+from app.helpers.base_model import db, engine
 from app.models.audit import Audit
 
 
+@pytest.fixture
+def partitioned_audit(client):
+    """
+    The audit table partitioned by month, as the migrations
+    create it, with only the default partition
+    """
+    audit_writer.flush()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE audit"))
+        conn.execute(text("""
+            CREATE TABLE audit (
+                id SERIAL,
+                ip_address VARCHAR(256) NOT NULL,
+                http_method VARCHAR(256) NOT NULL,
+                endpoint VARCHAR(256) NOT NULL,
+                requested_by VARCHAR(256) NOT NULL,
+                status_code INTEGER,
+                api_function VARCHAR(256),
+                details VARCHAR(4096),
+                event_time TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+                CONSTRAINT audit_pkey PRIMARY KEY (id, event_time)
+            ) PARTITION BY RANGE (event_time)
+        """))
+        conn.execute(text("CREATE TABLE audit_default PARTITION OF audit DEFAULT"))
+
+@pytest.fixture
+def audit_entry():
+    return {
+        "ip_address": "127.0.0.1",
+        "http_method": "GET",
+        "endpoint": "/datasets",
+        "requested_by": "",
+        "status_code": 200,
+        "api_function": "get_datasets",
+        "details": None,
+        "event_time": datetime.now()
+    }
+
+
 class TestAudits:
     def test_get_audit_events(
             self,
@@ -18,6 +62,7 @@ class TestAudits:
         """
         r = client.get("/datasets/", headers=simple_admin_header)
         assert r.status_code == 200, r.text
+        audit_writer.flush()
         list_audit = db.session.execute(select(Audit)).all()
         assert len(list_audit) > 0
         response = client.get("/audit", headers=simple_admin_header)
@@ -58,6 +103,7 @@ class TestAudits:
         """
         response = client.get("/datasets", headers=post_json_admin_header)
         assert response.status_code == 200
+        audit_writer.flush()
         log = Audit.query.filter(Audit.endpoint == '/datasets').one_or_none()
         assert log.details is None
 
@@ -96,9 +142,272 @@ class TestAudits:
 
         # Request will fail as secret is not recognized as dictionaries field
         assert resp.status_code == 201, resp.json
+        audit_writer.flush()
         audit_list = Audit.query.all()[-1]
         details = json.loads(audit_list.details.replace("'", "\""))
 
         assert details["password"] == '*****'
         assert details["username"] == '*****'
         assert details["dictionaries"][0]["password"] == '*****'
+
+    def test_entries_are_written_in_batches(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that queued entries are written with a single insert
+        """
+        writer = AuditWriter(batch_size=10, flush_interval_ms=1000, spool_path=str(tmp_path / "spool"))
+        for _ in range(3):
+            writer.put(audit_entry.copy())
+        writer.flush()
+
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 3
+        writer.stop()
+
+    def test_entries_are_spooled_if_db_unavailable(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that entries are kept in the spool file when the DB
+        can't be reached, and written once it's back
+        """
+        spool_path = tmp_path / "spool"
+        writer = AuditWriter(batch_size=1, flush_interval_ms=10, spool_path=str(spool_path))
+        with mock.patch(
+            "app.helpers.audit_writer.engine.begin",
+            side_effect=OperationalError("INSERT", {}, Exception("DB down"))
+        ):
+            writer.put(audit_entry.copy())
+            writer.flush()
+        assert len(spool_path.read_text().splitlines()) == 1
+        assert Audit.query.count() == 0
+
+        writer.put(audit_entry.copy())
+        writer.flush()
+        assert not spool_path.exists()
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 2
+        writer.stop()
+
+    def test_spool_is_replayed_in_batches(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that the spool file is written batch_size entries at
+        a time, and that if the DB goes down halfway only the
+        entries not written yet are kept in it
+        """
+        spool_path = tmp_path / "spool"
+        writer = AuditWriter(batch_size=2, flush_interval_ms=10, spool_path=str(spool_path))
+        writer._append_to_spool([audit_entry.copy() for _ in range(5)])
+
+        begin = engine.begin
+        calls = []
+        def flaky_begin():
+            calls.append(1)
+            if len(calls) > 1:
+                raise OperationalError("INSERT", {}, Exception("DB down"))
+            return begin()
+
+        with mock.patch("app.helpers.audit_writer.engine.begin", side_effect=flaky_begin):
+            writer._write([])
+        assert len(spool_path.read_text().splitlines()) == 3
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 2
+
+        writer._write([audit_entry.copy()])
+        assert not spool_path.exists()
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 6
+
+    def test_only_unwritten_entries_are_spooled(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that if the DB goes down while the entries are
+        inserted one by one, the ones already written aren't spooled
+        """
+        spool_path = tmp_path / "spool"
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_path=str(spool_path))
+
+        begin = engine.begin
+        calls = []
+        def flaky_begin():
+            calls.append(1)
+            if len(calls) == 4:
+                raise OperationalError("INSERT", {}, Exception("DB down"))
+            return begin()
+
+        with mock.patch("app.helpers.audit_writer.engine.begin", side_effect=flaky_begin):
+            writer._write([
+                {**audit_entry, "ip_address": None},
+                audit_entry.copy(),
+                audit_entry.copy(),
+                audit_entry.copy()
+            ])
+        assert len(spool_path.read_text().splitlines()) == 2
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 1
+
+    def test_oversized_values_are_truncated(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that values longer than their column, e.g. a large
+        request body, are cut to fit rather than failing the insert
+        """
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_path=str(tmp_path / "spool"))
+        writer.put({**audit_entry, "details": "a" * 5000, "endpoint": "/datasets/" + "b" * 300})
+        writer.flush()
+
+        entry = Audit.query.filter(Audit.api_function == "get_datasets").one()
+        assert len(entry.details) == 4096
+        assert len(entry.endpoint) == 256
+        assert not (tmp_path / "spool").exists()
+        writer.stop()
+
+    def test_rejected_entries_do_not_block_others(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that an entry the DB can never accept is dropped,
+        not spooled, and the rest of its batch is written
+        """
+        spool_path = tmp_path / "spool"
+        writer = AuditWriter(batch_size=10, flush_interval_ms=1000, spool_path=str(spool_path))
+        writer.put(audit_entry.copy())
+        writer.put({**audit_entry, "ip_address": None})
+        writer.put(audit_entry.copy())
+        writer.flush()
+
+        assert not spool_path.exists()
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 2
+
+        writer.put(audit_entry.copy())
+        writer.flush()
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 3
+        writer.stop()
+
+    def test_pending_entries_written_on_stop(
+        self,
+        client,
+        audit_entry,
+        tmp_path
+    ):
+        """
+        Tests that stopping the writer does not lose queued entries
+        """
+        writer = AuditWriter(batch_size=100, flush_interval_ms=60000, spool_path=str(tmp_path / "spool"))
+        writer.put(audit_entry.copy())
+        writer.stop()
+
+        assert not writer.thread.is_alive()
+        assert Audit.query.filter(Audit.api_function == "get_datasets").count() == 1
+
+
+class TestAuditPartitions:
+    def test_add_months(
+        self
+    ):
+        """
+        Tests that months are added across years
+        """
+        assert add_months(date(2025, 11, 15), 0) == date(2025, 11, 1)
+        assert add_months(date(2025, 11, 15), 3) == date(2026, 2, 1)
+        assert add_months(date(2025, 1, 31), -1) == date(2024, 12, 1)
+
+    def test_create_partitions(
+        self,
+        mocker
+    ):
+        """
+        Tests that only the missing partitions are created,
+        each in its own transaction
+        """
+        mocker.patch(
+            "app.helpers.audit_partitions.list_partitions",
+            return_value=["audit_y2025m11", "audit_default"]
+        )
+        engine = mocker.patch("app.helpers.audit_partitions.engine")
+        conn = engine.begin.return_value.__enter__.return_value
+        created = create_partitions(date(2025, 11, 20), months_ahead=2)
+
+        assert created == ["audit_y2025m12", "audit_y2026m01"]
+        assert engine.begin.call_count == 2
+        statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+        assert "DETACH PARTITION audit_default" in statements[0]
+        assert "FROM ('2025-12-01') TO ('2026-01-01')" in statements[1]
+        assert "ATTACH PARTITION audit_default DEFAULT" in statements[3]
+
+    def test_create_partitions_failure(
+        self,
+        mocker
+    ):
+        """
+        Tests that failing to create a partition doesn't stop the others
+        """
+        mocker.patch("app.helpers.audit_partitions.list_partitions", return_value=[])
+        engine = mocker.patch("app.helpers.audit_partitions.engine")
+        conn = engine.begin.return_value.__enter__.return_value
+        conn.execute.side_effect = [OperationalError("CREATE", {}, Exception("locked")), None]
+
+        assert create_partitions(date(2025, 11, 20), months_ahead=1) == ["audit_y2025m12"]
+
+    def test_drop_old_partitions(
+        self,
+        mocker
+    ):
+        """
+        Tests that only the partitions entirely older than
+        the retention period are dropped, and never the default one
+        """
+        mocker.patch(
+            "app.helpers.audit_partitions.list_partitions",
+            return_value=["audit_y2024m12", "audit_y2025m01", "audit_y2025m02", "audit_default"]
+        )
+        mocker.patch("app.helpers.audit_partitions.engine")
+
+        assert drop_old_partitions(date(2025, 3, 10), retention_months=1) == [
+            "audit_y2024m12", "audit_y2025m01"
+        ]
+        assert drop_old_partitions(date(2025, 3, 10), retention_months=0) == []
+
+    def test_default_partition_entries_are_moved(
+        self,
+        partitioned_audit
+    ):
+        """
+        Tests that entries in the default partition, for a month without
+        a partition yet, don't prevent creating it, and are moved into it
+        """
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO audit (ip_address, http_method, endpoint, requested_by, event_time) "
+                "VALUES ('127.0.0.1', 'GET', '/datasets', '', '2030-05-10'), "
+                "('127.0.0.1', 'GET', '/datasets', '', '2030-07-10')"
+            ))
+
+        assert create_partitions(date(2030, 5, 1), months_ahead=0) == ["audit_y2030m05"]
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM audit_y2030m05")).scalar() == 1
+            assert conn.execute(text("SELECT count(*) FROM audit_default")).scalar() == 1
+            assert conn.execute(text("SELECT count(*) FROM audit")).scalar() == 2
+            assert "audit_default" in list_partitions(conn)
+
+        assert drop_old_partitions(date(2030, 8, 1), retention_months=1) == ["audit_y2030m05"]
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM audit")).scalar() == 1
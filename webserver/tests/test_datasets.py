@@ -445,6 +445,31 @@ class TestPostDataset(MixinTestDataset):
 
         self.assert_datasets_by_name(data_body['name'], count=0)
 
+    def test_post_dataset_keycloak_lookup_fails(
+            self,
+            post_json_admin_header,
+            client,
+            k8s_client,
+            dataset_post_body,
+            mocker
+        ):
+        """
+        /datasets POST doesn't create the dataset admin policy
+        if the policies or scopes lookup fails
+        """
+        mocker.patch(
+            'app.models.dataset.Keycloak.get_scope',
+            side_effect=KeycloakError("Failed to fetch scope")
+        )
+        create_policy = mocker.patch('app.models.dataset.Keycloak.create_policy')
+        data_body = dataset_post_body.copy()
+        data_body['name'] = 'TestDs78'
+        resp = client.post("/datasets", json=data_body, headers=post_json_admin_header)
+
+        assert resp.status_code != 201
+        create_policy.assert_not_called()
+        self.assert_datasets_by_name(data_body['name'], count=0)
+
     @mock.patch('app.datasets_api.Dataset.add')
     def test_post_dataset_k8s_secrets_exists(
             self,
@@ -743,11 +768,13 @@ class TestPatchDataset(MixinTestDataset):
         mock_kc_patch_api.return_value.patch_resource.return_value = Mock()
         mock_kc_patch_api.return_value.get_user_by_id.return_value = {"email": dar_user}
 
-        response = client.patch(
-            f"/datasets/{dataset.id}",
-            json=data_body,
-            headers=post_json_admin_header
-        )
+        # The DAR clients are instanced through AsyncKeycloak.create
+        with mock.patch('app.helpers.keycloak_async.Keycloak', mock_kc_patch_api):
+            response = client.patch(
+                f"/datasets/{dataset.id}",
+                json=data_body,
+                headers=post_json_admin_header
+            )
         assert response.status_code == 202
         ds = Dataset.query.filter(Dataset.id == dataset.id).one_or_none()
         assert ds.name == "new_name"
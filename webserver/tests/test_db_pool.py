@@ -0,0 +1,205 @@
+import pytest
+from flask import g
+from sqlalchemy import create_engine, update
+from sqlalchemy.exc import OperationalError
+from unittest.mock import Mock
+
+from app.helpers.base_model import db, engine
+from app.helpers.const import build_sql_uri
+from app.helpers.db_pool import InstrumentedQueuePool, PoolMetrics, ReplicaMonitor, create_pooled_engine
+from app.models.dataset import Dataset
+
+
+@pytest.fixture
+def replica(mocker):
+    """
+    A second engine on the same DB, standing in for the replica
+    """
+    replica_engine = create_engine(build_sql_uri())
+    mocker.patch('app.helpers.base_model.replica_engine', replica_engine)
+    mocker.patch('app.helpers.base_model.replica_monitor', Mock(is_available=Mock(return_value=True)))
+    yield replica_engine
+    replica_engine.dispose()
+
+
+class TestDBPool:
+    def test_single_engine(
+            self,
+            client
+        ):
+        """
+        Flask-SQLAlchemy should use the shared engine
+        """
+        with client.application.app_context():
+            assert db.engine is engine
+        assert isinstance(engine.pool, InstrumentedQueuePool)
+
+    def test_checkouts_are_recorded(
+            self,
+            client
+        ):
+        """
+        Getting a connection from the pool updates the metrics
+        """
+        checkouts = engine.pool.metrics.as_dict()["checkouts"]
+        with engine.connect():
+            assert engine.pool.checkedout() >= 1
+        assert engine.pool.metrics.as_dict()["checkouts"] > checkouts
+
+    def test_pool_metrics(self):
+        """
+        Checks the wait times and timeouts are aggregated
+        """
+        metrics = PoolMetrics()
+        metrics.record_checkout(0.5)
+        metrics.record_checkout(0.1)
+        metrics.record_checkout(2, timed_out=True)
+        assert metrics.as_dict() == {
+            "checkouts": 2,
+            "timeouts": 1,
+            "wait_total_seconds": 2.6,
+            "wait_max_seconds": 2
+        }
+
+    def test_get_metrics(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Admins can see the pool usage
+        """
+        resp = client.get("/metrics", headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert set(resp.json["db_pool"].keys()) == {"primary"}
+        assert set(resp.json["db_pool"]["primary"].keys()) >= {"size", "in_use", "overflow", "checkouts", "wait_max_seconds"}
+        assert "keycloak" in resp.json
+
+    def test_get_metrics_per_engine(
+            self,
+            client,
+            simple_admin_header,
+            mocker
+        ):
+        """
+        Each engine's pool has its own metrics
+        """
+        replica_engine = create_pooled_engine(build_sql_uri())
+        mocker.patch('app.admin_api.replica_engine', replica_engine)
+        assert replica_engine.pool.metrics is not engine.pool.metrics
+
+        with replica_engine.connect():
+            pass
+        resp = client.get("/metrics", headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["db_pool"]["replica"]["checkouts"] == 1
+        assert resp.json["db_pool"]["primary"]["checkouts"] > 0
+
+        replica_engine.dispose()
+        assert replica_engine.pool.metrics.as_dict()["checkouts"] == 1
+
+    def test_get_metrics_non_admin(
+            self,
+            client,
+            simple_user_header
+        ):
+        """
+        Non-admin users can't see the metrics
+        """
+        resp = client.get("/metrics", headers=simple_user_header)
+        assert resp.status_code == 403
+
+
+class TestReplicaRouting:
+    def test_reads_go_to_the_replica(
+            self,
+            client,
+            replica
+        ):
+        """
+        Only queries in a read-only route use the replica
+        """
+        assert db.session.get_bind() is engine
+        g.read_replica = True
+        assert db.session.get_bind() is replica
+        assert db.session.get_bind(clause=update(Dataset).values(name="a")) is engine
+        g.pop("read_replica")
+        assert db.session.get_bind() is engine
+
+    def test_unavailable_replica(
+            self,
+            client,
+            replica,
+            mocker
+        ):
+        """
+        If the replica is not usable, the primary is
+        """
+        mocker.patch('app.helpers.base_model.replica_monitor', Mock(is_available=Mock(return_value=False)))
+        g.read_replica = True
+        assert db.session.get_bind() is engine
+        g.pop("read_replica")
+
+    def test_read_only_endpoint(
+            self,
+            client,
+            replica,
+            dataset,
+            simple_admin_header
+        ):
+        """
+        A read-only endpoint works on the replica
+        """
+        resp = client.get('/datasets', headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["items"][0]["id"] == dataset.id
+
+
+    def test_failing_replica(
+            self,
+            client,
+            dataset,
+            simple_admin_header,
+            mocker
+        ):
+        """
+        A read-only endpoint falls back to the primary
+        when its queries fail on the replica
+        """
+        replica_engine = create_engine(build_sql_uri(port="1"))
+        mocker.patch('app.helpers.base_model.replica_engine', replica_engine)
+        mocker.patch('app.helpers.base_model.replica_monitor', Mock(is_available=Mock(return_value=True)))
+
+        resp = client.get('/datasets', headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["items"][0]["id"] == dataset.id
+        replica_engine.dispose()
+
+
+class TestReplicaMonitor:
+    @pytest.fixture
+    def monitor(self):
+        replica_engine = create_engine(build_sql_uri())
+        yield ReplicaMonitor(replica_engine, max_lag=5, check_interval=60)
+        replica_engine.dispose()
+
+    def test_available(self, monitor):
+        """
+        The primary is never lagging, so it's a valid replica
+        """
+        assert monitor.get_lag() == 0
+        assert monitor.is_available()
+
+    def test_lagging(self, monitor, mocker):
+        mocker.patch.object(monitor, "get_lag", return_value=10)
+        assert not monitor.is_available()
+
+    def test_not_reachable(self, monitor, mocker):
+        mocker.patch.object(monitor, "get_lag", side_effect=OperationalError("SELECT", {}, Exception("down")))
+        assert not monitor.is_available()
+
+    def test_check_is_cached(self, monitor, mocker):
+        get_lag = mocker.patch.object(monitor, "get_lag", return_value=0)
+        assert monitor.is_available()
+        assert monitor.is_available()
+        get_lag.assert_called_once()
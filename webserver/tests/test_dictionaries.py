@@ -70,6 +70,37 @@ class TestDictionaries(MixinTestDataset):
         for i in range(0, len(data_body["dictionaries"])):
             assert response.json[i].items() >= data_body["dictionaries"][i].items()
 
+    def test_admin_get_dictionaries_sparse_fields(
+            self,
+            client,
+            dataset,
+            dataset_post_body,
+            post_json_admin_header,
+            simple_admin_header
+    ):
+        """
+        Check that only the fields requested are returned
+        """
+        data_body = dataset_post_body.copy()
+        data_body['name'] = 'TestDs78'
+        resp_ds = self.post_dataset(client, post_json_admin_header, data_body)
+        response = client.get(
+            f"/datasets/{resp_ds["dataset_id"]}/dictionaries",
+            query_string={"fields": "id,field_name"},
+            headers=simple_admin_header
+        )
+        assert response.status_code == 200
+        assert len(response.json) == len(data_body["dictionaries"])
+        for item in response.json:
+            assert set(item.keys()) == {"id", "field_name"}
+
+        response = client.get(
+            f"/datasets/{resp_ds["dataset_id"]}/dictionaries",
+            query_string={"fields": "id,secret"},
+            headers=simple_admin_header
+        )
+        assert response.status_code == 400
+
     def test_edit_existing_dictionary(
             self,
             client,
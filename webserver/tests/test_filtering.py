@@ -1,3 +1,4 @@
+from app.helpers.audit_writer import audit_writer
 from app.models.audit import Audit
 
 def test_filter_by_date(
@@ -17,6 +18,7 @@ def test_filter_by_date(
     client.get('/datasets/', headers=simple_admin_header)
     client.get('/datasets/', headers=simple_admin_header)
     client.get('/datasets/', headers=simple_admin_header)
+    audit_writer.flush()
 
     date_filter = Audit.query.all()[1].event_time
     filters = {
@@ -32,3 +34,80 @@ def test_filter_by_date(
         resp = client.get("/audit", query_string={f"event_time{fil}": date_filter}, headers=simple_admin_header)
         assert resp.status_code == 200
         assert resp.json["total"] == expected_results
+
+
+def test_filter_in_like_isnull(
+        client,
+        simple_admin_header,
+):
+    """
+    Testing the filters that take more than a plain value
+        - __in     => any of the comma separated values
+        - __like   => SQL LIKE pattern
+        - __isnull => true or false
+    """
+    client.get('/datasets/', headers=simple_admin_header)
+    client.get('/containers', headers=simple_admin_header)
+    audit_writer.flush()
+
+    filters = {
+        "endpoint__in": ("/datasets/,/containers", 2),
+        "endpoint__like": ("/data%", 1),
+        "status_code__isnull": ("false", 2),
+        "api_function__isnull": ("true", 0),
+    }
+    for fil, (value, expected_results) in filters.items():
+        resp = client.get("/audit", query_string={fil: value}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["total"] == expected_results
+
+
+def test_filter_values_are_coerced(
+        client,
+        simple_admin_header,
+):
+    """
+    Values that can't be converted to the field type,
+    and unknown fields or filters, are rejected
+    """
+    client.get('/datasets/', headers=simple_admin_header)
+    audit_writer.flush()
+
+    resp = client.get("/audit", query_string={"status_code__in": "200,201"}, headers=simple_admin_header)
+    assert resp.status_code == 200
+    assert resp.json["total"] == 1
+
+    for fil, value in [
+        ("status_code", "ok"),
+        ("event_time__gte", "yesterday"),
+        ("status_code__isnull", "maybe"),
+        ("not_a_field", "1"),
+        ("status_code__between", "1"),
+        ("id__like", "1"),
+        ("event_time__like", "2024%"),
+        ("", "1"),
+    ]:
+        resp = client.get("/audit", query_string={fil: value}, headers=simple_admin_header)
+        assert resp.status_code == 400
+
+
+def test_filter_in_with_estimated_count(
+        client,
+        simple_admin_header,
+):
+    """
+    The estimated count explains the query with the
+    __in values expanded, as they would be when executed
+    """
+    client.get('/datasets/', headers=simple_admin_header)
+    client.get('/containers', headers=simple_admin_header)
+    audit_writer.flush()
+
+    resp = client.get(
+        "/audit",
+        query_string={"endpoint__in": "/datasets/,/containers", "count": "estimate"},
+        headers=simple_admin_header
+    )
+    assert resp.status_code == 200
+    assert len(resp.json["items"]) == 2
+    assert isinstance(resp.json["total"], int)
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+from app.helpers.base_model import engine
+from app.helpers.exceptions import DBError, DBRecordNotFoundError, TaskExecutionException
+from app.helpers.query_filters import parse_query_params
+from app.models.container import Container
+from app.models.dataset import Dataset
+from app.models.request import Request
+from app.models.task import Task
+from tests.fixtures.azure_cr_fixtures import *
+
+
+@contextmanager
+def captured_statements(table:str):
+    """
+    Collects the SQL statements, and their parameters,
+    sent to the DB selecting from table
+    """
+    statements = []
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if f"FROM {table}" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _capture)
+
+
+def get_index_names(plan:dict) -> set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for sub_plan in plan.get("Plans", []):
+        names |= get_index_names(sub_plan)
+    return names
+
+
+def explain_indexes(statements:list[tuple]) -> list[set[str]]:
+    """
+    Returns the indexes used by each of the statements
+    """
+    used = []
+    with engine.begin() as conn:
+        # The test tables are almost empty, so the planner would
+        # prefer a sequential scan, even with a usable index
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+            used.append(get_index_names(plan[0]["Plan"]))
+    return used
+
+
+class TestIndexes:
+    """
+    Checks that the lookups running on most requests can use an index
+    """
+    def test_active_project_lookup(self, client):
+        with captured_statements("requests") as statements:
+            with pytest.raises(DBError):
+                Request.get_active_project("project", "user_id")
+
+        assert statements
+        for used in explain_indexes(statements):
+            assert "ix_requests_project_name_requested_by_proj_end" in used
+
+    @pytest.mark.parametrize("kwargs", [{"name": "Dataset"}, {"id": 1}, {"name": "Dataset", "id": 1}])
+    def test_dataset_lookup(self, client, kwargs):
+        with captured_statements("datasets") as statements:
+            with pytest.raises(DBRecordNotFoundError):
+                Dataset.get_dataset_by_name_or_id(**kwargs)
+
+        assert statements
+        for used in explain_indexes(statements):
+            assert used & {"ix_datasets_lower_name", "datasets_pkey"}
+
+    def test_dataset_lookup_case_insensitive(self, client, dataset):
+        assert Dataset.get_dataset_by_name_or_id(name=dataset.name.upper()).id == dataset.id
+
+    @pytest.mark.parametrize("field,index", [
+        ("requested_by", "ix_tasks_requested_by"),
+        ("dataset_id", "ix_tasks_dataset_id"),
+        ("status", "ix_tasks_status")
+    ])
+    def test_tasks_list_filters(self, client, field, index):
+        with captured_statements("tasks") as statements:
+            parse_query_params(Task, {field: "1"})
+
+        assert statements
+        for used in explain_indexes(statements):
+            assert index in used
+
+    def test_image_lookup(self, client, registry):
+        with captured_statements("registries") as registry_statements:
+            with captured_statements("containers") as statements:
+                with pytest.raises(TaskExecutionException):
+                    Task.get_image_with_repo(f"{registry.url}/example:latest")
+
+        assert statements
+        for used in explain_indexes(statements):
+            assert used & {"ix_containers_name_registry_id_tag", "ix_containers_name_registry_id_sha"}
+
+        assert registry_statements
+        for used in explain_indexes(registry_statements):
+            assert "ix_registries_url" in used
+
+    def test_containers_sync_lookup(self, client, registry):
+        """
+        Same query as in the containers sync
+        """
+        for key in ["tag", "sha"]:
+            with captured_statements("containers") as statements:
+                Container.query.filter(
+                    Container.name=="example",
+                    getattr(Container, key)=="latest",
+                    Container.registry_id==registry.id
+                ).one_or_none()
+
+            assert statements
+            for used in explain_indexes(statements):
+                assert f"ix_containers_name_registry_id_{key}" in used
@@ -1,7 +1,19 @@
+import json
+import threading
+import jwt
 import pytest
+import requests
 import responses
-from app.helpers.exceptions import KeycloakError
-from app.helpers.keycloak import URLS, Keycloak
+from datetime import datetime, timedelta, timezone
+from cryptography.hazmat.primitives.asymmetric import rsa
+from unittest.mock import Mock
+from app.helpers.exceptions import AuthenticationError, KeycloakError, UnauthorizedError
+from app.helpers.keycloak import (
+    URLS, Keycloak, KeycloakSession, PermissionCache,
+    TokenIdentity, UserCache, kc_cache, kc_session, permission_cache,
+    exchanged_token_cache
+)
+from app.helpers.keycloak_async import AsyncKeycloak, run_sync
 
 class TestKeycloakResponseFailures:
     """
@@ -100,6 +112,8 @@ class TestKeycloakResponseFailures:
         keycloak API returns != 200 on fetching the client secret
         """
         kc_client = Keycloak()
+        # The secret has been cached on init
+        kc_cache.client_secrets.clear()
         # Mocking the requests for the specific token
         with responses.RequestsMock() as rsps:
             # Mocking self.get_admin_token_global() request to be successful
@@ -398,3 +412,721 @@ class TestKeycloakResponseFailures:
             with pytest.raises(KeycloakError) as exc:
                 kc_client.create_user(**{'email': 'some@email.com'})
             assert exc.value.description == 'Failed to create the user'
+
+
+class TestKeycloakCache:
+    """
+    Collection of tests to make sure the admin token and the clients'
+        details are fetched once and shared across Keycloak instances
+    """
+    def mock_init_requests(self, rsps:responses.RequestsMock, expires_in:int=300):
+        rsps.add(
+            responses.POST,
+            URLS["get_token"],
+            json={"access_token": "admin token", "expires_in": expires_in},
+            status=200
+        )
+        rsps.add(
+            responses.GET,
+            URLS["client"] + "?clientId=global",
+            json=[{"id": "global-id"}],
+            status=200
+        )
+        rsps.add(
+            responses.GET,
+            URLS["client_secret"] % "global-id",
+            json={"value": "secret"},
+            status=200
+        )
+
+    def test_init_is_cached(
+            self
+    ):
+        """
+        Test that instancing Keycloak multiple times only
+        reaches Keycloak on the first one
+        """
+        with responses.RequestsMock() as rsps:
+            self.mock_init_requests(rsps)
+            Keycloak()
+            kc_client = Keycloak()
+            assert len(rsps.calls) == 3
+
+        assert kc_client.admin_token == "admin token"
+        assert kc_client.client_id == "global-id"
+        assert kc_client.client_secret == "secret"
+
+    def test_admin_token_renewed_before_expiring(
+            self
+    ):
+        """
+        Test that an admin token that is about to expire
+        is requested again, while the client details are not
+        """
+        with responses.RequestsMock() as rsps:
+            self.mock_init_requests(rsps, expires_in=10)
+            Keycloak()
+            Keycloak()
+            token_calls = [call for call in rsps.calls if call.request.url == URLS["get_token"]]
+            assert len(token_calls) == 2
+            assert len(rsps.calls) == 4
+
+    def test_clear_cache(
+            self
+    ):
+        """
+        Test that clearing the cache forces a new fetch
+        """
+        with responses.RequestsMock() as rsps:
+            self.mock_init_requests(rsps)
+            Keycloak()
+            kc_cache.clear()
+            Keycloak()
+            assert len(rsps.calls) == 6
+
+    def test_client_details_expire(
+            self,
+            mocker
+    ):
+        """
+        Test that the clients' ids and secrets are fetched
+        again once they expire, while the admin token is not
+        """
+        mocker.patch("app.helpers.keycloak.CLIENT_CACHE_TTL", 10)
+        monotonic = mocker.patch("app.helpers.keycloak.time.monotonic", return_value=1000)
+        with responses.RequestsMock() as rsps:
+            self.mock_init_requests(rsps)
+            Keycloak()
+            monotonic.return_value = 1011
+            Keycloak()
+            token_calls = [call for call in rsps.calls if call.request.url == URLS["get_token"]]
+            assert len(token_calls) == 1
+            assert len(rsps.calls) == 5
+
+
+@pytest.fixture
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+@pytest.fixture
+def realm_certs(rsa_key):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(rsa_key.public_key()))
+    jwk.update({"kid": "test-kid", "alg": "RS256", "use": "sig"})
+    return {"keys": [jwk]}
+
+@pytest.fixture
+def access_token_factory(rsa_key):
+    def _make_token(kid="test-kid", expires_in=300, **claims):
+        payload = {
+            "exp": datetime.now(tz=timezone.utc) + timedelta(seconds=expires_in),
+            "sub": "user-id",
+            "typ": "Bearer",
+            "azp": "global",
+            "preferred_username": "some_user",
+            "realm_access": {"roles": ["Users"]}
+        }
+        payload.update(claims)
+        return jwt.encode(payload, rsa_key, algorithm="RS256", headers={"kid": kid})
+    return _make_token
+
+
+class TestLocalTokenValidation:
+    """
+    Collection of tests for the access token verification
+        through the realm public keys, without introspection
+    """
+    def test_decode_access_token_locally(
+            self,
+            realm_certs,
+            access_token_factory
+    ):
+        """
+        Test that an access token is decoded without reaching the
+        introspection endpoint, and the realm keys are fetched once
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["certs"], json=realm_certs, status=200)
+            token_info = kc_client.decode_token(access_token_factory())
+            kc_client.decode_token(access_token_factory())
+            assert len(rsps.calls) == 1
+
+        assert token_info["sub"] == "user-id"
+        assert token_info["username"] == "some_user"
+        assert token_info["active"]
+
+    def test_is_user_admin_locally(
+            self,
+            realm_certs,
+            access_token_factory
+    ):
+        """
+        Test that the admin role is checked from the access token claims
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["certs"], json=realm_certs, status=200)
+            assert not kc_client.is_user_admin(access_token_factory())
+            assert kc_client.is_user_admin(
+                access_token_factory(realm_access={"roles": ["Administrator"]})
+            )
+
+    def test_expired_access_token(
+            self,
+            realm_certs,
+            access_token_factory
+    ):
+        """
+        Test that an expired access token is refused
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["certs"], json=realm_certs, status=200)
+            with pytest.raises(AuthenticationError):
+                kc_client.decode_token(access_token_factory(expires_in=-60))
+            assert not kc_client.is_token_valid(
+                access_token_factory(expires_in=-60), None, None,
+                tok_type='access_token', with_permissions=False
+            )
+
+    def test_access_token_other_audience(
+            self,
+            realm_certs,
+            access_token_factory
+    ):
+        """
+        Test that an access token issued for another client is refused
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["certs"], json=realm_certs, status=200)
+            with pytest.raises(AuthenticationError):
+                kc_client.decode_token(access_token_factory(azp="another_client"))
+
+    def test_unknown_key_id_refreshes_keys(
+            self,
+            realm_certs,
+            access_token_factory
+    ):
+        """
+        Test that a token signed with an unknown key id, i.e.
+        after a key rotation, triggers a new fetch of the realm keys
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["certs"], json={"keys": []}, status=200)
+            rsps.add(responses.GET, URLS["certs"], json=realm_certs, status=200)
+            kc_cache.signing_keys_fetched_at = None
+            with pytest.raises(AuthenticationError):
+                kc_client.decode_token(access_token_factory())
+
+            kc_cache.signing_keys_fetched_at = None
+            assert kc_client.decode_token(access_token_factory())["sub"] == "user-id"
+            assert len(rsps.calls) == 2
+
+    def test_refresh_token_uses_introspection(
+            self
+    ):
+        """
+        Test that tokens not signed with the realm keys,
+        i.e. refresh tokens, are still sent to Keycloak
+        """
+        kc_client = Keycloak()
+        refresh_token = jwt.encode(
+            {"typ": "Refresh", "sub": "user-id"}, "a secret key long enough for HS512 signing purposes" * 2, algorithm="HS512"
+        )
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                URLS["validate"],
+                json={"active": True, "sub": "user-id", "username": "some_user"},
+                status=200
+            )
+            assert kc_client.decode_token(refresh_token)["username"] == "some_user"
+
+    def test_introspection_only(
+            self,
+            mocker,
+            access_token_factory
+    ):
+        """
+        Test that setting the validation to introspection
+        sends access tokens to Keycloak
+        """
+        mocker.patch('app.helpers.keycloak.TOKEN_VALIDATION', 'introspection')
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                URLS["validate"],
+                json={"active": True, "sub": "user-id", "username": "some_user"},
+                status=200
+            )
+            assert kc_client.decode_token(access_token_factory())["username"] == "some_user"
+
+
+class TestTokenIdentity:
+    """
+    Collection of tests for the request-scoped token decoding
+    """
+    def test_token_decoded_once_per_request(
+            self,
+            mocker,
+            client,
+            simple_admin_header
+    ):
+        """
+        Test that auth and audit share the decoded token
+        """
+        decode_spy = mocker.spy(Keycloak, "decode_token")
+        resp = client.get("/datasets/", headers=simple_admin_header)
+        assert resp.status_code == 200, resp.json
+        assert decode_spy.call_count == 1
+
+    def test_identity_from_token_info(
+            self,
+            mocker,
+            client
+    ):
+        """
+        Test that the admin flag is taken from the realm roles
+        without reaching Keycloak
+        """
+        kc_client = Keycloak()
+        mocker.patch.object(kc_client, "decode_token", return_value={
+            "sub": "user-id",
+            "username": "some_user",
+            "realm_access": {"roles": ["Administrator"]}
+        })
+        is_admin_mock = mocker.patch.object(kc_client, "is_user_admin", return_value=False)
+        identity = TokenIdentity.from_request(kc_client, "some token")
+
+        assert identity.sub == "user-id"
+        assert identity.username == "some_user"
+        assert identity.is_admin
+        is_admin_mock.assert_not_called()
+        assert TokenIdentity.from_request(token="some token") is identity
+
+
+class TestPermissionCache:
+    """
+    Collection of tests for the UMA decisions caching
+    """
+    def access_token(self, expires_in:int=300):
+        return jwt.encode(
+            {"exp": datetime.now(tz=timezone.utc) + timedelta(seconds=expires_in), "sub": "user-id"},
+            "a secret key long enough for HS256 signing", algorithm="HS256"
+        )
+
+    def mock_permission_requests(self, rsps:responses.RequestsMock, client_id:str, status:int=200):
+        rsps.add(
+            responses.GET,
+            (URLS["resource"] % client_id) + "?name=some_resource",
+            json=[{"_id": "resource-id"}],
+            status=200
+        )
+        rsps.add(
+            responses.POST,
+            URLS["get_token"],
+            json={"result": status == 200},
+            status=status
+        )
+
+    def test_decision_is_cached(
+            self
+    ):
+        """
+        Test that a positive decision is asked to Keycloak only once
+        """
+        kc_client = Keycloak()
+        token = self.access_token()
+        with responses.RequestsMock() as rsps:
+            self.mock_permission_requests(rsps, kc_client.client_id)
+            assert kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            assert kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            assert len(rsps.calls) == 2
+
+    def test_denied_decision_not_cached(
+            self
+    ):
+        """
+        Test that a negative decision is asked to Keycloak every time
+        """
+        kc_client = Keycloak()
+        token = self.access_token()
+        with responses.RequestsMock() as rsps:
+            self.mock_permission_requests(rsps, kc_client.client_id, status=403)
+            for _ in range(2):
+                with pytest.raises(UnauthorizedError):
+                    kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            assert len(rsps.calls) == 4
+
+    def test_invalidate_by_resource(
+            self
+    ):
+        """
+        Test that invalidating a resource forces a new decision
+        """
+        kc_client = Keycloak()
+        token = self.access_token()
+        with responses.RequestsMock() as rsps:
+            self.mock_permission_requests(rsps, kc_client.client_id)
+            kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            permission_cache.invalidate(resource="another_resource")
+            kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            assert len(rsps.calls) == 2
+
+            permission_cache.invalidate(resource="some_resource")
+            kc_client.check_permissions(token, "can_exec_task", "some_resource", True)
+            assert len(rsps.calls) == 4
+
+    def test_expired_token_not_cached(
+            self
+    ):
+        """
+        Test that decisions do not outlive the token
+        """
+        cache = PermissionCache()
+        key = PermissionCache.get_key("token", "scope", "resource", "global")
+        cache.allow(key, self.access_token(expires_in=-10), "global", "resource")
+        assert not cache.is_allowed(key)
+
+    def test_lru_eviction(
+            self
+    ):
+        """
+        Test that the least recently used decision is dropped
+        when the cache is full
+        """
+        cache = PermissionCache(max_size=2)
+        token = self.access_token()
+        keys = [PermissionCache.get_key(token, "scope", f"resource{i}", "global") for i in range(3)]
+        cache.allow(keys[0], token, "global", "resource0")
+        cache.allow(keys[1], token, "global", "resource1")
+        assert cache.is_allowed(keys[0])
+        cache.allow(keys[2], token, "global", "resource2")
+
+        assert cache.is_allowed(keys[0])
+        assert not cache.is_allowed(keys[1])
+        assert cache.is_allowed(keys[2])
+
+
+class TestKeycloakSession:
+    """
+    Collection of tests for the shared Keycloak HTTP transport
+    """
+    def test_default_timeout(
+            self,
+            mocker
+    ):
+        """
+        Test that every request gets a timeout unless one is given
+        """
+        mock_request = mocker.patch.object(requests.Session, "request")
+        kc_session.get(URLS["health_check"])
+        assert mock_request.call_args.kwargs["timeout"] == 30
+
+        kc_session.get(URLS["health_check"], timeout=5)
+        assert mock_request.call_args.kwargs["timeout"] == 5
+
+    def test_latency_is_recorded_per_endpoint(
+            self
+    ):
+        """
+        Test that calls to the same endpoint with different
+        ids are grouped together
+        """
+        session = KeycloakSession()
+        with responses.RequestsMock() as rsps:
+            for user_id in ["1d5d4a7e-8a3b-4b0e-9a3f-2c1f4b6a7d8e", "2e6e5b8f-9b4c-4c1f-8b4a-3d2a5c7b8e9f"]:
+                rsps.add(responses.GET, URLS["user"] + f"/{user_id}", json={}, status=200)
+                session.get(URLS["user"] + f"/{user_id}")
+
+        assert len(session.stats) == 1
+        endpoint, stat = list(session.stats.items())[0]
+        assert endpoint.startswith("GET ")
+        assert endpoint.endswith("/users/{id}")
+        assert stat["count"] == 2
+        assert stat["max_seconds"] <= stat["total_seconds"]
+
+    def test_unauthorized_drops_admin_token(
+            self
+    ):
+        """
+        Test that an admin token rejected by Keycloak is not reused
+        """
+        kc_cache.set_admin_token("admin token", 300)
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["roles"], status=401)
+            kc_session.get(URLS["roles"], headers={"Authorization": "Bearer admin token"})
+
+        assert kc_cache.get_admin_token() is None
+
+    def test_unauthorized_keeps_other_admin_token(
+            self
+    ):
+        """
+        Test that a 401 on a user's token does not affect the admin token
+        """
+        kc_cache.set_admin_token("admin token", 300)
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, URLS["roles"], status=401)
+            kc_session.get(URLS["roles"], headers={"Authorization": "Bearer user token"})
+
+        assert kc_cache.get_admin_token() == "admin token"
+
+
+class TestUserCache:
+    """
+    Collection of tests to make sure users' lookups are
+        cached, and dropped when the user changes
+    """
+    user = {"id": "1d5d4a7e-8a3b-4b0e-9a3f-2c1f4b6a7d8e", "username": "user@test.com", "email": "user@test.com"}
+
+    def test_user_by_username_is_cached(
+            self
+    ):
+        """
+        Test that looking up the same user twice only
+        reaches Keycloak once, and the cached value can't be altered
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                f'{URLS["user"]}?username={self.user["username"]}&exact=True',
+                json=[self.user],
+                status=200
+            )
+            kc_client.get_user_by_username(self.user["username"])["password"] = "changed"
+            assert kc_client.get_user_by_username(self.user["username"]) == self.user
+            assert len(rsps.calls) == 1
+
+    def test_missing_user_is_cached(
+            self
+    ):
+        """
+        Test that a user not found is cached too
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                f'{URLS["user"]}?email=missing@test.com&exact=True',
+                json=[],
+                status=200
+            )
+            assert kc_client.get_user_by_email("missing@test.com") is None
+            assert kc_client.get_user_by_email("missing@test.com") is None
+            assert len(rsps.calls) == 1
+
+    def test_errors_are_not_cached(
+            self
+    ):
+        """
+        Test that a failed lookup is tried again
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                URLS["user_role"] % self.user["id"],
+                status=500
+            )
+            for _ in range(2):
+                with pytest.raises(KeycloakError):
+                    kc_client.get_user_role(self.user["id"])
+            assert len(rsps.calls) == 2
+
+    def test_role_assignment_invalidates_roles(
+            self
+    ):
+        """
+        Test that assigning a role drops the cached user's roles
+        """
+        kc_client = Keycloak()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                URLS["user_role"] % self.user["id"],
+                json=[{"name": "Users"}],
+                status=200
+            )
+            rsps.add(
+                responses.POST,
+                URLS["user_role"] % self.user["id"],
+                status=204
+            )
+            kc_client.get_user_role(self.user["id"])
+            kc_client.assign_role_to_user(self.user["id"], {"name": "Administrator", "id": "role-id"})
+            kc_client.get_user_role(self.user["id"])
+            role_lookups = [call for call in rsps.calls if call.request.method == responses.GET]
+            assert len(role_lookups) == 2
+
+    def test_invalidate_by_id_drops_other_lookups(
+            self
+    ):
+        """
+        Test that invalidating a user by id also drops
+        the lookups by username and email
+        """
+        cache = UserCache()
+        cache.set("username", self.user["username"], self.user)
+        cache.set("email", self.user["email"], self.user)
+        cache.set("id", self.user["id"], self.user)
+        cache.set("username", "another@test.com", {"id": "another", "username": "another@test.com"})
+
+        cache.invalidate(user_id=self.user["id"])
+        assert not cache.get("username", self.user["username"])[0]
+        assert not cache.get("email", self.user["email"])[0]
+        assert not cache.get("id", self.user["id"])[0]
+        assert cache.get("username", "another@test.com")[0]
+
+    def test_entries_expire(
+            self
+    ):
+        """
+        Test that users are fetched again after the TTL
+        and missing users after the negative TTL
+        """
+        cache = UserCache(ttl=60, negative_ttl=0)
+        cache.set("email", "missing@test.com", None)
+        cache.set("id", self.user["id"], self.user)
+        assert cache.get("email", "missing@test.com") == (False, None)
+        assert cache.get("id", self.user["id"]) == (True, self.user)
+
+        cache = UserCache(ttl=-1)
+        cache.set("id", self.user["id"], self.user)
+        assert cache.get("id", self.user["id"]) == (False, None)
+
+
+class TestExchangedTokenCache:
+    """
+    Collection of tests to make sure project tokens are
+        exchanged once per global token
+    """
+    def token(self, expires_in:int=300, **claims) -> str:
+        return jwt.encode(
+            {"exp": int(datetime.now(timezone.utc).timestamp()) + expires_in, **claims},
+            "secret",
+            algorithm="HS256"
+        )
+
+    def mock_exchange_requests(self, rsps:responses.RequestsMock, exchanged_token:str):
+        rsps.add(
+            responses.POST,
+            URLS["get_token"],
+            json={"access_token": "global access token"},
+            status=200
+        )
+        rsps.add(
+            responses.POST,
+            URLS["get_token"],
+            json={"access_token": exchanged_token, "refresh_token": exchanged_token},
+            status=200
+        )
+
+    def test_access_token_is_cached(
+            self
+    ):
+        """
+        Test that exchanging the same token for the same client
+        only reaches Keycloak once
+        """
+        kc_client = Keycloak()
+        source_token = self.token()
+        exchanged = self.token(project="project")
+        with responses.RequestsMock() as rsps:
+            self.mock_exchange_requests(rsps, exchanged)
+            assert kc_client.exchange_global_token(source_token) == exchanged
+            assert kc_client.exchange_global_token(source_token) == exchanged
+            assert len(rsps.calls) == 2
+
+    def test_refresh_token_is_not_cached(
+            self
+    ):
+        """
+        Test that refresh tokens are always exchanged,
+        as /refresh_token has to return a new one
+        """
+        kc_client = Keycloak()
+        source_token = self.token()
+        with responses.RequestsMock() as rsps:
+            self.mock_exchange_requests(rsps, self.token())
+            self.mock_exchange_requests(rsps, self.token())
+            kc_client.exchange_global_token(source_token, "refresh_token")
+            kc_client.exchange_global_token(source_token, "refresh_token")
+            assert len(rsps.calls) == 4
+
+    def test_expiring_token_is_not_cached(
+            self
+    ):
+        """
+        Test that a token about to expire is exchanged again
+        """
+        kc_client = Keycloak()
+        source_token = self.token()
+        with responses.RequestsMock() as rsps:
+            self.mock_exchange_requests(rsps, self.token(expires_in=10))
+            self.mock_exchange_requests(rsps, self.token(expires_in=10))
+            kc_client.exchange_global_token(source_token)
+            kc_client.exchange_global_token(source_token)
+            assert len(rsps.calls) == 4
+
+    def test_invalidate_client(
+            self
+    ):
+        """
+        Test that dropping a client's tokens does not affect the others
+        """
+        for client_name in ["project1", "project2"]:
+            key = exchanged_token_cache.get_key("source", client_name)
+            exchanged_token_cache.set(key, self.token(), self.token(), client_name)
+
+        exchanged_token_cache.invalidate(client_name="project1")
+        assert exchanged_token_cache.get(exchanged_token_cache.get_key("source", "project1")) is None
+        assert exchanged_token_cache.get(exchanged_token_cache.get_key("source", "project2")) is not None
+
+
+class TestAsyncKeycloak:
+    """
+    Collection of tests for the asyncio interface and its sync bridge
+    """
+    def test_calls_run_concurrently(
+            self
+    ):
+        """
+        Test that the awaited methods run at the same time,
+        and results are returned in order
+        """
+        barrier = threading.Barrier(3, timeout=5)
+        def get_scope(name:str):
+            barrier.wait()
+            return {"name": name}
+
+        kc_client = Mock(get_scope=Mock(side_effect=get_scope))
+        async_kc_client = AsyncKeycloak(kc_client)
+
+        results = run_sync(*[async_kc_client.get_scope(f"scope{i}") for i in range(3)])
+        assert results == [{"name": "scope0"}, {"name": "scope1"}, {"name": "scope2"}]
+
+    def test_attributes_are_not_wrapped(
+            self
+    ):
+        """
+        Test that non-callable attributes are returned as they are
+        """
+        kc_client = Mock(client_name="global")
+        assert AsyncKeycloak(kc_client).client_name == "global"
+
+    def test_errors_are_raised(
+            self
+    ):
+        """
+        Test that an exception in one of the calls is raised by the bridge
+        """
+        kc_client = Mock(get_scope=Mock(side_effect=KeycloakError("Failed to fetch scope")))
+        async_kc_client = AsyncKeycloak(kc_client)
+
+        with pytest.raises(KeycloakError):
+            run_sync(async_kc_client.get_scope("scope"))
@@ -9,16 +9,14 @@ We want to test the creation, deletion and list operations.
     - create_namespaced_job
 """
 
-import errno
 import json
 import pytest
 from kubernetes import client
 from kubernetes.client.exceptions import ApiException
-from tarfile import ReadError
 from unittest import mock
 from unittest.mock import Mock
 
-from app.helpers.exceptions import InvalidRequest, KubernetesException
+from app.helpers.exceptions import InvalidRequest
 from app.helpers.kubernetes import KubernetesClient, KubernetesBatchClient
 from tests.conftest import side_effect
 from app.helpers.task_pod import TaskPod
@@ -189,93 +187,72 @@ class TestKubernetesHelper:
             k8s.delete_pod('pod', namespace)
 
     @mock.patch('kubernetes.stream.ws_client.WSClient')
-    def test_cp_from_pod(
+    def test_stream_from_pod(
         self,
         ws_mock,
-        mocker,
         k8s_config
     ):
         """
-        Tests the successful behaviour of cp_from_pod
+        Tests the tar archive is returned as it's received
         """
         ws_mock.return_value = Mock(
-            is_open=Mock(side_effect=[True, False]),
-            read_stdout=Mock(side_effect=['something']),
-            peek_stderr=Mock(return_value=False),
-            read_stderr=Mock(return_value='')
+            is_open=Mock(side_effect=[True, True, False]),
+            peek_stdout=Mock(side_effect=[b'some', b'thing', b'']),
+            read_stdout=Mock(side_effect=[b'some', b'thing']),
+            peek_stderr=Mock(return_value=False)
         )
-        mocker.patch('app.helpers.kubernetes.shutil')
-        mocker.patch('app.helpers.kubernetes.tarfile').__enter__.return_value = Mock()
-        mocker.patch('app.helpers.kubernetes.TemporaryFile').__enter__.return_value = Mock()
 
         k8s = KubernetesClient()
-        assert k8s.cp_from_pod("pod_name", "/mnt", "/mnt", "host-id-results") == '/tmp/data/host-id-results.zip'
+        request = k8s.api_client.request
+        assert list(k8s.stream_from_pod("pod_name", "/mnt")) == [b'some', b'thing']
+        assert ws_mock.call_args.kwargs["binary"]
+        # The output is not also kept in memory
+        assert ws_mock.call_args.args[3] is False
+        ws_mock.return_value.close.assert_called_once()
+        # The shared client is left as it was
+        assert k8s.api_client.request == request
 
     @mock.patch('kubernetes.stream.ws_client.WSClient')
-    def test_cp_from_pod_fails_temp_files_read(
+    def test_stream_from_pod_connection_failure(
         self,
         ws_mock,
-        mocker,
         k8s_config
     ):
         """
-        Tests reading fails on cp_from_pod
+        Tests failing to exec in the pod raises straight away
         """
-        ws_mock.return_value = Mock(
-            is_open=Mock(side_effect=[True, False]),
-            read_stdout=Mock(side_effect=['something']),
-            peek_stderr=Mock(return_value=False),
-            read_stderr=Mock(return_value='')
-        )
-        mocker.patch('app.helpers.kubernetes.tarfile.open').side_effect = ReadError('file could not be opened successfully')
-        mocker.patch('app.helpers.kubernetes.TemporaryFile').__enter__.return_value = Mock()
+        ws_mock.side_effect = Exception("Handshake status 500")
 
         k8s = KubernetesClient()
-        with pytest.raises(KubernetesException):
-            k8s.cp_from_pod("pod_name", "/mnt", "/mnt", "host-id-results") == '/mnt/host-id-results.tar.gz'
+        with pytest.raises(ApiException):
+            k8s.stream_from_pod("pod_name", "/mnt")
 
-    @mock.patch('kubernetes.stream.ws_client.WSClient')
-    def test_cp_from_pod_fails_zip_creation(
-        self,
-        ws_mock,
-        mocker,
-        k8s_config
-    ):
+
+class TestSharedApiClient:
+    def test_clients_share_api_client(self, k8s_config, mocker):
         """
-        Tests the archive creation fails
+        The config is loaded once, and all of the
+        clients use the same connections pool
         """
-        ws_mock.return_value = Mock(
-            is_open=Mock(side_effect=[True, False]),
-            read_stdout=Mock(side_effect=['something']),
-            peek_stderr=Mock(return_value=False),
-            read_stderr=Mock(return_value='')
-        )
-        mocker.patch('app.helpers.kubernetes.shutil.make_archive').side_effect = NotADirectoryError(errno.ENOTDIR, 'Not a directory', 'path')
-        mocker.patch('app.helpers.kubernetes.TemporaryFile').__enter__.return_value = Mock()
+        load_config = mocker.patch('app.helpers.kubernetes.config.load_kube_config')
+        core = KubernetesClient()
+        batch = KubernetesBatchClient()
+        assert core.api_client is batch.api_client
+        assert KubernetesClient().api_client is core.api_client
+        load_config.assert_called_once()
 
-        k8s = KubernetesClient()
-        with pytest.raises(KubernetesException):
-            k8s.cp_from_pod("pod_name", "/mnt", "/mnt", "host-id-results") == '/mnt/host-id-results.zip'
-
-    @mock.patch('kubernetes.stream.ws_client.WSClient')
-    def test_cp_from_pod_fails_zip_creation_other_exception(
+    @mock.patch('urllib3.PoolManager')
+    def test_default_request_timeout(
         self,
-        ws_mock,
-        mocker,
+        url_mock,
         k8s_config
     ):
         """
-        Tests the archive creation fails
+        Requests without a timeout get the default one
         """
-        ws_mock.return_value = Mock(
-            is_open=Mock(side_effect=[True, False]),
-            read_stdout=Mock(side_effect=['something']),
-            peek_stderr=Mock(return_value=False),
-            read_stderr=Mock(return_value='')
-        )
-        mocker.patch('app.helpers.kubernetes.shutil.make_archive').side_effect = KeyError()
-        mocker.patch('app.helpers.kubernetes.TemporaryFile').__enter__.return_value = Mock()
-
-        k8s = KubernetesClient()
-        with pytest.raises(KubernetesException):
-            k8s.cp_from_pod("pod_name", "/mnt", "/mnt", "host-id-results") == '/mnt/host-id-results.zip'
+        url_mock.return_value.request.side_effect = side_effect({
+            "url": "/namespaces/tasks/pod",
+            "body": json.dumps({"items": []}).encode()
+        })
+        KubernetesClient().list_namespaced_pod("tasks")
+        assert url_mock.return_value.request.call_args.kwargs["timeout"] is not None
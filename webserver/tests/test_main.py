@@ -1,5 +1,10 @@
+import json
+import orjson
 import os
 import responses
+import uuid
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
 from unittest import mock
 from requests.exceptions import ConnectionError
 from app.helpers.keycloak import URLS
@@ -111,3 +116,32 @@ class TestTokenRefresh:
                 headers={"Authorization": f"Bearer {invalid_token}"}
             )
         assert resp.status_code == 401
+
+
+class TestJSONProvider:
+    def test_same_output_as_default_provider(self, client):
+        """
+        The fast encoder should render exactly what the default
+        Flask one does, including datetimes and non-ASCII characters
+        """
+        body = {
+            "b": [1, None, True, {"time": datetime(2024, 1, 2, 3, 4, 5)}],
+            "a": uuid.UUID(int=5),
+            "c": "àèì 😀"
+        }
+        with client.application.app_context():
+            fast = client.application.json.response(body).get_data()
+            default = DefaultJSONProvider(client.application).response(body).get_data()
+        assert fast == default
+
+    def test_responses_use_orjson(self, client, mocker):
+        """
+        The responses are encoded by orjson, not the default provider
+        """
+        orjson_dumps = mocker.patch("app.fn_flask.orjson.dumps", wraps=orjson.dumps)
+        default_dumps = mocker.spy(DefaultJSONProvider, "dumps")
+        with client.application.app_context():
+            resp = client.application.json.response({"a": 1})
+        assert resp.get_data() == b'{"a":1}\n'
+        orjson_dumps.assert_called_once()
+        default_dumps.assert_not_called()
@@ -1,3 +1,5 @@
+import re
+from app.helpers.audit_writer import audit_writer
 from app.models.dataset import Dataset
 
 
@@ -55,3 +57,195 @@ class TestPagination:
 
         assert resp.status_code == 400
         assert resp.json["error"] == "page and per_page parameters should be integers"
+
+    def test_cursor_pagination(
+            self,
+            client,
+            k8s_client,
+            user_uuid,
+            dataset,
+            dataset_oracle,
+            simple_admin_header
+        ):
+        """
+        Test that following the next cursor goes through
+        all of the results once, and stops at the last page
+        """
+        Dataset(
+            name="testnew",
+            host="host.url",
+            username="user",
+            password="pass"
+        ).add(user_id=user_uuid)
+
+        ids = []
+        query = {"limit": "2"}
+        for _ in range(2):
+            resp = client.get('/datasets', query_string=query, headers=simple_admin_header)
+            assert resp.status_code == 200
+            assert resp.json["limit"] == 2
+            assert "total" not in resp.json
+            ids += [ds["id"] for ds in resp.json["items"]]
+            query["after"] = resp.json["next"]
+
+        assert query["after"] is None
+        assert len(ids) == 3
+        assert ids == sorted(ids)
+
+    def test_cursor_pagination_with_filters(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that filters are applied together with the cursor
+        """
+        for _ in range(3):
+            client.get('/datasets', headers=simple_admin_header)
+        audit_writer.flush()
+
+        resp = client.get(
+            '/audit',
+            query_string={"limit": "2", "endpoint": "/datasets"},
+            headers=simple_admin_header
+        )
+        assert resp.status_code == 200
+        assert len(resp.json["items"]) == 2
+        assert all(item["endpoint"] == "/datasets" for item in resp.json["items"])
+
+        resp = client.get(
+            '/audit',
+            query_string={"limit": "2", "endpoint": "/datasets", "after": resp.json["next"]},
+            headers=simple_admin_header
+        )
+        assert len(resp.json["items"]) == 1
+        assert resp.json["next"] is None
+
+    def test_cursor_pagination_invalid_values(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that malformed cursors and limits are rejected
+        """
+        for query in [{"after": "notacursor"}, {"limit": "asdf"}, {"limit": "0"}]:
+            resp = client.get('/datasets', query_string=query, headers=simple_admin_header)
+            assert resp.status_code == 400
+
+    def test_pagination_count_modes(
+            self,
+            client,
+            dataset,
+            simple_admin_header
+        ):
+        """
+        Test that count=none omits the totals, and count=estimate
+        still returns them
+        """
+        resp = client.get('/datasets', query_string={"count": "none"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert "total" not in resp.json
+        assert "pages" not in resp.json
+        assert len(resp.json["items"]) == 1
+
+        resp = client.get('/datasets', query_string={"count": "estimate"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert isinstance(resp.json["total"], int)
+        assert isinstance(resp.json["pages"], int)
+
+        resp = client.get('/datasets', query_string={"count": "exact"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["total"] == 1
+
+    def test_pagination_count_modes_with_filters(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that the count parameter is not used as a filter
+        """
+        client.get('/datasets', headers=simple_admin_header)
+        audit_writer.flush()
+
+        resp = client.get(
+            '/audit',
+            query_string={"count": "none", "endpoint": "/datasets"},
+            headers=simple_admin_header
+        )
+        assert resp.status_code == 200
+        assert "total" not in resp.json
+        assert all(item["endpoint"] == "/datasets" for item in resp.json["items"])
+
+    def test_pagination_invalid_count(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that unsupported count modes are rejected
+        """
+        resp = client.get('/datasets', query_string={"count": "maybe"}, headers=simple_admin_header)
+        assert resp.status_code == 400
+
+    def test_pagination_sparse_fields(
+            self,
+            client,
+            dataset,
+            simple_admin_header
+        ):
+        """
+        Test that only the requested fields are returned,
+        with both offset and cursor pagination
+        """
+        resp = client.get('/datasets', query_string={"fields": "id,name"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert set(resp.json["items"][0].keys()) == {"id", "name", "slug", "url"}
+
+        resp = client.get('/datasets', query_string={"fields": "id", "limit": "1"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        assert resp.json["items"] == [{"id": dataset.id}]
+
+    def test_pagination_sparse_fields_with_filters(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that the fields parameter is not used as a filter,
+        and that unknown fields are rejected
+        """
+        client.get('/datasets', headers=simple_admin_header)
+        audit_writer.flush()
+
+        resp = client.get(
+            '/audit',
+            query_string={"fields": "id,endpoint", "endpoint": "/datasets"},
+            headers=simple_admin_header
+        )
+        assert resp.status_code == 200
+        assert resp.json["items"]
+        for item in resp.json["items"]:
+            assert set(item.keys()) == {"id", "endpoint"}
+
+        resp = client.get('/audit', query_string={"fields": "id,password"}, headers=simple_admin_header)
+        assert resp.status_code == 400
+
+    def test_pagination_serialized_values(
+            self,
+            client,
+            simple_admin_header
+        ):
+        """
+        Test that the values are rendered according to the column type
+        """
+        client.get('/datasets', headers=simple_admin_header)
+        audit_writer.flush()
+
+        resp = client.get('/audit', query_string={"per_page": "500"}, headers=simple_admin_header)
+        assert resp.status_code == 200
+        item = resp.json["items"][0]
+        assert isinstance(item["id"], int)
+        assert isinstance(item["status_code"], int)
+        assert re.match(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$', item["event_time"])
@@ -0,0 +1,173 @@
+import time
+from datetime import datetime
+from unittest.mock import Mock
+from kubernetes.client.exceptions import ApiException
+
+from app.helpers.pod_cache import PodCache
+from tests.fixtures.azure_cr_fixtures import *
+
+
+def build_pod(name:str, task_id:str, image:str="some_image") -> Mock:
+    pod = Mock()
+    pod.metadata.name = name
+    pod.metadata.labels = {"task_id": task_id}
+    pod.metadata.creation_timestamp = datetime.now()
+    pod.spec.containers = [Mock(image=image)]
+    pod.status.container_statuses = None
+    return pod
+
+
+class TestPodCache:
+    def test_list_indexes_by_task_id(self):
+        """
+        Listing replaces the cached pods, by task_id
+        """
+        cache = PodCache(namespace="tasks")
+        v1 = Mock()
+        v1.list_namespaced_pod.return_value = Mock(
+            items=[build_pod("pod1", "1"), build_pod("pod2", "1"), build_pod("pod3", "2")],
+            metadata=Mock(resource_version="100")
+        )
+        assert cache._list(v1) == "100"
+        v1.list_namespaced_pod.assert_called_once_with("tasks", label_selector="task_id")
+
+        cache.start = Mock()
+        assert sorted(pod.metadata.name for pod in cache.get_pods(1)) == ["pod1", "pod2"]
+        assert [pod.metadata.name for pod in cache.get_pods(2)] == ["pod3"]
+        assert cache.get_pods(3) == []
+
+    def test_relist_notifies_deleted_pods(self):
+        """
+        Pods gone from a new list, e.g. deleted while the watch
+        was down, are notified as DELETED, before the listed ones
+        """
+        cache = PodCache()
+        kept_pod, deleted_pod = build_pod("pod1", "1"), build_pod("pod2", "2")
+        cache.apply_event("ADDED", kept_pod)
+        cache.apply_event("ADDED", deleted_pod)
+        events = []
+        cache.subscribe(lambda event_type, pod: events.append((event_type, pod.metadata.name)))
+
+        v1 = Mock()
+        v1.list_namespaced_pod.return_value = Mock(items=[kept_pod], metadata=Mock(resource_version="100"))
+        cache._list(v1)
+        assert events == [("DELETED", "pod2"), ("ADDED", "pod1")]
+
+    def test_watch_events(self):
+        """
+        Added and modified pods are updated, deleted ones removed
+        """
+        cache = PodCache()
+        cache.start = Mock()
+        pod = build_pod("pod1", "1")
+        cache.apply_event("ADDED", pod)
+        assert cache.get_pods(1) == [pod]
+
+        updated_pod = build_pod("pod1", "1")
+        cache.apply_event("MODIFIED", updated_pod)
+        assert cache.get_pods(1) == [updated_pod]
+
+        cache.apply_event("DELETED", updated_pod)
+        assert cache.get_pods(1) == []
+
+    def test_stale_cache_is_a_miss(self):
+        """
+        If the API server hasn't been heard from for too long,
+        or ever, the cache can't be used
+        """
+        cache = PodCache(max_staleness=10)
+        cache.start = Mock()
+        assert cache.get_pods(1) is None
+
+        cache.apply_event("ADDED", build_pod("pod1", "1"))
+        assert len(cache.get_pods(1)) == 1
+
+        cache.last_sync = time.monotonic() - 11
+        assert cache.get_pods(1) is None
+
+    def test_disabled(self):
+        cache = PodCache(enabled=False)
+        cache.start = Mock()
+        cache.apply_event("ADDED", build_pod("pod1", "1"))
+        assert cache.get_pods(1) is None
+        cache.start.assert_not_called()
+
+    def test_watch_resumes_from_resource_version(self, mocker):
+        """
+        The watch starts from the list's resource version,
+        and returns the last one seen to resume from
+        """
+        cache = PodCache(namespace="tasks")
+        pod = build_pod("pod1", "1")
+        watcher = Mock(resource_version="105")
+        watcher.stream.return_value = [{"type": "ADDED", "object": pod}]
+        mocker.patch("app.helpers.pod_cache.Watch", return_value=watcher)
+
+        v1 = Mock()
+        assert cache._watch(v1, "100") == "105"
+        assert watcher.stream.call_args.kwargs["resource_version"] == "100"
+        cache.start = Mock()
+        assert cache.get_pods(1) == [pod]
+
+    def test_watch_error_event_lists_again(self, mocker):
+        cache = PodCache()
+        watcher = Mock()
+        watcher.stream.return_value = [{"type": "ERROR", "object": None, "raw_object": {"code": 500}}]
+        mocker.patch("app.helpers.pod_cache.Watch", return_value=watcher)
+        assert cache._watch(Mock(), "100") is None
+
+    def test_expired_watch_lists_again(self, mocker):
+        """
+        A 410 from the watch means the resource version is too old,
+        the pods are listed again straight away
+        """
+        cache = PodCache()
+        mocker.patch("app.helpers.pod_cache.KubernetesClient")
+        mocker.patch.object(cache, "_list", side_effect=["100", "200", KeyboardInterrupt()])
+        mocker.patch.object(cache, "_watch", side_effect=ApiException(status=410))
+        sleep = mocker.patch("app.helpers.pod_cache.time.sleep")
+        try:
+            cache._run()
+        except KeyboardInterrupt:
+            pass
+        assert cache._list.call_count == 3
+        sleep.assert_not_called()
+
+
+class TestTaskPodFromCache:
+    def test_get_current_pod_from_cache(
+            self,
+            client,
+            task,
+            k8s_client,
+            mocker
+        ):
+        """
+        With a fresh cache, the API server is not called
+        """
+        pod = build_pod("pod1", str(task.id), task.docker_image)
+        mocker.patch("app.models.task.pod_cache.get_pods", return_value=[pod])
+        k8s_client["list_namespaced_pod_mock"].reset_mock()
+
+        assert task.get_current_pod() is pod
+        k8s_client["list_namespaced_pod_mock"].assert_not_called()
+
+    def test_get_current_pod_stale_cache(
+            self,
+            client,
+            task,
+            k8s_client,
+            mocker
+        ):
+        """
+        With a stale cache, or when asked not to use it,
+        the pods are listed from the API server
+        """
+        get_pods = mocker.patch("app.models.task.pod_cache.get_pods", return_value=None)
+        k8s_client["list_namespaced_pod_mock"].reset_mock()
+        task.get_current_pod()
+        k8s_client["list_namespaced_pod_mock"].assert_called_once()
+
+        get_pods.return_value = []
+        task.get_current_pod(cached=False)
+        assert k8s_client["list_namespaced_pod_mock"].call_count == 2
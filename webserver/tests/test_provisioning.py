@@ -0,0 +1,95 @@
+import threading
+import pytest
+from app.helpers.exceptions import KeycloakError
+from app.helpers.provisioning import ProvisioningPlan
+
+
+class TestProvisioningPlan:
+    def test_steps_get_dependencies_results(
+            self
+    ):
+        """
+        Test that each step receives the results of its dependencies
+        """
+        plan = ProvisioningPlan("test")
+        plan.add_step("first", lambda _: 1)
+        plan.add_step("second", lambda res: res["first"] + 1, ["first"])
+        plan.add_step("third", lambda res: res["first"] + res["second"], ["first", "second"])
+        assert plan.run() == {"first": 1, "second": 2, "third": 3}
+
+    def test_independent_steps_run_concurrently(
+            self
+    ):
+        """
+        Test that steps with no dependencies between them
+        run at the same time
+        """
+        barrier = threading.Barrier(3, timeout=5)
+        plan = ProvisioningPlan("test")
+        for step in range(3):
+            plan.add_step(f"step {step}", lambda _: barrier.wait())
+        assert len(plan.run()) == 3
+
+    def test_completed_steps_rolled_back_on_failure(
+            self
+    ):
+        """
+        Test that a failure rolls back the completed steps
+        in reverse order, and skips the dependent ones
+        """
+        rolled_back = []
+        def failing_step(_):
+            raise KeycloakError("error")
+
+        plan = ProvisioningPlan("test")
+        plan.add_step("client", lambda _: "client", rollback=rolled_back.append)
+        plan.add_step("scope", lambda _: "scope", ["client"], rollback=rolled_back.append)
+        plan.add_step("policy", failing_step, ["scope"])
+        plan.add_step("permission", lambda _: pytest.fail("Should not run"), ["policy"])
+
+        with pytest.raises(KeycloakError):
+            plan.run()
+        assert rolled_back == ["scope", "client"]
+
+    def test_rollback_failures_do_not_stop_rollback(
+            self
+    ):
+        """
+        Test that a failing rollback does not prevent
+        the others, and the original error is raised
+        """
+        rolled_back = []
+        def failing_rollback(_):
+            raise KeycloakError("rollback error")
+
+        plan = ProvisioningPlan("test")
+        plan.add_step("client", lambda _: "client", rollback=rolled_back.append)
+        plan.add_step("scope", lambda _: "scope", ["client"], rollback=failing_rollback)
+        plan.add_step("policy", lambda _: 1 / 0, ["scope"])
+
+        with pytest.raises(ZeroDivisionError):
+            plan.run()
+        assert rolled_back == ["client"]
+
+    def test_unknown_dependency(
+            self
+    ):
+        """
+        Test that a plan depending on a missing step is rejected
+        """
+        plan = ProvisioningPlan("test")
+        plan.add_step("scope", lambda _: "scope", ["client"])
+        with pytest.raises(ValueError):
+            plan.run()
+
+    def test_circular_dependency(
+            self
+    ):
+        """
+        Test that a plan with a cycle is rejected
+        """
+        plan = ProvisioningPlan("test")
+        plan.add_step("first", lambda _: 1, ["second"])
+        plan.add_step("second", lambda _: 2, ["first"])
+        with pytest.raises(ValueError):
+            plan.run()
@@ -0,0 +1,162 @@
+from datetime import datetime, timezone
+from unittest.mock import Mock
+from sqlalchemy import inspect
+
+from app.helpers.base_model import db
+from app.helpers.task_reconciler import TaskReconciler, get_pod_state
+from app.models.task import Task
+from tests.fixtures.azure_cr_fixtures import *
+
+
+def build_pod(task_id:str, status:str=None, **state) -> Mock:
+    pod = Mock()
+    pod.metadata.labels = {"task_id": task_id}
+    if status is None:
+        pod.status.container_statuses = None
+        return pod
+
+    container_state = Mock(running=None, waiting=None, terminated=None)
+    setattr(container_state, status, Mock(**state))
+    pod.status.container_statuses = [Mock(state=container_state)]
+    return pod
+
+
+class TestGetPodState:
+    def test_not_created(self):
+        assert get_pod_state(build_pod("1")) is None
+
+    def test_terminated(self):
+        started = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+        finished = datetime(2026, 1, 1, 11, tzinfo=timezone.utc)
+        pod = build_pod(
+            "1", "terminated",
+            started_at=started,
+            finished_at=finished,
+            exit_code=1,
+            reason="Error"
+        )
+        assert get_pod_state(pod) == {
+            "status": "terminated",
+            "started_at": datetime(2026, 1, 1, 10),
+            "finished_at": datetime(2026, 1, 1, 11),
+            "exit_code": 1,
+            "status_reason": "Error"
+        }
+
+
+class TestTaskReconciler:
+    def test_ignores_pods_without_task(self):
+        reconciler = TaskReconciler()
+        pod = build_pod("1")
+        pod.metadata.labels = {}
+        reconciler.on_pod_event("ADDED", pod)
+        assert reconciler.queue.empty()
+
+        reconciler.on_pod_event("ADDED", build_pod("1"))
+        assert reconciler.queue.get_nowait()[0] == 1
+
+    def test_disabled_does_not_start(self, mocker):
+        start = mocker.patch("app.helpers.task_reconciler.pod_cache.start")
+        reconciler = TaskReconciler(enabled=False)
+        reconciler.start()
+        assert reconciler.thread is None
+        assert not reconciler.is_current()
+        start.assert_not_called()
+
+    def test_write_latest_state(self, client, task):
+        """
+        Only the last event of the batch is written
+        """
+        TaskReconciler().write([
+            (task.id, "ADDED", build_pod(str(task.id), "waiting", reason="ContainerCreating")),
+            (task.id, "MODIFIED", build_pod(str(task.id), "running", started_at=datetime(2026, 1, 1, 10))),
+            (task.id, "MODIFIED", build_pod(
+                str(task.id), "terminated",
+                started_at=datetime(2026, 1, 1, 10),
+                finished_at=datetime(2026, 1, 1, 11),
+                exit_code=0,
+                reason="Completed"
+            ))
+        ])
+        db.session.expire_all()
+        updated = db.session.get(Task, task.id)
+        assert updated.status == "terminated"
+        assert updated.exit_code == 0
+        assert updated.status_reason == "Completed"
+        assert updated.get_stored_status() == {
+            "terminated": {
+                "started_at": datetime(2026, 1, 1, 10),
+                "finished_at": datetime(2026, 1, 1, 11),
+                "exit_code": 0,
+                "reason": "Completed"
+            }
+        }
+
+    def test_write_does_not_overwrite_cancelled(self, client, task):
+        task.status = "cancelled"
+        db.session.commit()
+
+        TaskReconciler().write([
+            (task.id, "MODIFIED", build_pod(str(task.id), "running", started_at=datetime(2026, 1, 1, 10)))
+        ])
+        db.session.expire_all()
+        assert db.session.get(Task, task.id).status == "cancelled"
+
+    def test_write_without_status(self, client, task):
+        """
+        Tasks without a status are updated too
+        """
+        task.status = None
+        db.session.commit()
+
+        TaskReconciler().write([
+            (task.id, "MODIFIED", build_pod(str(task.id), "running", started_at=datetime(2026, 1, 1, 10)))
+        ])
+        db.session.expire_all()
+        assert db.session.get(Task, task.id).status == "running"
+
+    def test_write_deleted_pod(self, client, task):
+        task.status = "running"
+        db.session.commit()
+
+        TaskReconciler().write([(task.id, "DELETED", build_pod(str(task.id)))])
+        db.session.expire_all()
+        assert db.session.get(Task, task.id).status == "deleted"
+
+    def test_status_from_db(self, client, task, mocker):
+        """
+        With the reconciler up to date, the status
+        is not read from the pods
+        """
+        mocker.patch("app.models.task.task_reconciler.is_current", return_value=True)
+        get_status = mocker.patch.object(Task, "get_status")
+        task.status = "running"
+        task.started_at = datetime(2026, 1, 1, 10)
+
+        assert task.sanitized_dict()["status"] == {"running": {"started_at": datetime(2026, 1, 1, 10)}}
+        get_status.assert_not_called()
+        assert "started_at" not in task.sanitized_dict()
+
+    def test_waiting_status_from_db(self, client, task, mocker):
+        """
+        A waiting task is rendered as the bare status,
+        as when it's read from the pods
+        """
+        mocker.patch("app.models.task.task_reconciler.is_current", return_value=True)
+        task.status = "waiting"
+        task.status_reason = "ContainerCreating"
+
+        assert task.sanitized_dict()["status"] == "waiting"
+
+    def test_status_field_loads_its_columns(self, client, task):
+        """
+        Selecting only the status loads the columns it's built from,
+        so they are not lazy loaded one task at a time
+        """
+        db.session.expunge_all()
+        loaded = Task.load_fields(Task.query.filter(Task.id == task.id), ["id", "status"]).one()
+        unloaded = inspect(loaded).unloaded
+
+        assert "description" in unloaded
+        for column in ["docker_image", "started_at", "finished_at", "exit_code", "status_reason"]:
+            assert column not in unloaded
@@ -3,8 +3,10 @@ import pytest
 from datetime import datetime, timedelta
 import json
 from unittest import mock
+from uuid import uuid4
 from app.models.request import Request
 from app.helpers.exceptions import KeycloakError
+from app.helpers.keycloak import Keycloak
 
 @pytest.fixture
 def kc_user_mock(mocker, user_uuid):
@@ -267,3 +269,30 @@ class TestTransfers:
             Request.title == request_base_body["title"],
             Request.project_name == request_base_body["project_name"],
         ).count() == 0
+
+    def test_transfer_new_client_deleted_if_exception_raised(
+            self,
+            client,
+            post_json_admin_header,
+            kc_user_mock,
+            basic_user,
+            request_base_body,
+            mocker
+        ):
+        """
+        Tests that a project client created during approve()
+        is removed if one of the following steps fails
+        """
+        request_base_body["project_name"] = f"project-{uuid4()}"
+        client_name = f"Request {basic_user["email"]} - {request_base_body["project_name"]}"
+
+        mocker.patch("app.helpers.keycloak.Keycloak.create_permission",
+                     side_effect=KeycloakError("error"))
+
+        response = client.post(
+            "/datasets/token_transfer",
+            headers=post_json_admin_header,
+            data=json.dumps(request_base_body)
+        )
+        assert response.status_code == 500
+        assert not Keycloak().client_exists(client_name)
@@ -41,6 +41,88 @@ class TestGetUsers(UserMixin):
         assert len(resp.json) == 1
         assert resp.json[0]['email'] == new_user_email
 
+    def test_get_users_paginated(
+        self,
+        client,
+        simple_admin_header,
+        new_user,
+        basic_user
+    ):
+        """
+        Tests that page and per_page are applied to the list of users,
+        and the backend user is not counted
+        """
+        emails = set()
+        for page in [1, 2]:
+            resp = client.get(
+                "/users",
+                query_string={"page": page, "per_page": 1},
+                headers=simple_admin_header
+            )
+            assert resp.status_code == 200
+            assert resp.json["page"] == page
+            assert resp.json["per_page"] == 1
+            assert resp.json["total"] == 2
+            assert resp.json["pages"] == 2
+            assert len(resp.json["items"]) == 1
+            emails.update(user["email"] for user in resp.json["items"])
+            assert all(user["role"] for user in resp.json["items"])
+
+        assert emails == {new_user["email"], basic_user["email"]}
+
+    def test_get_users_page_around_admin(
+        self,
+        client,
+        simple_admin_header,
+        mocker
+    ):
+        """
+        Tests that the pages are full and don't overlap,
+        wherever the backend user is in the list
+        """
+        usernames = ["a", "b", "c", "d"]
+        mocker.patch("app.users_api.KEYCLOAK_ADMIN", "b")
+        mocker.patch(
+            "app.users_api.Keycloak.list_users",
+            side_effect=lambda first, max_results: [
+                {"id": name, "username": name, "email": f"{name}@test.com"}
+                for name in usernames[first:first + max_results]
+            ]
+        )
+        mocker.patch("app.users_api.Keycloak.count_users", return_value=len(usernames))
+        mocker.patch(
+            "app.users_api.Keycloak.get_users_roles",
+            side_effect=lambda user_ids: {user_id: ["Users"] for user_id in user_ids}
+        )
+
+        pages = []
+        for page in [1, 2]:
+            resp = client.get(
+                "/users",
+                query_string={"page": page, "per_page": 2},
+                headers=simple_admin_header
+            )
+            assert resp.status_code == 200
+            assert resp.json["total"] == 3
+            pages.append([user["username"] for user in resp.json["items"]])
+        assert pages == [["a", "c"], ["d"]]
+
+    def test_get_users_invalid_pagination(
+        self,
+        client,
+        simple_admin_header
+    ):
+        """
+        Tests that non-numeric or negative pagination values are rejected
+        """
+        for query in [{"page": "first"}, {"per_page": 0}]:
+            resp = client.get(
+                "/users",
+                query_string=query,
+                headers=simple_admin_header
+            )
+            assert resp.status_code == 400
+
     def test_user_needs_pass_reset_flag_true(
         self,
         client,